@@ -0,0 +1,189 @@
+"""Admission control for expensive endpoints.
+
+Requests are sorted into route classes (PDF renders, exports, reports, plain
+CRUD). Each class has its own concurrency limit and a bounded wait queue, so a
+burst of renders cannot take every slot from interactive calls. When a queue is
+full, or a request waited too long, the client gets a fast 503. A per-client
+token bucket per class answers 429 once a client exceeds its rate. Both
+responses carry `Retry-After`.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_REJECTED, ADMISSION_WAITING, ADMISSION_WAIT_SECONDS
+
+# First match wins; anything unmatched under /api is "crud"
+ROUTE_CLASSES: List[Tuple[str, "re.Pattern"]] = [
+    ("pdf", re.compile(r"^/api/(.+/(pdf|thumbnail)|pdf/.*|thumbnails|letters/mail-merge(/csv)?)$")),
+    ("export", re.compile(r"^/api/.*(export|import|archive$)")),
+    ("report", re.compile(r"^/api/.*reports?(/|$)")),
+    ("crud", re.compile(r"^/api/")),
+]
+# Probes, metrics and long-lived event streams are never queued
+EXEMPT_PATHS = {"/api/health", "/api/ready", "/api/events", "/metrics"}
+
+DEFAULTS = {
+    "pdf": {"concurrency": os.cpu_count() or 2, "queue": 32, "rate": 0.0, "burst": 10},
+    "export": {"concurrency": 2, "queue": 4, "rate": 0.0, "burst": 2},
+    "report": {"concurrency": 4, "queue": 8, "rate": 0.0, "burst": 4},
+    "crud": {"concurrency": 256, "queue": 512, "rate": 0.0, "burst": 50},
+}
+
+
+class RouteLimit:
+    """Concurrency limit with a bounded queue for one route class."""
+
+    def __init__(self, name: str, concurrency: int, queue: int, queue_timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+
+    def full(self) -> bool:
+        return self.semaphore.locked() and self.waiting >= self.queue
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting in the queue up to `queue_timeout`; False if none came free."""
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()
+            return True
+        self.waiting += 1
+        ADMISSION_WAITING.inc(self.name)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+            ADMISSION_WAITING.dec(self.name)
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, self.name)
+
+    def release(self):
+        self.semaphore.release()
+
+
+class TokenBucket:
+    """Per-client token buckets: `rate` requests per second with bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, client: str) -> float:
+        """Spend one token; returns 0 when allowed, else seconds until a token is available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            # Least recently seen clients have refilled the longest; forgetting them is harmless
+            self._buckets.popitem(last=False)
+        return wait
+
+
+def classify(path: str) -> Optional[str]:
+    if path in EXEMPT_PATHS:
+        return None
+    for name, pattern in ROUTE_CLASSES:
+        if pattern.match(path):
+            return name
+    return None
+
+
+def limits_from_env() -> Dict[str, dict]:
+    """Per-class settings from ADMISSION_<CLASS>_{CONCURRENCY,QUEUE,RATE,BURST}."""
+    settings = {}
+    for name, defaults in DEFAULTS.items():
+        settings[name] = {
+            key: type(value)(os.environ.get(f"ADMISSION_{name.upper()}_{key.upper()}", value))
+            for key, value in defaults.items()
+        }
+    return settings
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, limits: Dict[str, dict], queue_timeout: float = 10.0, client_header: str = ""):
+        self.app = app
+        self.limits = {
+            name: RouteLimit(name, config["concurrency"], config["queue"], queue_timeout)
+            for name, config in limits.items() if config["concurrency"] > 0
+        }
+        self.buckets = {
+            name: TokenBucket(config["rate"], max(1, config["burst"]))
+            for name, config in limits.items() if config["rate"] > 0
+        }
+        self.client_header = client_header.lower().encode("latin-1")
+
+    def client_key(self, scope) -> str:
+        if self.client_header:
+            for name, value in scope["headers"]:
+                if name == self.client_header:
+                    # X-Forwarded-For style lists: the first entry is the original client
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else ""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        route_class = classify(scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        bucket = self.buckets.get(route_class)
+        if bucket:
+            wait = bucket.take(self.client_key(scope))
+            if wait:
+                await self.reject(send, route_class, 429, "rate_limited", wait)
+                return
+
+        limit = self.limits.get(route_class)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        if limit.full():
+            await self.reject(send, route_class, 503, "queue_full", limit.queue_timeout)
+            return
+        if not await limit.acquire():
+            await self.reject(send, route_class, 503, "queue_timeout", limit.queue_timeout)
+            return
+        ADMISSION_IN_FLIGHT.inc(route_class)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            ADMISSION_IN_FLIGHT.dec(route_class)
+            limit.release()
+
+    @staticmethod
+    async def reject(send, route_class: str, status: int, reason: str, retry_after: float):
+        ADMISSION_REJECTED.inc(route_class, reason)
+        body = json.dumps({"detail": "Too many requests" if status == 429 else "Server busy, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,207 @@
+"""Soft delete and the archive collections behind the live collections.
+
+Deleting a document only marks it with `deleted_at`, and it can be restored. The
+archive job moves documents out of the live collections into
+`<collection>_archive`: those deleted more than a retention period ago, and
+invoices, quotations and letters dated and last updated before the archive age
+and in a final status (paid invoices; accepted, rejected or converted
+quotations; any letter). Deleted companies stay while any document, live or
+archived, still refers to them, since documents are rendered with their company.
+Archive collections are created with zstd block compression and only carry the
+unique `id` index, so the live collections and their indexes hold the working
+set. Reads include the archive when asked, and restoring an archived document
+moves it back.
+
+    cd backend
+    python -m archive --dry-run
+    python -m archive --older-than-days 730 --deleted-after-days 30
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+ROOT_DIR = Path(__file__).parent
+logger = logging.getLogger("archive")
+# Live collection: statuses after which a document no longer changes (None: any;
+# empty: none, so only deleted documents are archived)
+ARCHIVED_COLLECTIONS = {
+    "invoices": ("paid",),
+    "quotations": ("accepted", "rejected", "converted"),
+    "letters": None,
+    "companies": (),
+    "items": (),
+}
+# Collections whose documents refer to a company by `company_id`
+COMPANY_DOCUMENTS = ("invoices", "quotations", "letters")
+BATCH_SIZE = 500
+# Documents that have not been deleted. Restores unset the field, so it is never null.
+LIVE = {"deleted_at": {"$exists": False}}
+
+
+def archive_name(collection: str) -> str:
+    return f"{collection}_archive"
+
+
+async def ensure_archive_collections(db, compressor: str = "zstd"):
+    """Create the archive collections with `compressor` block compression (an empty
+    string keeps the server default) and their `id` index."""
+    existing = set(await db.list_collection_names())
+    for name in ARCHIVED_COLLECTIONS:
+        archive = archive_name(name)
+        if archive not in existing and compressor:
+            try:
+                await db.create_collection(archive, storageEngine={
+                    "wiredTiger": {"configString": f"block_compressor={compressor}"},
+                })
+            except CollectionInvalid:
+                # Created by another worker starting at the same time
+                pass
+            except (NotImplementedError, OperationFailure) as exc:
+                # Storage engines without WiredTiger options, and in-memory stand-ins
+                logger.warning("Creating %s without %s compression: %s", archive, compressor, exc)
+                try:
+                    await db.create_collection(archive)
+                except CollectionInvalid:
+                    pass
+        await db[archive].create_index("id", unique=True)
+
+
+def archive_filter(collection: str, before: str, deleted_before: str) -> dict:
+    """Documents due for the archive: dated and last updated before `before` (ISO
+    date) and in a final status, or deleted before `deleted_before` (ISO timestamp)."""
+    deleted = {"deleted_at": {"$lt": deleted_before}}
+    statuses = ARCHIVED_COLLECTIONS[collection]
+    if statuses is not None and not statuses:
+        return deleted
+    # A restored or recently edited document is not closed yet
+    closed = {"date": {"$lt": before}, "$or": [{"updated_at": {"$exists": False}}, {"updated_at": {"$lt": before}}]}
+    if statuses:
+        closed["status"] = {"$in": list(statuses)}
+    return {"$or": [closed, deleted]}
+
+
+async def referenced_companies(db) -> list:
+    """Ids of the companies that documents, live or archived, refer to."""
+    ids = set()
+    for name in COMPANY_DOCUMENTS:
+        for collection in (name, archive_name(name)):
+            ids.update(await db[collection].distinct("company_id"))
+    return list(ids)
+
+
+async def move_batch(source, target, documents: list, archived_at: str) -> int:
+    """Copy `documents` into `target`, then delete them from `source` unless they
+    changed in the meantime; returns how many were moved."""
+    await target.bulk_write([
+        ReplaceOne({"id": document["id"]}, {**document, "archived_at": archived_at}, upsert=True)
+        for document in documents
+    ], ordered=False)
+    result = await source.bulk_write([
+        DeleteOne({"id": document["id"], "revision": document.get("revision")}) for document in documents
+    ], ordered=False)
+    if result.deleted_count < len(documents):
+        # Updated while being copied: they stay live, so their copies go
+        kept = [document["id"] async for document in source.find(
+            {"id": {"$in": [document["id"] for document in documents]}}, {"_id": 0, "id": 1})]
+        await target.delete_many({"id": {"$in": kept}})
+    return result.deleted_count
+
+
+async def archive_documents(db, collection: str, query: dict, dry_run: bool = False, batch_size: int = BATCH_SIZE) -> int:
+    """Move the documents matching `query` to the archive, `batch_size` at a time;
+    returns how many were moved (or would be, with dry_run)."""
+    source = db[collection]
+    if dry_run:
+        return await source.count_documents(query)
+    target = db[archive_name(collection)]
+    archived_at = datetime.now(timezone.utc).isoformat()
+    moved = 0
+    while True:
+        documents = await source.find(query, {"_id": 0}).limit(batch_size).to_list(None)
+        if not documents:
+            return moved
+        count = await move_batch(source, target, documents, archived_at)
+        if count == 0:
+            # Every document changed under us; leave them for the next run
+            return moved
+        moved += count
+
+
+async def run_archive(db, older_than_days: int, deleted_after_days: int, dry_run: bool = False) -> Dict[str, int]:
+    """Archive every archived collection; returns the number of documents moved per collection."""
+    now = datetime.now(timezone.utc)
+    before = (now - timedelta(days=older_than_days)).date().isoformat()
+    deleted_before = (now - timedelta(days=deleted_after_days)).isoformat()
+    counts = {}
+    for name in ARCHIVED_COLLECTIONS:
+        query = archive_filter(name, before, deleted_before)
+        if name == "companies":
+            query = {**query, "id": {"$nin": await referenced_companies(db)}}
+        counts[name] = await archive_documents(db, name, query, dry_run)
+    return counts
+
+
+async def restore_document(db, collection: str, doc_id: str, stamp: dict) -> Optional[dict]:
+    """Undelete a document, moving it back from the archive if it was archived, and
+    give it `stamp` (revision and updated_at). Returns it, or None if there is no
+    deleted or archived document with that id."""
+    result = await db[collection].update_one(
+        {"id": doc_id, "deleted_at": {"$exists": True}},
+        {"$set": stamp, "$unset": {"deleted_at": ""}},
+    )
+    if result.matched_count:
+        return await db[collection].find_one({"id": doc_id}, {"_id": 0})
+    if collection not in ARCHIVED_COLLECTIONS:
+        return None
+    archive = db[archive_name(collection)]
+    document = await archive.find_one({"id": doc_id}, {"_id": 0})
+    if document is None:
+        return None
+    document.pop("deleted_at", None)
+    document.pop("archived_at", None)
+    document.update(stamp)
+    await db[collection].replace_one({"id": doc_id}, document, upsert=True)
+    await archive.delete_one({"id": doc_id})
+    return document
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=int, help="default: ARCHIVE_AFTER_DAYS, else 730")
+    parser.add_argument("--deleted-after-days", type=int, help="default: ARCHIVE_DELETED_AFTER_DAYS, else 30")
+    parser.add_argument("--dry-run", action="store_true", help="only count the documents that would move")
+    args = parser.parse_args(argv)
+
+    load_dotenv(ROOT_DIR / '.env')
+    if args.older_than_days is None:
+        args.older_than_days = int(os.environ.get('ARCHIVE_AFTER_DAYS', '730'))
+    if args.deleted_after_days is None:
+        args.deleted_after_days = int(os.environ.get('ARCHIVE_DELETED_AFTER_DAYS', '30'))
+
+    async def run():
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            db = client[os.environ['DB_NAME']]
+            await ensure_archive_collections(db, os.environ.get('ARCHIVE_COMPRESSOR', 'zstd'))
+            return await run_archive(db, args.older_than_days, args.deleted_after_days, args.dry_run)
+        finally:
+            client.close()
+
+    counts = asyncio.run(run())
+    verb = "Would archive" if args.dry_run else "Archived"
+    print(f"{verb} " + ", ".join(f"{count} {name}" for name, count in counts.items()), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
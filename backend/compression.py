@@ -0,0 +1,233 @@
+"""Response compression negotiated by Accept-Encoding.
+
+gzip is always available; brotli and zstd are offered when the `brotli` and
+`zstandard` packages are installed. Responses smaller than `minimum_size`, ranges,
+already-encoded bodies and content types that are compressed already (images,
+archives, PDFs, event streams) pass through untouched. The level can be set per
+route. By default compression runs on the event loop: at level 1 a megabyte of
+JSON takes a few milliseconds, less than handing it to a worker thread costs
+while PDF renders hold the GIL. With `thread_threshold` set, chunks of at least
+that many bytes are compressed in the thread pool instead, for higher levels.
+"""
+import re
+import zlib
+from typing import Iterable, Optional, Sequence, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+# Content types that are already compressed, or must not be buffered
+EXCLUDED_TYPES = (
+    "image/", "video/", "audio/", "font/woff",
+    "application/zip", "application/gzip", "application/x-7z-compressed",
+    "application/octet-stream", "application/pdf", "text/event-stream",
+    # XLSX and the other Office Open XML formats are ZIP files
+    "application/vnd.openxmlformats-officedocument.",
+)
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+# Server preference, best ratio per CPU first
+CODECS = {}
+if zstandard is not None:
+    CODECS["zstd"] = _Zstd
+if brotli is not None:
+    CODECS["br"] = _Brotli
+CODECS["gzip"] = _Gzip
+
+
+def negotiate(accept_encoding: str, available: Iterable[str] = CODECS) -> Optional[str]:
+    """Pick the preferred codec the client accepts (q > 0), or None."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for codec in available:
+        quality = accepted.get(codec, accepted.get("*", 0.0))
+        if quality > 0:
+            return codec
+    return None
+
+
+def parse_route_levels(value: str) -> Sequence[Tuple["re.Pattern", int]]:
+    """Parse "pattern=level,..." (e.g. "/pdf$=1,^/api/changes=9"); level 0 disables compression."""
+    rules = []
+    for part in filter(None, (part.strip() for part in value.split(","))):
+        pattern, _, level = part.rpartition("=")
+        rules.append((re.compile(pattern), int(level)))
+    return rules
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 4096, level: int = 1, route_levels: Sequence[Tuple["re.Pattern", int]] = (),
+                 excluded_types: Sequence[str] = EXCLUDED_TYPES, thread_threshold: Optional[int] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.route_levels = route_levels
+        self.excluded_types = tuple(excluded_types)
+        self.thread_threshold = thread_threshold
+
+    def level_for(self, path: str) -> int:
+        for pattern, level in self.route_levels:
+            if pattern.search(path):
+                return level
+        return self.level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept-encoding"), "")
+        encoding = negotiate(accept) if accept else None
+        level = self.level_for(scope["path"])
+        if encoding is None or level <= 0:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponse(self, encoding, level, send)(scope, receive)
+
+
+class _CompressedResponse:
+    """Per-request state: holds the response start until the first body chunk
+    shows whether (and how) the response should be compressed."""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, level: int, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.level = level
+        self.send = send
+        self.start = None
+        self.passthrough = False
+        self.compressor = None
+
+    async def __call__(self, scope, receive):
+        await self.middleware.app(scope, receive, self.wrapped_send)
+
+    def skip(self, message) -> bool:
+        if message["status"] < 200 or message["status"] in (204, 206, 304):
+            return True
+        headers = {name.lower(): value for name, value in message.get("headers", [])}
+        if b"content-encoding" in headers or b"content-range" in headers:
+            return True
+        content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+        if content_type.startswith(self.middleware.excluded_types):
+            return True
+        length = headers.get(b"content-length")
+        return length is not None and int(length) < self.middleware.minimum_size
+
+    def compressed_start(self, length: Optional[int]):
+        headers = [(name, value) for name, value in self.start.get("headers", [])
+                   if name.lower() not in (b"content-length", b"vary")]
+        vary = [value for name, value in self.start.get("headers", []) if name.lower() == b"vary"]
+        headers.append((b"content-encoding", self.encoding.encode()))
+        headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"])))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode()))
+        return {**self.start, "headers": headers}
+
+    async def run(self, function, data: bytes) -> bytes:
+        threshold = self.middleware.thread_threshold
+        if threshold and len(data) >= threshold:
+            return await run_in_threadpool(function, data)
+        return function(data)
+
+    async def wrapped_send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            self.passthrough = self.skip(message)
+            if self.passthrough:
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        codec = CODECS[self.encoding]
+
+        if self.compressor is None and not more_body:
+            # Whole body in one message: compress it in one go with a Content-Length
+            if len(body) < self.middleware.minimum_size:
+                await self.send(self.start)
+                await self.send(message)
+                return
+            compressed = await self.run(lambda data: self._one_shot(codec, data), body)
+            await self.send(self.compressed_start(len(compressed)))
+            await self.send({"type": "http.response.body", "body": compressed})
+            return
+
+        if self.compressor is None:
+            # Streaming body: length unknown, flush after each chunk so the client sees progress
+            self.compressor = codec(self.level)
+            await self.send(self.compressed_start(None))
+        chunk = await self.run(self._stream_chunk if more_body else self._stream_last, body)
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    def _one_shot(self, codec, data: bytes) -> bytes:
+        compressor = codec(self.level)
+        return compressor.compress(data) + compressor.finish()
+
+    def _stream_chunk(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush()
+
+    def _stream_last(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.finish()
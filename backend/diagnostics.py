@@ -0,0 +1,286 @@
+"""Slow-operation logging and render profiling.
+
+Operations that exceed their threshold are logged as one structured (JSON) line
+and kept in a ring buffer that `/api/debug/slow` exposes. Slow MongoDB queries
+are re-run through `explain` so the record shows which plan was used and how
+many documents were examined for each one returned. Records show the shape of a
+query, never its values, and each shape is explained at most once per
+`explain_interval`, with a few explains in flight at a time.
+
+`RenderProfiler` runs PDF renders under cProfile on request (or for a random
+sample of renders) and keeps per-document aggregates across renders. One render
+is profiled at a time; renders that start meanwhile run unprofiled.
+"""
+import asyncio
+import cProfile
+import io
+import json
+import logging
+import marshal
+import pstats
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Literal
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Session and transport fields that explain rejects or that do not describe the query
+DRIVER_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern", "apiVersion", "apiStrict", "apiDeprecationErrors"}
+# Explained query shapes whose plans are remembered
+EXPLAINED_SHAPES = 256
+
+
+class SlowLog:
+    def __init__(self, size: int = 200, query_ms: float = 500, render_ms: float = 2000, request_ms: float = 2000):
+        self.events = deque(maxlen=size)
+        self.query_ms = query_ms
+        self.render_ms = render_ms
+        self.request_ms = request_ms
+
+    def record(self, kind: str, duration_ms: float, **context):
+        event = {
+            "kind": kind,
+            "at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(duration_ms, 1),
+            **context,
+        }
+        self.events.append(event)
+        logger.warning("slow %s: %s", kind, json.dumps(event, default=str))
+
+    def render(self, document: str, doc_id: str, seconds: float, **context):
+        if seconds * 1000 >= self.render_ms:
+            self.record("render", seconds * 1000, document=document, id=doc_id, **context)
+
+    def recent(self, kind: str = None, limit: int = 100):
+        events = [event for event in reversed(self.events) if kind is None or event["kind"] == kind]
+        return events[:limit]
+
+
+def plan_summary(stage: dict) -> str:
+    """Flatten a winning plan into e.g. "IXSCAN company_id_1 <- FETCH <- LIMIT"."""
+    names = []
+    while stage:
+        name = stage.get("stage", "?")
+        if stage.get("indexName"):
+            name += f" {stage['indexName']}"
+        names.append(name)
+        stage = stage.get("inputStage") or (stage.get("inputStages") or [None])[0]
+    return " <- ".join(reversed(names))
+
+
+def query_shape(value):
+    """`value` with every literal replaced by "?": lists of documents (pipelines,
+    $or branches) keep each member's shape, other lists collapse to ["?"]."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, dict) for item in value):
+            return [query_shape(item) for item in value]
+        return ["?"] if value else []
+    return "?"
+
+
+def command_filter(command_name: str, command: dict):
+    """The shape of what a command selects on. Updates and deletes carry one
+    statement per document; the first one stands for the batch."""
+    if command_name in ("update", "delete"):
+        statements = command.get(command_name + "s") or [{}]
+        return query_shape(statements[0].get("q", {}))
+    return query_shape(command.get("filter") or command.get("query") or command.get("pipeline") or {})
+
+
+class SlowCommandListener(monitoring.CommandListener):
+    """Catch MongoDB commands slower than the query threshold and explain them,
+    once per query shape every `explain_interval` seconds and at most
+    `max_explains` at a time."""
+
+    def __init__(self, slow_log: SlowLog, max_explains: int = 2, explain_interval: float = 300):
+        self.slow_log = slow_log
+        self.max_explains = max_explains
+        self.explain_interval = explain_interval
+        self._commands = {}
+        self._db = None
+        self._loop = None
+        # Touched on the event loop only
+        self._plans = OrderedDict()
+        self._explaining = set()
+
+    def attach(self, db, loop):
+        """Enable explain follow-ups; they run on `loop` against `db`."""
+        self._db = db
+        self._loop = loop
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE_COMMANDS or event.command_name == "getMore":
+            self._commands[event.request_id] = (event.command, event.database_name)
+
+    def failed(self, event):
+        self._commands.pop(event.request_id, None)
+
+    def succeeded(self, event):
+        command, database = self._commands.pop(event.request_id, (None, None))
+        duration_ms = event.duration_micros / 1000
+        if command is None or duration_ms < self.slow_log.query_ms:
+            return
+        collection = command.get(event.command_name)
+        context = {
+            "command": event.command_name,
+            "database": database,
+            "collection": collection if isinstance(collection, str) else command.get("collection"),
+            "filter": command_filter(event.command_name, command),
+            "returned": self._returned(event.reply),
+        }
+        if self._loop is None or event.command_name not in EXPLAINABLE_COMMANDS:
+            self.slow_log.record("query", duration_ms, **context)
+            return
+        explain_command = {key: value for key, value in command.items() if key not in DRIVER_FIELDS and not key.startswith("$")}
+        if event.command_name in ("update", "delete"):
+            # explain takes a single statement
+            explain_command[event.command_name + "s"] = explain_command.get(event.command_name + "s", [])[:1]
+        shape = json.dumps([context["command"], context["collection"], context["filter"]], sort_keys=True, default=str)
+        self._loop.call_soon_threadsafe(self._schedule, shape, explain_command, duration_ms, context)
+
+    def _schedule(self, shape: str, command: dict, duration_ms: float, context: dict):
+        cached = self._plans.get(shape)
+        if cached is not None and time.monotonic() - cached[0] < self.explain_interval:
+            self.slow_log.record("query", duration_ms, **context, **cached[1], explain="cached")
+            return
+        if shape in self._explaining or len(self._explaining) >= self.max_explains:
+            self.slow_log.record("query", duration_ms, **context, explain="skipped")
+            return
+        self._explaining.add(shape)
+        asyncio.ensure_future(self._explain(shape, command, duration_ms, context))
+
+    @staticmethod
+    def _returned(reply):
+        cursor = reply.get("cursor")
+        if cursor:
+            return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+        return reply.get("n")
+
+    async def _explain(self, shape: str, command: dict, duration_ms: float, context: dict):
+        try:
+            explained = await self._db.command({"explain": command, "verbosity": "executionStats"})
+            stats = explained.get("executionStats", {})
+            planner = explained.get("queryPlanner", {})
+            plan = {
+                "plan": plan_summary(planner.get("winningPlan", {})),
+                "docs_examined": stats.get("totalDocsExamined"),
+                "keys_examined": stats.get("totalKeysExamined"),
+            }
+            context.update(plan, returned=stats.get("nReturned", context["returned"]))
+            self._plans[shape] = (time.monotonic(), plan)
+            self._plans.move_to_end(shape)
+            while len(self._plans) > EXPLAINED_SHAPES:
+                self._plans.popitem(last=False)
+        except Exception as exc:
+            context["explain_error"] = str(exc)
+        finally:
+            self._explaining.discard(shape)
+        self.slow_log.record("query", duration_ms, **context)
+
+
+class SlowRequestMiddleware:
+    def __init__(self, app, slow_log: SlowLog):
+        self.app = app
+        self.slow_log = slow_log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if duration_ms >= self.slow_log.request_ms and scope["path"] != "/api/events":
+                self.slow_log.record(
+                    "request",
+                    duration_ms,
+                    method=scope["method"],
+                    route=getattr(scope.get("route"), "path", scope["path"]),
+                    query=scope.get("query_string", b"").decode("latin-1"),
+                )
+
+
+# Sort keys pstats accepts
+ProfileSort = Literal[
+    "calls", "cumulative", "cumtime", "file", "filename", "line", "module", "name",
+    "ncalls", "nfl", "pcalls", "stdname", "time", "tottime",
+]
+
+
+class RenderProfiler:
+    def __init__(self, sample_rate: float = 0.0):
+        self.sample_rate = sample_rate
+        self.aggregates = {}
+        self.renders = {}
+        # Renders run on worker threads
+        self._lock = threading.Lock()
+        self._active = None
+
+    def begin(self, force: bool = False):
+        """Start profiling this render if forced or sampled; returns the profile, or
+        None if it is not profiled, including when another render already is.
+
+        cProfile only sees the thread it was enabled on, so call this (and `end`)
+        on the thread that renders.
+        """
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        with self._lock:
+            if self._active is not None:
+                return None
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+ allows one active profiler per process
+                return None
+            self._active = profile
+        return profile
+
+    def end(self, document: str, profile: cProfile.Profile) -> pstats.Stats:
+        profile.disable()
+        stats = pstats.Stats(profile)
+        with self._lock:
+            self._active = None
+            if document in self.aggregates:
+                self.aggregates[document].add(stats)
+            else:
+                self.aggregates[document] = pstats.Stats(profile)
+            self.renders[document] = self.renders.get(document, 0) + 1
+        return stats
+
+    def discard(self, profile: cProfile.Profile):
+        """Stop a profile whose render failed, without keeping its stats."""
+        profile.disable()
+        with self._lock:
+            self._active = None
+
+    def reset(self):
+        with self._lock:
+            self.aggregates.clear()
+            self.renders.clear()
+
+    def format(self, stats: pstats.Stats, sort: ProfileSort = "cumulative", limit: int = 40) -> str:
+        """The top `limit` functions by `sort`, printed from a copy so that shared
+        aggregates are not re-sorted or re-pointed while renders add to them."""
+        output = io.StringIO()
+        with self._lock:
+            snapshot = pstats.Stats(stream=output)
+            snapshot.add(stats)
+        snapshot.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def dump(self, document: str) -> bytes:
+        """Aggregated stats in the marshal format that pstats/snakeviz load."""
+        with self._lock:
+            return marshal.dumps(self.aggregates[document].stats)
@@ -0,0 +1,132 @@
+"""Change broadcasting for the /api/events stream.
+
+Writes are published to a `ChangeBroker`, which fans them out to every connected
+client. Each client owns a small bounded queue: a client that stops reading is
+told to resync instead of making the worker buffer events for it forever.
+"""
+import asyncio
+import json
+import logging
+from typing import Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+RESYNC = {"resync": True}
+
+
+class Subscription:
+    __slots__ = ("queue", "collections", "overflowed")
+
+    def __init__(self, queue_size: int, collections: Optional[Set[str]] = None):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.collections = collections
+        self.overflowed = False
+
+    def offer(self, event: dict):
+        if self.collections and event["collection"] not in self.collections:
+            return
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Drop what is queued; the client catches up through /api/changes.
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class ChangeBroker:
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.subscribers: Set[Subscription] = set()
+
+    def subscribe(self, collections: Optional[Iterable[str]] = None) -> Subscription:
+        subscription = Subscription(self.queue_size, set(collections) if collections else None)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+
+    def publish(self, collection: str, op: str, doc_id: str, revision: int):
+        if not self.subscribers:
+            return
+        event = {"collection": collection, "op": op, "id": doc_id, "revision": revision}
+        for subscription in self.subscribers:
+            subscription.offer(event)
+
+
+async def event_stream(broker: ChangeBroker, subscription: Subscription, is_disconnected, heartbeat: float = 15.0):
+    """Yield Server-Sent Events for one subscription until the client goes away."""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            if event is RESYNC:
+                subscription.overflowed = False
+                yield "event: resync\ndata: {}\n\n"
+                continue
+            yield f"id: {event['revision']}\nevent: change\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def supports_change_streams(db) -> bool:
+    try:
+        hello = await db.command("hello")
+    except Exception:
+        return False
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+
+async def watch_change_streams(db, broker: ChangeBroker, collections: Iterable[str]):
+    """Feed the broker from a database-wide change stream.
+
+    Deletes are picked up from the tombstones collection, which carries the
+    application id and revision that the raw delete event does not.
+    """
+    collections = list(collections)
+    pipeline = [
+        {"$match": {
+            "operationType": {"$in": ["insert", "update", "replace"]},
+            "ns.coll": {"$in": collections + ["tombstones"]},
+        }},
+        {"$project": {
+            "operationType": 1,
+            "ns.coll": 1,
+            "fullDocument.id": 1,
+            "fullDocument.revision": 1,
+            "fullDocument.collection": 1,
+            "fullDocument.deleted_at": 1,
+        }},
+    ]
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    doc = change.get("fullDocument")
+                    if not doc:
+                        continue
+                    if change["ns"]["coll"] == "tombstones":
+                        broker.publish(doc["collection"], "delete", doc["id"], doc["revision"])
+                    elif doc.get("deleted_at"):
+                        # Soft delete; published from its tombstone above
+                        continue
+                    else:
+                        op = "create" if change["operationType"] == "insert" else "update"
+                        broker.publish(change["ns"]["coll"], op, doc["id"], doc.get("revision", 0))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Change stream interrupted, reconnecting")
+            await asyncio.sleep(1)
@@ -0,0 +1,244 @@
+"""Spreadsheet export of invoices, quotations and catalog items.
+
+Documents are read from a cursor and written out in batches, either as CSV or as
+XLSX through openpyxl's write-only workbook, so memory use does not grow with
+the size of the export. Invoices and quotations can be exported one row per
+document or one row per line item. The API streams the same rows as downloads
+from /api/export/<collection>, and the command line writes them to a file:
+
+    cd backend
+    python -m export invoices --format xlsx --out invoices-2024.xlsx --date-from 2024-01-01 --date-to 2024-12-31
+    python -m export quotations --rows lines --status accepted --out - > accepted-lines.csv
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from archive import LIVE
+
+ROOT_DIR = Path(__file__).parent
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+ROW_MODES = ("documents", "lines")
+BATCH_SIZE = 1000
+# Text starting with these is read as a formula by spreadsheet applications
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+PRICED_FIELDS = [
+    "company_id", "client_name", "client_address", "client_phone", "client_email", "currency",
+    "subtotal", "discount_rate", "discount_amount", "tax_rate", "tax_amount", "total", "notes", "created_at", "updated_at",
+]
+LINE_FIELDS = ["item_id", "name", "description", "quantity", "unit", "unit_price", "total"]
+
+# Columns per collection: document fields, plus the leading document fields that
+# are repeated on every line-item row
+EXPORTS = {
+    "invoices": {
+        "fields": ["id", "invoice_number", "date", "due_date", "status", "quotation_id", *PRICED_FIELDS],
+        "line_document_fields": ["id", "invoice_number", "date", "status", "client_name", "currency"],
+        "filters": ("status", "company_id", "date"),
+    },
+    "quotations": {
+        "fields": ["id", "quotation_number", "date", "valid_until", "status", "invoice_id", *PRICED_FIELDS],
+        "line_document_fields": ["id", "quotation_number", "date", "status", "client_name", "currency"],
+        "filters": ("status", "company_id", "date"),
+    },
+    "items": {
+        "fields": ["id", "name", "description", "unit", "unit_price", "created_at", "updated_at"],
+        "filters": (),
+    },
+}
+
+
+def columns(collection: str, rows: str) -> List[str]:
+    spec = EXPORTS[collection]
+    if rows == "documents":
+        return list(spec["fields"])
+    if "line_document_fields" not in spec:
+        raise ValueError(f"{collection} have no line items")
+    return [f"document_{field}" if field == "id" else field for field in spec["line_document_fields"]] + \
+        ["line"] + [f"line_{field}" for field in LINE_FIELDS]
+
+
+def build_query(collection: str, status: Optional[str] = None, company_id: Optional[str] = None,
+                date_from: Optional[str] = None, date_to: Optional[str] = None) -> dict:
+    """MongoDB filter for an export; dates are ISO strings, so they compare as text."""
+    allowed = EXPORTS[collection]["filters"]
+    given = {"status": status, "company_id": company_id, "date": date_from or date_to}
+    unsupported = [name for name, value in given.items() if value and name not in allowed]
+    if unsupported:
+        raise ValueError(f"{collection} cannot be filtered by {', '.join(unsupported)}")
+    query = dict(LIVE)
+    if status:
+        query["status"] = status
+    if company_id:
+        query["company_id"] = company_id
+    if date_from or date_to:
+        query["date"] = {key: value for key, value in (("$gte", date_from), ("$lte", date_to)) if value}
+    return query
+
+
+def projection(collection: str, rows: str) -> dict:
+    spec = EXPORTS[collection]
+    fields = spec["fields"] if rows == "documents" else spec["line_document_fields"] + ["items"]
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+
+def formula_like(value) -> bool:
+    return isinstance(value, str) and value.startswith(FORMULA_PREFIXES)
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, (int, float, str)):
+        return value
+    # Datetimes stored as BSON dates and anything else unexpected
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def document_rows(collection: str, rows: str, document: dict) -> List[list]:
+    """The export rows of one document: a single row, or one per line item."""
+    spec = EXPORTS[collection]
+    if rows == "documents":
+        return [[_cell(document.get(field)) for field in spec["fields"]]]
+    lead = [_cell(document.get(field)) for field in spec["line_document_fields"]]
+    return [
+        lead + [number] + [_cell(line.get(field)) for field in LINE_FIELDS]
+        for number, line in enumerate(document.get("items") or [], 1)
+    ]
+
+
+async def row_batches(cursor, collection: str, rows: str, batch_size: int = BATCH_SIZE) -> AsyncIterator[List[list]]:
+    """Rows from a Motor cursor, `batch_size` at a time."""
+    batch = []
+    async for document in cursor:
+        batch.extend(document_rows(collection, rows, document))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_row_batches(cursor, collection: str, rows: str, batch_size: int = BATCH_SIZE) -> Iterator[List[list]]:
+    """Rows from a PyMongo cursor, `batch_size` at a time."""
+    batch = []
+    for document in cursor:
+        batch.extend(document_rows(collection, rows, document))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_bytes(rows: Iterable[list]) -> bytes:
+    """CSV lines of `rows`; text that would be read as a formula is prefixed with an
+    apostrophe, so client names like "=HYPERLINK(...)" stay text."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        [f"'{value}" if formula_like(value) else value for value in row] for row in rows
+    )
+    return buffer.getvalue().encode("utf-8")
+
+
+def csv_header(header: List[str]) -> bytes:
+    # The byte order mark makes Excel read the file as UTF-8
+    return b"\xef\xbb\xbf" + csv_bytes([header])
+
+
+class XlsxWriter:
+    """Write-only workbook: appended rows go to a temporary file, not to memory.
+
+    openpyxl stores any text starting with "=" as a formula, so such values are
+    written as cells typed as text.
+    """
+
+    def __init__(self, title: str, header: List[str]):
+        from openpyxl import Workbook
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title)
+        self.sheet.freeze_panes = "A2"
+        self.sheet.append(header)
+
+    def append(self, rows: Iterable[list]):
+        for row in rows:
+            if any(formula_like(value) for value in row):
+                row = [self._text_cell(value) if formula_like(value) else value for value in row]
+            self.sheet.append(row)
+
+    def _text_cell(self, value: str):
+        from openpyxl.cell import WriteOnlyCell
+        cell = WriteOnlyCell(self.sheet, value)
+        cell.data_type = "s"
+        return cell
+
+    def save(self, output: BinaryIO):
+        self.workbook.save(output)
+
+
+def write_export(cursor, collection: str, rows: str, file_format: str, output: BinaryIO) -> int:
+    """Write a whole export from a PyMongo cursor to `output`; returns the number of rows."""
+    header = columns(collection, rows)
+    count = 0
+    if file_format == "csv":
+        output.write(csv_header(header))
+        for batch in iter_row_batches(cursor, collection, rows):
+            output.write(csv_bytes(batch))
+            count += len(batch)
+        return count
+    writer = XlsxWriter(collection, header)
+    for batch in iter_row_batches(cursor, collection, rows):
+        writer.append(batch)
+        count += len(batch)
+    writer.save(output)
+    return count
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("collection", choices=sorted(EXPORTS))
+    parser.add_argument("--out", required=True, help="output file, or - for standard output (CSV only)")
+    parser.add_argument("--format", choices=sorted(FORMATS), help="default: from the --out suffix, else csv")
+    parser.add_argument("--rows", choices=ROW_MODES, default="documents", help="one row per document or per line item")
+    parser.add_argument("--status")
+    parser.add_argument("--company-id")
+    parser.add_argument("--date-from", help="ISO date, inclusive")
+    parser.add_argument("--date-to", help="ISO date, inclusive")
+    args = parser.parse_args(argv)
+
+    file_format = args.format or ("xlsx" if args.out.lower().endswith(".xlsx") else "csv")
+    if args.out == "-" and file_format != "csv":
+        parser.error("XLSX cannot be written to standard output")
+    try:
+        header = columns(args.collection, args.rows)
+        query = build_query(args.collection, args.status, args.company_id, args.date_from, args.date_to)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    from pymongo import MongoClient
+    load_dotenv(ROOT_DIR / '.env')
+    db = MongoClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+    cursor = db[args.collection].find(query, projection(args.collection, args.rows), batch_size=BATCH_SIZE)
+    if args.out == "-":
+        count = write_export(cursor, args.collection, args.rows, file_format, sys.stdout.buffer)
+    else:
+        partial = Path(args.out + ".tmp")
+        with partial.open("wb") as output:
+            count = write_export(cursor, args.collection, args.rows, file_format, output)
+        os.replace(partial, args.out)
+    print(f"Exported {count} rows ({len(header)} columns)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Revision history of invoices, quotations and letters.
+
+Every update appends a record to the `history` collection for the version it
+creates, keyed by collection, document id and revision. A record holds either a
+JSON Patch (RFC 6902 add/remove/replace operations) from the version it was
+based on, or, every `snapshot_every` versions along that chain, a full snapshot,
+so storage grows with what changed and rebuilding a version applies a bounded
+number of patches. The first update of a document that has no history yet also
+stores the version it replaces, so nothing written before history was kept is
+lost. Records are never changed once written. The live version of a document
+that has no record of its own yet, such as one that was just created, is read
+from the document itself.
+"""
+import copy
+from typing import List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+HISTORY_COLLECTIONS = ("invoices", "quotations", "letters")
+SNAPSHOT_EVERY = 20
+DUPLICATE_KEY = 11000
+
+
+def _pointer(path: tuple) -> str:
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in path)
+
+
+def _parse_pointer(pointer: str) -> List[str]:
+    return [part.replace("~1", "/").replace("~0", "~") for part in pointer.split("/")[1:]]
+
+
+def _same(old, new) -> bool:
+    # 1 and 1.0 compare equal but are stored differently
+    return type(old) is type(new) and old == new
+
+
+def diff(old, new, path: tuple = ()) -> List[dict]:
+    """JSON Patch operations that turn `old` into `new`. Objects and arrays are
+    compared member by member; arrays that change length gain or lose elements at
+    the end."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        operations = [{"op": "remove", "path": _pointer(path + (key,))} for key in old if key not in new]
+        for key, value in new.items():
+            if key not in old:
+                operations.append({"op": "add", "path": _pointer(path + (key,)), "value": value})
+            elif not _same(old[key], value):
+                operations.extend(diff(old[key], value, path + (key,)))
+        return operations
+    if isinstance(old, list) and isinstance(new, list):
+        common = min(len(old), len(new))
+        operations = []
+        for index in range(common):
+            if not _same(old[index], new[index]):
+                operations.extend(diff(old[index], new[index], path + (index,)))
+        operations.extend({"op": "remove", "path": _pointer(path + (index,))} for index in range(len(old) - 1, common - 1, -1))
+        operations.extend({"op": "add", "path": _pointer(path + (index,)), "value": new[index]} for index in range(common, len(new)))
+        return operations
+    return [] if _same(old, new) else [{"op": "replace", "path": _pointer(path), "value": new}]
+
+
+def apply_patch(document: dict, patch: List[dict]) -> dict:
+    """A copy of `document` with the operations of `patch` applied."""
+    document = copy.deepcopy(document)
+    for operation in patch:
+        *parents, last = _parse_pointer(operation["path"])
+        target = document
+        for part in parents:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        if isinstance(target, list):
+            index = int(last)
+            if operation["op"] == "add":
+                target.insert(index, copy.deepcopy(operation["value"]))
+            elif operation["op"] == "remove":
+                del target[index]
+            else:
+                target[index] = copy.deepcopy(operation["value"])
+        elif operation["op"] == "remove":
+            del target[last]
+        else:
+            target[last] = copy.deepcopy(operation["value"])
+    return document
+
+
+def _record(collection: str, document: dict, base: Optional[int], depth: int, **body) -> dict:
+    return {
+        "collection": collection,
+        "id": document["id"],
+        "revision": document.get("revision", 0),
+        "base": base,
+        "depth": depth,
+        "at": document.get("updated_at") or document.get("created_at"),
+        **body,
+    }
+
+
+async def record_versions(db, collection: str, versions: List[Tuple[dict, dict]], snapshot_every: int = SNAPSHOT_EVERY):
+    """Append the history records of (previous, current) document versions with one
+    lookup of the previous records and one insert."""
+    if not versions:
+        return
+    based_on = {(previous["id"], previous.get("revision", 0)) for previous, _ in versions}
+    bases = {
+        (record["id"], record["revision"]): record
+        async for record in db.history.find(
+            {"collection": collection, "$or": [{"id": doc_id, "revision": revision} for doc_id, revision in based_on]},
+            {"_id": 0, "id": 1, "revision": 1, "depth": 1},
+        )
+    }
+    records = []
+    for previous, current in versions:
+        base = bases.get((previous["id"], previous.get("revision", 0)))
+        if base is None:
+            # First change since history was kept: keep the version it replaces
+            base = _record(collection, previous, None, 0, kind="snapshot", snapshot=previous)
+            records.append(base)
+        depth = base["depth"] + 1
+        if depth >= snapshot_every:
+            records.append(_record(collection, current, base["revision"], 0, kind="snapshot", snapshot=current))
+        else:
+            records.append(_record(collection, current, base["revision"], depth, kind="patch", patch=diff(previous, current)))
+    try:
+        await db.history.insert_many(records, ordered=False)
+    except BulkWriteError as exc:
+        # Two updates of the same version both stored it as their baseline
+        if any(error["code"] != DUPLICATE_KEY for error in exc.details["writeErrors"]):
+            raise
+
+
+async def list_revisions(db, collection: str, doc_id: str, limit: int) -> List[dict]:
+    """Newest first: revision, base, time and kind of each version, with the patch
+    for patch records (snapshots are left out). A live version without a record
+    is listed first with kind "live"."""
+    cursor = db.history.find({"collection": collection, "id": doc_id}, {"_id": 0, "collection": 0, "id": 0, "snapshot": 0})
+    revisions = await cursor.sort("revision", -1).to_list(limit)
+    live = await db[collection].find_one({"id": doc_id}, {"_id": 0, "revision": 1, "updated_at": 1, "created_at": 1})
+    if live is not None and (not revisions or revisions[0]["revision"] < live.get("revision", 0)):
+        revisions = [{"revision": live.get("revision", 0), "base": revisions[0]["revision"] if revisions else None, "depth": 0,
+                      "at": live.get("updated_at") or live.get("created_at"), "kind": "live"}] + revisions[:limit - 1]
+    return revisions
+
+
+async def load_version(db, collection: str, doc_id: str, revision: int) -> Optional[dict]:
+    """The document as it was at `revision`: the nearest snapshot with the patches
+    after it applied, or the live document if it is at `revision` and has no
+    record yet. None if there is no such version."""
+    patches = []
+    while True:
+        record = await db.history.find_one({"collection": collection, "id": doc_id, "revision": revision}, {"_id": 0})
+        if record is None:
+            if patches:
+                return None
+            return await db[collection].find_one({"id": doc_id, "revision": revision}, {"_id": 0})
+        if record["kind"] == "snapshot":
+            document = record["snapshot"]
+            break
+        patches.append(record["patch"])
+        revision = record["base"]
+    for patch in reversed(patches):
+        document = apply_patch(document, patch)
+    return document
@@ -0,0 +1,130 @@
+"""Bulk import of catalog items and companies from CSV or XLSX uploads.
+
+Rows are read lazily (csv on the spooled upload, openpyxl in read-only mode for
+XLSX), validated against the create model a chunk at a time and deduplicated on
+a key column, so an upload of any length is never held in memory. Column names
+are the model's field names and unknown columns are ignored. A row only writes
+the cells it has: missing columns and empty cells leave an existing document's
+values alone, and take the model defaults in a new one.
+"""
+import csv
+import io
+from itertools import islice
+from typing import BinaryIO, Dict, Iterator, List, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+CHUNK_SIZE = 1000
+# Row errors listed in the report; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+def is_xlsx(file: BinaryIO, filename: str) -> bool:
+    if filename.lower().endswith(".xlsx"):
+        return True
+    # XLSX files are ZIP archives
+    position = file.tell()
+    magic = file.read(4)
+    file.seek(position)
+    return magic == b"PK\x03\x04"
+
+
+def _normalize(header) -> str:
+    return str(header or "").strip().lower().replace(" ", "_")
+
+
+def _cleaned(header: List[str], values) -> dict:
+    row = {}
+    for name, value in zip(header, values):
+        if isinstance(value, str):
+            value = value.strip()
+        if name and value not in (None, ""):
+            row[name] = value
+    return row
+
+
+def read_rows(file: BinaryIO, filename: str) -> Iterator[Tuple[int, dict]]:
+    """Yield (row number, {column: value}) with the header as row 1; blank rows are skipped.
+
+    Raises ValueError (possibly part way through) for files that cannot be read.
+    """
+    if is_xlsx(file, filename):
+        from openpyxl import load_workbook
+        try:
+            workbook = load_workbook(file, read_only=True, data_only=True)
+        except Exception as exc:
+            raise ValueError(f"Not a readable XLSX file: {exc}") from exc
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [_normalize(name) for name in next(rows, ())]
+            for number, values in enumerate(rows, 2):
+                # Cells come back as numbers and dates; the models parse text like CSV values
+                row = _cleaned(header, [None if value is None else str(value) for value in values])
+                if row:
+                    yield number, row
+        finally:
+            workbook.close()
+        return
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.reader(text)
+        header = [_normalize(name) for name in next(reader, [])]
+        for values in reader:
+            row = _cleaned(header, values)
+            if row:
+                yield reader.line_num, row
+    finally:
+        # Leave the upload open for its owner
+        text.detach()
+
+
+def chunks(rows: Iterator[Tuple[int, dict]], size: int = CHUNK_SIZE) -> Iterator[List[Tuple[int, dict]]]:
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def dedupe_key(document: dict, keys: Tuple[str, ...]) -> Tuple[str, str]:
+    """The first key field that is set, as (field, value). Values are compared
+    exactly (after trimming), the same way the upsert matches existing documents."""
+    for field in keys:
+        value = document.get(field)
+        if value:
+            return field, str(value).strip()
+    return keys[0], ""
+
+
+def defaults(model: Type[BaseModel]) -> dict:
+    """Default values of the optional fields of `model`, for new documents."""
+    return {
+        name: field.get_default(call_default_factory=True)
+        for name, field in model.model_fields.items() if not field.is_required()
+    }
+
+
+def validate_chunk(chunk: List[Tuple[int, dict]], model: Type[BaseModel], keys: Tuple[str, ...],
+                   seen: Dict[Tuple[str, str], int]) -> Tuple[List[Tuple[int, dict]], List[dict]]:
+    """Validate rows against `model`; returns ((row, document) to write, row errors).
+    Documents only hold the fields their row sets.
+
+    `seen` maps dedupe keys to the row that first used them and is carried across
+    chunks, so a repeated key anywhere in the file is reported.
+    """
+    valid, errors = [], []
+    for number, row in chunk:
+        try:
+            document = model.model_validate(row).model_dump(exclude_unset=True)
+        except ValidationError as exc:
+            errors.append({"row": number, "errors": [
+                {"field": ".".join(str(part) for part in error["loc"]), "message": error["msg"]} for error in exc.errors()
+            ]})
+            continue
+        key = dedupe_key(document, keys)
+        if key in seen:
+            errors.append({"row": number, "errors": [{"field": key[0], "message": f"Duplicate of row {seen[key]}"}]})
+            continue
+        seen[key] = number
+        valid.append((number, document))
+    return valid, errors
@@ -0,0 +1,108 @@
+"""Mail merge: one letter template, many recipients.
+
+Template fields may contain `{{placeholders}}` that are filled from each
+recipient's fields (plus `{{index}}`, the 1-based position in the list).
+Recipient fields named like letter fields (`recipient_name`,
+`recipient_address`, ...) also replace those fields directly. Merged letters are
+rendered straight from memory and never stored as documents; a merged PDF is
+kept in the PDF cache under a digest of its template and recipients.
+"""
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import re
+import zipfile
+from concurrent.futures import Executor
+from typing import BinaryIO, Dict, List, Set
+from xml.sax.saxutils import escape
+
+PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+# Letter fields that placeholders are substituted in
+MERGE_FIELDS = ("letter_number", "date", "subject", "recipient_name", "recipient_position", "recipient_address", "content", "cc_list")
+# Recipient columns that replace the template's field outright
+RECIPIENT_FIELDS = ("recipient_name", "recipient_position", "recipient_address")
+
+
+def parse_recipients_csv(data: bytes) -> List[Dict[str, str]]:
+    """Rows of a CSV upload (header row required) as dicts with trimmed keys and values."""
+    reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+    return [
+        {key.strip(): (value or "").strip() for key, value in row.items() if key}
+        for row in reader
+        if any((value or "").strip() for value in row.values() if isinstance(value, str))
+    ]
+
+
+def merge_digest(template: dict, recipients: List[Dict[str, str]]) -> str:
+    """Identifies a merge by its template and recipients, for the PDF cache."""
+    payload = json.dumps([template, recipients], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def missing_fields(template: dict, recipients: List[Dict[str, str]]) -> Set[str]:
+    """Placeholders used by the template that some recipient cannot fill."""
+    used = {name for field in MERGE_FIELDS for name in PLACEHOLDER.findall(template.get(field) or "")}
+    used.discard("index")
+    missing = set()
+    for recipient in recipients:
+        missing |= used - recipient.keys()
+    return missing
+
+
+def merge_letter(template: dict, recipient: Dict[str, str], index: int) -> dict:
+    """The letter for one recipient. Values are escaped because the renderer
+    treats letter text as ReportLab paragraph markup."""
+    values = {key: escape(str(value)) for key, value in recipient.items()}
+    values["index"] = str(index)
+    letter = dict(template)
+    for field in RECIPIENT_FIELDS:
+        if field in values:
+            letter[field] = values[field]
+    for field in MERGE_FIELDS:
+        if letter.get(field):
+            letter[field] = PLACEHOLDER.sub(lambda match: values.get(match.group(1), match.group(0)), letter[field])
+    letter["id"] = f"merge-{index}"
+    return letter
+
+
+def entry_name(letter: dict, index: int) -> str:
+    name = re.sub(r"[^\w.-]+", "_", letter.get("recipient_name") or "").strip("_")[:60]
+    return f"{index:05d}_{name or 'letter'}.pdf"
+
+
+def render_zip_chunk(template: dict, company: dict, recipients: List[Dict[str, str]], first_index: int) -> list:
+    """Render one PDF per recipient in a worker process; returns (entry name, pdf bytes)."""
+    from pdf_render import letter_images, render_merged_letters
+    images = letter_images(template, company)
+    results = []
+    for offset, recipient in enumerate(recipients):
+        letter = merge_letter(template, recipient, first_index + offset)
+        results.append((entry_name(letter, first_index + offset), render_merged_letters([letter], company, images)))
+    return results
+
+
+def render_merged_pdf(template: dict, company: dict, recipients: List[Dict[str, str]], output: BinaryIO):
+    """All merged letters as one PDF, written to `output`."""
+    from pdf_render import render_merged_letters
+    letters = [merge_letter(template, recipient, index) for index, recipient in enumerate(recipients, 1)]
+    render_merged_letters(letters, company, output=output)
+
+
+async def render_merged_zip(pool: Executor, template: dict, company: dict, recipients: List[Dict[str, str]],
+                            output: BinaryIO, chunk_size: int = 50):
+    """Render recipients in parallel chunks on `pool` and write a ZIP of one PDF each to `output`."""
+    loop = asyncio.get_running_loop()
+    futures = [
+        loop.run_in_executor(pool, render_zip_chunk, template, company, recipients[start:start + chunk_size], start + 1)
+        for start in range(0, len(recipients), chunk_size)
+    ]
+    try:
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as archive:
+            for future in futures:
+                for name, pdf in await future:
+                    await asyncio.to_thread(archive.writestr, name, pdf)
+    finally:
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,294 @@
+"""Minimal Prometheus metrics: counters, gauges and histograms rendered in the
+text exposition format, plus the HTTP middleware and Motor command and
+connection pool listeners that feed them.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in list(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # per-bucket counts, then +Inf count, then sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def _samples(self):
+        lines = []
+        for key, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests served.", ["method", "route", "status"])
+HTTP_LATENCY = REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency.", ["method", "route"])
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests currently being served.")
+HTTP_REQUEST_SIZE = REGISTRY.histogram("http_request_size_bytes", "HTTP request body size.", ["route"], buckets=SIZE_BUCKETS)
+HTTP_RESPONSE_SIZE = REGISTRY.histogram("http_response_size_bytes", "HTTP response body size.", ["route"], buckets=SIZE_BUCKETS)
+PDF_STAGE_SECONDS = REGISTRY.histogram("pdf_render_stage_seconds", "Time spent in each PDF rendering stage.", ["document", "stage"])
+PDF_CACHE_REQUESTS = REGISTRY.counter("pdf_cache_requests_total", "PDF requests by cache outcome.", ["document", "result"])
+THUMBNAIL_CACHE_REQUESTS = REGISTRY.counter("thumbnail_cache_requests_total", "Thumbnail requests by cache outcome.", ["document", "result"])
+MONGO_COMMAND_SECONDS = REGISTRY.histogram("mongodb_command_duration_seconds", "MongoDB command latency.", ["command", "collection"])
+MONGO_COMMAND_FAILURES = REGISTRY.counter("mongodb_command_failures_total", "Failed MongoDB commands.", ["command", "collection"])
+ADMISSION_IN_FLIGHT = REGISTRY.gauge("admission_in_flight", "Admitted requests being served per route class.", ["route_class"])
+ADMISSION_WAITING = REGISTRY.gauge("admission_waiting", "Requests queued for a slot per route class.", ["route_class"])
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram("admission_wait_seconds", "Time queued requests waited for a slot.", ["route_class"])
+ADMISSION_REJECTED = REGISTRY.counter("admission_rejected_total", "Requests turned away by admission control.", ["route_class", "reason"])
+MONGO_POOL_CONNECTIONS = REGISTRY.gauge("mongodb_pool_connections", "Open connections in the MongoDB pool.", ["address"])
+MONGO_POOL_CHECKED_OUT = REGISTRY.gauge("mongodb_pool_checked_out", "MongoDB connections currently in use.", ["address"])
+MONGO_POOL_WAITING = REGISTRY.gauge("mongodb_pool_waiting", "Operations waiting for a MongoDB connection.", ["address"])
+MONGO_POOL_WAIT_SECONDS = REGISTRY.histogram("mongodb_pool_wait_seconds", "Time spent waiting to check out a MongoDB connection.", ["address"])
+MONGO_POOL_CHECKOUT_FAILURES = REGISTRY.counter("mongodb_pool_checkout_failures_total", "Failed MongoDB connection checkouts.", ["address", "reason"])
+MONGO_POOL_CLEARED = REGISTRY.counter("mongodb_pool_cleared_total", "Times a MongoDB pool was cleared after an error.", ["address"])
+
+
+class StageTimer:
+    """Record consecutive stages of one operation, e.g. fetch -> story -> build.
+
+    Without a histogram the timer only keeps time and records nothing.
+    """
+
+    __slots__ = ("histogram", "labels", "start", "last")
+
+    def __init__(self, histogram: Optional[Histogram], *labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = self.last = time.perf_counter()
+
+    def total(self) -> float:
+        return self.last - self.start
+
+    def lap(self, stage: str, nested: Dict[str, float] = None):
+        """Close the current stage. `nested` holds sub-stages measured inside it,
+        which are recorded on their own and subtracted from this one."""
+        now = time.perf_counter()
+        self.last, elapsed = now, now - self.last
+        if self.histogram is None:
+            return
+        for name, seconds in (nested or {}).items():
+            self.histogram.observe(seconds, *self.labels, name)
+            elapsed -= seconds
+        self.histogram.observe(elapsed, *self.labels, stage)
+
+
+class MetricsMiddleware:
+    """Record latency, in-flight count and body sizes per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        sizes = [0, 0]
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUESTS.inc(scope["method"], path, status)
+            HTTP_LATENCY.observe(time.perf_counter() - start, scope["method"], path)
+            HTTP_REQUEST_SIZE.observe(sizes[0], path)
+            HTTP_RESPONSE_SIZE.observe(sizes[1], path)
+
+
+class CommandTimingListener(monitoring.CommandListener):
+    """Time every MongoDB command issued through the client it is registered on."""
+
+    def __init__(self):
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            target = event.command.get("collection", "")
+        self._collections[event.request_id] = target
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, event.command_name, collection)
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, event.command_name, collection)
+        MONGO_COMMAND_FAILURES.inc(event.command_name, collection)
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Track pool size, checked-out connections and checkout waits per server."""
+
+    def __init__(self):
+        # Checkouts start and finish on the same thread, so waits are keyed by it
+        self._waits: Dict[Tuple[int, str], float] = {}
+
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        MONGO_POOL_CLEARED.inc(self._address(event))
+
+    def pool_closed(self, event):
+        address = self._address(event)
+        MONGO_POOL_CONNECTIONS.set(address, value=0)
+        MONGO_POOL_CHECKED_OUT.set(address, value=0)
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc(self._address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec(self._address(event))
+
+    def connection_check_out_started(self, event):
+        address = self._address(event)
+        MONGO_POOL_WAITING.inc(address)
+        self._waits[(threading.get_ident(), address)] = time.perf_counter()
+
+    def _check_out_finished(self, address: str):
+        MONGO_POOL_WAITING.dec(address)
+        start = self._waits.pop((threading.get_ident(), address), None)
+        if start is not None:
+            MONGO_POOL_WAIT_SECONDS.observe(time.perf_counter() - start, address)
+
+    def connection_check_out_failed(self, event):
+        address = self._address(event)
+        self._check_out_finished(address)
+        MONGO_POOL_CHECKOUT_FAILURES.inc(address, event.reason)
+
+    def connection_checked_out(self, event):
+        address = self._address(event)
+        self._check_out_finished(address)
+        MONGO_POOL_CHECKED_OUT.inc(address)
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec(self._address(event))
@@ -0,0 +1,126 @@
+"""On-disk cache of rendered PDFs and file streaming with HTTP Range support.
+
+Entries are keyed by document kind, id and revision, the company revision and
+the renderer version, so any edit to either document, or to the renderer, produces
+a new key and stale files simply age out. Files
+are written under a temporary name and renamed into place, which makes the cache
+safe to share between worker processes. When the cache grows past its size
+limit, the least recently used files are removed.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, Optional, Tuple
+
+import anyio
+
+CHUNK_SIZE = 64 * 1024
+# Hash of the renderer source: a deploy that changes how PDFs look does not serve
+# PDFs rendered by the previous version (the module itself is imported lazily)
+RENDERER_VERSION = hashlib.sha256((Path(__file__).parent / "pdf_render.py").read_bytes()).hexdigest()[:12]
+
+
+class PdfCache:
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._written = 0
+
+    @staticmethod
+    def key(kind: str, document: dict, company: dict) -> str:
+        return f"{kind}-{document['id']}-r{document.get('revision', 0)}-c{company.get('revision', 0)}-v{RENDERER_VERSION}"
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self.directory / f"{key}.pdf"
+        try:
+            # Touch on every hit so eviction sees recent use (atime is often not kept)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, write: Callable[[BinaryIO], None]) -> Path:
+        """Create an entry by calling `write` with an open file; returns its path."""
+        path = self.directory / f"{key}.pdf"
+        handle, partial = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as output:
+                write(output)
+            os.replace(partial, path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+        self._written += path.stat().st_size
+        if self._written >= self.max_bytes // 10:
+            self._written = 0
+            self.evict()
+        return path
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for path in self.directory.glob("*.pdf"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        # Temp files left behind by a crashed worker
+        cutoff = time.time() - 3600
+        for path in self.directory.glob("*.tmp"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` range into inclusive (start, end).
+
+    Returns None for no header, multiple ranges or anything unparseable (the
+    full body is sent), and raises ValueError for a range outside the file.
+    """
+    if not header:
+        return None
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+async def iter_file(file: BinaryIO, start: int = 0, length: Optional[int] = None, close: bool = True) -> AsyncIterator[bytes]:
+    """Yield `length` bytes of `file` from `start` in chunks, reading off the event loop."""
+    try:
+        await anyio.to_thread.run_sync(file.seek, start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            chunk = await anyio.to_thread.run_sync(file.read, size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        if close:
+            file.close()
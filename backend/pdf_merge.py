@@ -0,0 +1,30 @@
+"""Concatenate rendered PDFs into one file with a bookmark per document.
+
+Pages are copied as they are (no re-rendering), so any mix of invoices,
+quotations and letters can be merged from their cached renders. Objects that are
+byte-for-byte identical across the parts, such as a company's letterhead form
+and its embedded logo, are stored once in the merged file.
+"""
+from typing import BinaryIO, Iterable, Tuple
+
+from pypdf import PdfReader, PdfWriter
+
+KIND_TITLES = {"invoice": "Invoice", "quotation": "Quotation", "letter": "Letter"}
+
+
+def bookmark_title(kind: str, document: dict) -> str:
+    number = document.get(f"{kind}_number") or document.get("id", "")
+    if kind == "letter" and document.get("subject"):
+        return f"{KIND_TITLES[kind]} {number} - {document['subject']}"
+    return f"{KIND_TITLES[kind]} {number}"
+
+
+def merge_pdfs(parts: Iterable[Tuple[str, BinaryIO]], output: BinaryIO):
+    """Append each (bookmark title, PDF file) in order and write the result to `output`."""
+    writer = PdfWriter()
+    for title, file in parts:
+        file.seek(0)
+        writer.append(PdfReader(file), outline_item=title, import_outline=False)
+    writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+    writer.page_mode = "/UseOutlines"
+    writer.write(output)
@@ -0,0 +1,640 @@
+"""PDF rendering for invoices, quotations and letters.
+
+Renderers take plain, picklable dicts (documents as stored in MongoDB) and return
+the PDF bytes, or write them to a file object passed as `output`. Nothing here touches the database or HTTP, so the same code serves
+the API routes, batch jobs in worker processes, and benchmarks.
+"""
+import base64
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import BinaryIO, Optional
+
+from PIL import Image
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT, TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Flowable
+from reportlab.platypus import Image as RLImage
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from metrics import PDF_STAGE_SECONDS, StageTimer
+
+# Visual templates, selected by a document's `template_id`
+TEMPLATES = {
+    "template1": {
+        "invoice": {"accent": "#1e40af"},
+        "quotation": {"accent": "#059669"},
+        "letter": {},
+    },
+}
+DEFAULT_TEMPLATE = "template1"
+
+PRICED_LAYOUTS = {
+    "invoice": {
+        "title": "INVOICE",
+        "number_label": "Invoice Number:",
+        "until_label": "Due Date:",
+        "until_field": "due_date",
+        "info_widths": [100, 200, 80, 120],
+    },
+    "quotation": {
+        "title": "QUOTATION",
+        "number_label": "Quotation Number:",
+        "until_label": "Valid Until:",
+        "until_field": "valid_until",
+        "info_widths": [120, 180, 80, 120],
+    },
+}
+
+
+def resolve_template(kind: str, document: dict, template: Optional[str] = None) -> dict:
+    """Template settings for `kind`; unknown ids fall back to the default template."""
+    template_id = template or document.get("template_id") or DEFAULT_TEMPLATE
+    return TEMPLATES.get(template_id, TEMPLATES[DEFAULT_TEMPLATE])[kind]
+
+
+@lru_cache(maxsize=None)
+def sample_styles():
+    """ReportLab's sample stylesheet, built once per process; renderers only derive from it."""
+    return getSampleStyleSheet()
+
+
+class TimedCanvas(canvas.Canvas):
+    """Canvas that remembers how long writing out the finished PDF took."""
+    save_seconds = 0.0
+
+    def save(self):
+        start = time.perf_counter()
+        super().save()
+        self.save_seconds = time.perf_counter() - start
+
+
+def load_image(data_uri: str, max_width: int, max_height: int):
+    """Decode a base64 (data URI) image and shrink it to fit; returns (png_buffer, width, height)."""
+    image_data = data_uri.split(',')[1] if ',' in data_uri else data_uri
+    img = Image.open(io.BytesIO(base64.b64decode(image_data)))
+    img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format='PNG')
+    img_buffer.seek(0)
+    return img_buffer, img.width, img.height
+
+
+def format_currency(amount: float, currency: str) -> str:
+    if currency == "IDR":
+        return f"Rp {amount:,.0f}"
+    elif currency == "USD":
+        return f"${amount:,.2f}"
+    elif currency == "EUR":
+        return f"€{amount:,.2f}"
+    else:
+        return f"{currency} {amount:,.2f}"
+
+
+def _company_block(company: dict, logo=None) -> list:
+    """The left-aligned company details under the title of invoices and quotations
+    (without a logo)."""
+    story = []
+    styles = sample_styles()
+    company_style = ParagraphStyle('company', parent=styles['Normal'], fontSize=10, alignment=TA_LEFT)
+    story.append(Paragraph(f"<b>{company['name']}</b>", company_style))
+    story.append(Paragraph(company['address'], company_style))
+    story.append(Paragraph(f"Phone: {company['phone']} | Email: {company['email']}", company_style))
+    if company.get('npwp'):
+        story.append(Paragraph(f"NPWP: {company['npwp']}", company_style))
+    story.append(Spacer(1, 20))
+    return story
+
+
+def _letter_header(company: dict, logo=None) -> list:
+    """The centered "kop surat" of letters: logo, name, motto, contacts and a double rule.
+
+    `logo` is the decoded logo as (png_bytes, width, height), see letterhead_logo().
+    """
+    story = []
+    styles = sample_styles()
+    
+    # Company Header with Logo (Kop Surat) - Centered Layout
+    company_style = ParagraphStyle('company', parent=styles['Normal'], fontSize=11, alignment=TA_CENTER)
+    company_name_style = ParagraphStyle('company_name', parent=styles['Normal'], fontSize=14, alignment=TA_CENTER, spaceAfter=4)
+    company_motto_style = ParagraphStyle('company_motto', parent=styles['Normal'], fontSize=9, alignment=TA_CENTER, textColor=colors.HexColor('#666666'), fontName='Helvetica-Oblique')
+    
+    # Add logo if available (centered)
+    if logo:
+        logo_bytes, logo_width, logo_height = logo
+        logo_image = RLImage(io.BytesIO(logo_bytes), width=logo_width, height=logo_height)
+        
+        # Center logo in table
+        logo_table = Table([[logo_image]], colWidths=[500])
+        logo_table.setStyle(TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ]))
+        story.append(logo_table)
+        story.append(Spacer(1, 8))
+    
+    # Company name and details (centered)
+    story.append(Paragraph(f"<b>{company['name']}</b>", company_name_style))
+    
+    if company.get('motto'):
+        story.append(Paragraph(f"<i>{company.get('motto')}</i>", company_motto_style))
+        story.append(Spacer(1, 4))
+    
+    story.append(Paragraph(company.get('address', ''), company_style))
+    story.append(Paragraph(f"Tel: {company.get('phone', '')} | Email: {company.get('email', '')}", company_style))
+    
+    if company.get('website'):
+        story.append(Paragraph(f"Website: {company.get('website')}", company_style))
+    
+    # Line separator
+    story.append(Spacer(1, 10))
+    separator_table = Table([['']], colWidths=[500])
+    separator_table.setStyle(TableStyle([
+        ('LINEABOVE', (0, 0), (-1, 0), 2, colors.HexColor('#000000')),
+        ('LINEBELOW', (0, 0), (-1, 0), 1, colors.HexColor('#000000')),
+    ]))
+    story.append(separator_table)
+    story.append(Spacer(1, 20))
+    return story
+
+
+def letterhead_logo(company: dict):
+    """The company logo shrunk for the letterhead, as (png_bytes, width, height), or None."""
+    if not company.get('logo'):
+        return None
+    try:
+        return _png_bytes(load_image(company['logo'], 60, 60))
+    except Exception:
+        return None
+
+
+def _place(flowables: list, width: float):
+    """Place the flowables the way a frame would; returns ([(flowable, bottom offset, width)], height)."""
+    placements = []
+    cursor = 0
+    space_after = 0
+    for index, flowable in enumerate(flowables):
+        if index:
+            cursor += space_after + max(flowable.getSpaceBefore() - space_after, 0)
+        w, h = flowable.wrap(width, 1e6)
+        cursor += h
+        placements.append((flowable, cursor, w))
+        space_after = flowable.getSpaceAfter()
+    return placements, cursor
+
+
+class LetterheadLayout:
+    """What is kept of a company header between renders: the decoded logo and the
+    height measured per frame width.
+
+    Nothing here is ever drawn, so renders on any thread can share one instance;
+    each render draws its own flowables, built from it by `flowables()`.
+    """
+
+    def __init__(self, form_name: str, variant: str, company: dict):
+        self.form_name = form_name
+        self._build = LETTERHEAD_BUILDERS[variant]
+        self._company = dict(company)
+        self.logo = letterhead_logo(company) if variant == "letter" else None
+        flowables = self.flowables()
+        self.space_before = flowables[0].getSpaceBefore()
+        self.space_after = flowables[-1].getSpaceAfter()
+        self._heights = {}
+        self._lock = threading.Lock()
+
+    def flowables(self) -> list:
+        """New flowables of the header, for one render."""
+        return self._build(self._company, self.logo)
+
+    def height(self, width: float) -> float:
+        with self._lock:
+            height = self._heights.get(width)
+        if height is None:
+            _, height = _place(self.flowables(), width)
+            with self._lock:
+                self._heights[width] = height
+        return height
+
+
+class Letterhead(Flowable):
+    """A company header drawn as a PDF form XObject, so each PDF stores it once
+    however many pages stamp it.
+
+    One instance per render; the layout behind it is shared. The header flowables
+    are only built and drawn when the form is not yet defined on this canvas.
+    """
+
+    def __init__(self, layout: LetterheadLayout):
+        super().__init__()
+        self.layout = layout
+
+    def getSpaceBefore(self):
+        return self.layout.space_before
+
+    def getSpaceAfter(self):
+        return self.layout.space_after
+
+    def wrap(self, availWidth, availHeight):
+        self.width, self.height = availWidth, self.layout.height(availWidth)
+        return self.width, self.height
+
+    def draw(self):
+        name = f"{self.layout.form_name}_{int(self.width)}"
+        if not self.canv.hasForm(name):
+            placements, height = _place(self.layout.flowables(), self.width)
+            # Generous bounding box: forms clip to it and wide tables overhang the frame
+            self.canv.beginForm(name, -self.width, -height, 2 * self.width, 2 * height)
+            for flowable, bottom, w in placements:
+                flowable.drawOn(self.canv, 0, height - bottom, _sW=self.width - w)
+            self.canv.endForm()
+        self.canv.doForm(name)
+
+
+LETTERHEAD_BUILDERS = {"letter": _letter_header, "block": _company_block}
+LETTERHEAD_CACHE_SIZE = 256
+_letterheads = OrderedDict()
+_letterheads_lock = threading.Lock()
+
+
+def letterhead(company: dict, variant: str) -> Letterhead:
+    """The header for `company` in one render. Its layout is cached per company
+    revision; a new revision builds a new one."""
+    key = (company.get('id'), company.get('revision', 0), variant)
+    with _letterheads_lock:
+        layout = _letterheads.get(key)
+        if layout is not None:
+            _letterheads.move_to_end(key)
+    if layout is None:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        built = LetterheadLayout(f"LH{digest}", variant, company)
+        with _letterheads_lock:
+            layout = _letterheads.setdefault(key, built)
+            _letterheads.move_to_end(key)
+            while len(_letterheads) > LETTERHEAD_CACHE_SIZE:
+                _letterheads.popitem(last=False)
+    return Letterhead(layout)
+
+
+def _render_priced_document(kind: str, document: dict, company: dict, template: Optional[str], timer: Optional[StageTimer],
+                            output: Optional[BinaryIO] = None) -> Optional[bytes]:
+    """Shared layout of invoices and quotations: company block, info, items, totals, signature."""
+    layout = PRICED_LAYOUTS[kind]
+    accent = colors.HexColor(resolve_template(kind, document, template)["accent"])
+    timer = timer or StageTimer(PDF_STAGE_SECONDS, kind)
+    buffer = output if output is not None else io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=50, leftMargin=50, topMargin=50, bottomMargin=50)
+    
+    story = []
+    styles = sample_styles()
+    
+    # Header
+    header_style = ParagraphStyle('header', parent=styles['Heading1'], fontSize=24, textColor=accent, alignment=TA_CENTER)
+    story.append(Paragraph(layout["title"], header_style))
+    story.append(Spacer(1, 20))
+    
+    # Company Info
+    story.append(letterhead(company, "block"))
+    
+    # Document Info
+    info_data = [
+        [layout["number_label"], document[f"{kind}_number"], "Date:", document['date']],
+        ["Client:", document['client_name'], layout["until_label"], document.get(layout["until_field"], '-')],
+    ]
+    info_table = Table(info_data, colWidths=layout["info_widths"])
+    info_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ]))
+    story.append(info_table)
+    story.append(Spacer(1, 20))
+    
+    # Items Table
+    items_data = [['Item', 'Description', 'Qty', 'Unit Price', 'Total']]
+    for item in document['items']:
+        items_data.append([
+            item['name'],
+            item['description'],
+            f"{item['quantity']} {item['unit']}",
+            format_currency(item['unit_price'], document['currency']),
+            format_currency(item['total'], document['currency'])
+        ])
+    
+    items_table = Table(items_data, colWidths=[120, 150, 60, 80, 90])
+    items_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), accent),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.white]),
+    ]))
+    story.append(items_table)
+    story.append(Spacer(1, 20))
+    
+    # Summary
+    summary_data = [
+        ['Subtotal:', format_currency(document['subtotal'], document['currency'])],
+    ]
+    if document.get('discount_amount', 0) > 0:
+        summary_data.append([f"Discount ({document.get('discount_rate', 0)}%):", format_currency(document['discount_amount'], document['currency'])])
+    if document.get('tax_amount', 0) > 0:
+        summary_data.append([f"Tax ({document.get('tax_rate', 0)}%):", format_currency(document['tax_amount'], document['currency'])])
+    summary_data.append(['Total:', format_currency(document['total'], document['currency'])])
+    
+    summary_table = Table(summary_data, colWidths=[350, 150])
+    summary_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ('LINEABOVE', (0, -1), (-1, -1), 2, accent),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, -1), (-1, -1), 12),
+    ]))
+    story.append(summary_table)
+    
+    if document.get('notes'):
+        story.append(Spacer(1, 20))
+        story.append(Paragraph(f"<b>Notes:</b>", styles['Normal']))
+        story.append(Paragraph(document['notes'], styles['Normal']))
+    
+    if company.get('bank_name'):
+        story.append(Spacer(1, 30))
+        story.append(Paragraph("<b>Payment Details:</b>", styles['Normal']))
+        story.append(Paragraph(f"Bank: {company['bank_name']}", styles['Normal']))
+        story.append(Paragraph(f"Account: {company['bank_account']}", styles['Normal']))
+        story.append(Paragraph(f"Account Name: {company['bank_account_name']}", styles['Normal']))
+    
+    # Signature section
+    if document.get('signature_name') or document.get('signature_position'):
+        story.append(Spacer(1, 40))
+        signature_style = ParagraphStyle('signature', parent=styles['Normal'], fontSize=10, alignment=TA_RIGHT)
+        story.append(Paragraph("<b>Authorized Signature:</b>", signature_style))
+        story.append(Spacer(1, 40))
+        if document.get('signature_name'):
+            story.append(Paragraph(f"<b>{document['signature_name']}</b>", signature_style))
+        if document.get('signature_position'):
+            story.append(Paragraph(document['signature_position'], signature_style))
+    
+    timer.lap("story")
+    doc.build(story, canvasmaker=TimedCanvas)
+    timer.lap("build", nested={"serialize": doc.canv.save_seconds})
+    return None if output is not None else buffer.getvalue()
+
+
+def render_invoice(invoice: dict, company: dict, template: Optional[str] = None, timer: Optional[StageTimer] = None,
+                   output: Optional[BinaryIO] = None) -> Optional[bytes]:
+    return _render_priced_document("invoice", invoice, company, template, timer, output)
+
+
+def render_quotation(quotation: dict, company: dict, template: Optional[str] = None, timer: Optional[StageTimer] = None,
+                     output: Optional[BinaryIO] = None) -> Optional[bytes]:
+    return _render_priced_document("quotation", quotation, company, template, timer, output)
+
+
+def _png_bytes(image):
+    png_buffer, width, height = image
+    return png_buffer.getvalue(), width, height
+
+
+def letter_images(letter: dict, company: dict):
+    """Decode and resize the signature images of a letter (the logo is part of the
+    cached letterhead).
+
+    Returns one (png_bytes, width, height) or None per signatory; plain bytes, so
+    the result can be reused across renders and processes.
+    """
+    signature_images = []
+    for sig in letter.get('signatories') or []:
+        sig_image = None
+        if sig.get('signature_image'):
+            try:
+                # 2x larger than the logo for better visibility
+                sig_image = _png_bytes(load_image(sig['signature_image'], 160, 80))
+            except Exception:
+                pass
+        signature_images.append(sig_image)
+    return signature_images
+
+
+def _letter_story(letter: dict, company: dict, signature_images) -> list:
+    story = []
+    styles = sample_styles()
+    
+    story.append(letterhead(company, "letter"))
+    
+    # Letter Number and Date
+    letter_info_style = ParagraphStyle('letterinfo', parent=styles['Normal'], fontSize=10, alignment=TA_LEFT)
+    story.append(Paragraph(f"Nomor: {letter['letter_number']}", letter_info_style))
+    story.append(Paragraph(f"Tanggal: {letter['date']}", letter_info_style))
+    
+    if letter.get('attachments_count', 0) > 0:
+        story.append(Paragraph(f"Lampiran: {letter['attachments_count']} berkas", letter_info_style))
+    
+    story.append(Paragraph(f"Perihal: <b>{letter['subject']}</b>", letter_info_style))
+    story.append(Spacer(1, 20))
+    
+    # Recipient
+    story.append(Paragraph("Kepada Yth,", styles['Normal']))
+    story.append(Paragraph(f"<b>{letter['recipient_name']}</b>", styles['Normal']))
+    if letter.get('recipient_position'):
+        story.append(Paragraph(letter['recipient_position'], styles['Normal']))
+    if letter.get('recipient_address'):
+        story.append(Paragraph(letter['recipient_address'], styles['Normal']))
+    story.append(Spacer(1, 20))
+    
+    # Greeting based on letter type
+    if letter['letter_type'] == 'general':
+        story.append(Paragraph("Dengan hormat,", styles['Normal']))
+    elif letter['letter_type'] == 'cooperation':
+        story.append(Paragraph("Dengan hormat,", styles['Normal']))
+    elif letter['letter_type'] == 'request':
+        story.append(Paragraph("Dengan hormat,", styles['Normal']))
+    
+    story.append(Spacer(1, 12))
+    
+    # Letter Content
+    content_style = ParagraphStyle('content', parent=styles['Normal'], fontSize=11, alignment=TA_JUSTIFY, leading=16)
+    
+    # Split content by paragraphs
+    paragraphs = letter['content'].split('\n')
+    for para in paragraphs:
+        if para.strip():
+            story.append(Paragraph(para.strip(), content_style))
+            story.append(Spacer(1, 8))
+    
+    story.append(Spacer(1, 12))
+    
+    # Closing based on letter type
+    if letter['letter_type'] == 'general':
+        story.append(Paragraph("Demikian surat ini kami sampaikan. Atas perhatian dan kerjasamanya, kami ucapkan terima kasih.", styles['Normal']))
+    elif letter['letter_type'] == 'cooperation':
+        story.append(Paragraph("Demikian surat penawaran kerjasama ini kami sampaikan. Besar harapan kami dapat menjalin kerjasama yang baik dengan perusahaan Bapak/Ibu.", styles['Normal']))
+    elif letter['letter_type'] == 'request':
+        story.append(Paragraph("Demikian permohonan ini kami sampaikan, atas perhatian dan perkenannya kami ucapkan terima kasih.", styles['Normal']))
+    
+    story.append(Spacer(1, 30))
+    
+    # Signatories
+    if letter.get('signatories') and len(letter['signatories']) > 0:
+        sig_data = []
+        sig_widths = []
+        
+        num_sigs = len(letter['signatories'])
+        col_width = 500 // num_sigs
+        
+        for sig, sig_image in zip(letter['signatories'], signature_images):
+            sig_content = []
+            sig_style = ParagraphStyle('sig', parent=styles['Normal'], fontSize=10, alignment=TA_CENTER)
+            
+            sig_content.append(Paragraph(sig.get('position', ''), sig_style))
+            sig_content.append(Spacer(1, 5))
+            
+            # Add signature image if available
+            if sig_image:
+                sig_img_data, sig_width, sig_height = sig_image
+                sig_content.append(RLImage(io.BytesIO(sig_img_data), width=sig_width, height=sig_height))
+            else:
+                sig_content.append(Spacer(1, 80))
+            
+            sig_content.append(Spacer(1, 5))
+            sig_content.append(Paragraph(f"<b>{sig.get('name', '')}</b>", sig_style))
+            
+            sig_data.append(sig_content)
+            sig_widths.append(col_width)
+        
+        # Create signature table
+        sig_table = Table([sig_data], colWidths=sig_widths)
+        sig_table.setStyle(TableStyle([
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ]))
+        story.append(sig_table)
+    
+    # CC List
+    if letter.get('cc_list'):
+        story.append(Spacer(1, 30))
+        story.append(Paragraph("<b>Tembusan:</b>", styles['Normal']))
+        cc_items = letter['cc_list'].split('\n')
+        for cc in cc_items:
+            if cc.strip():
+                story.append(Paragraph(f"- {cc.strip()}", styles['Normal']))
+    
+    return story
+
+
+def render_letter(letter: dict, company: dict, template: Optional[str] = None, timer: Optional[StageTimer] = None,
+                  output: Optional[BinaryIO] = None) -> Optional[bytes]:
+    """Render a letter. Letters have a single layout, so `template` is accepted for
+    symmetry with the other renderers and otherwise ignored."""
+    timer = timer or StageTimer(PDF_STAGE_SECONDS, "letter")
+    images = letter_images(letter, company)
+    timer.lap("images")
+    
+    buffer = output if output is not None else io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    story = _letter_story(letter, company, images)
+    
+    timer.lap("story")
+    doc.build(story, canvasmaker=TimedCanvas)
+    timer.lap("build", nested={"serialize": doc.canv.save_seconds})
+    return None if output is not None else buffer.getvalue()
+
+
+def render_merged_letters(letters: list, company: dict, images=None, output: Optional[BinaryIO] = None) -> Optional[bytes]:
+    """Render letters that share a company and signatories (a mail merge) into one
+    PDF, each starting on a new page. Signatures are decoded once, from the first
+    letter unless `images` is given, and the PDF embeds each image and the
+    letterhead only once."""
+    images = letter_images(letters[0], company) if images is None else images
+    story = []
+    for letter in letters:
+        if story:
+            story.append(PageBreak())
+        story.extend(_letter_story(letter, company, images))
+    buffer = output if output is not None else io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    doc.build(story)
+    return None if output is not None else buffer.getvalue()
+
+
+RENDERERS = {
+    "invoice": render_invoice,
+    "quotation": render_quotation,
+    "letter": render_letter,
+}
+
+
+def render_document(kind: str, document: dict, company: dict, template: Optional[str] = None, timer: Optional[StageTimer] = None,
+                    output: Optional[BinaryIO] = None) -> Optional[bytes]:
+    """Render by document kind; a top-level function so it can be sent to a process pool.
+
+    ReportLab assembles the whole file in memory and writes it out when the
+    document is saved, so `output` saves a copy of the PDF but does not let pages
+    go out before the last one is laid out.
+    """
+    return RENDERERS[kind](document, company, template, timer, output)
+
+
+def warm_up() -> dict:
+    """Render a tiny invoice, quotation and letter so font metrics, styles and the
+    PNG codec are loaded before the first real request; returns seconds per kind."""
+    pixel = io.BytesIO()
+    Image.new('RGB', (8, 8), 'white').save(pixel, format='PNG')
+    image = "data:image/png;base64," + base64.b64encode(pixel.getvalue()).decode()
+    company = {
+        "id": "warm-up", "name": "Warm-up", "address": "-", "phone": "-", "email": "-", "website": "-",
+        "motto": "-", "npwp": "-", "bank_name": "-", "bank_account": "-", "bank_account_name": "-", "logo": image,
+    }
+    priced = {
+        "id": "warm-up", "company_id": "warm-up", "client_name": "-", "date": "-",
+        "items": [{"name": "-", "description": "-", "quantity": 1, "unit_price": 1, "unit": "pcs", "total": 1}],
+        "subtotal": 1, "discount_rate": 10, "discount_amount": 0.1, "tax_rate": 11, "tax_amount": 0.1, "total": 1,
+        "currency": "IDR", "notes": "-", "signature_name": "-", "signature_position": "-",
+    }
+    documents = {
+        "invoice": {**priced, "invoice_number": "0"},
+        "quotation": {**priced, "quotation_number": "0"},
+        "letter": {
+            "id": "warm-up", "company_id": "warm-up", "letter_number": "0", "date": "-", "subject": "-",
+            "letter_type": "general", "recipient_name": "-", "content": "-", "attachments_count": 1, "cc_list": "-",
+            "signatories": [{"name": "-", "position": "-", "signature_image": image}],
+        },
+    }
+    seconds = {}
+    for kind, document in documents.items():
+        start = time.perf_counter()
+        # A throwaway timer keeps warm-up renders out of the stage metrics
+        render_document(kind, document, company, timer=StageTimer(None, kind))
+        seconds[kind] = time.perf_counter() - start
+    return seconds
+
+
+def pdf_filename(kind: str, document: dict) -> str:
+    number = document.get(f"{kind}_number") or document.get("id", "")
+    if kind == "letter":
+        number = number.replace('/', '_')
+    return f"{kind}_{number}.pdf"
+
+
+def document_stats(kind: str, document: dict, company: dict) -> dict:
+    """Size indicators of a document, for slow-render records."""
+    images = 1 if kind == "letter" and company.get('logo') else 0
+    if kind != "letter":
+        return {"items": len(document.get('items') or []), "images": images}
+    signatories = document.get('signatories') or []
+    return {
+        "paragraphs": document['content'].count('\n') + 1,
+        "signatories": len(signatories),
+        "images": images + sum(1 for sig in signatories if sig.get('signature_image')),
+    }
@@ -0,0 +1,202 @@
+"""Batch PDF renderer.
+
+Streams invoices, quotations or letters from MongoDB and renders them across all
+cores with the same code as the /pdf endpoints, writing into a directory or a ZIP.
+Progress is checkpointed so an interrupted run picks up where it stopped.
+Deleted documents are left out; archived ones are included on request.
+
+    cd backend
+    python -m render invoices --year 2024 --out /archive/invoices-2024.zip
+    python -m render invoices --year 2019 --include-archived --out /archive/invoices-2019.zip
+    python -m render letters --query '{"letter_type": "cooperation"}' --out /archive/letters --workers 8
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from archive import LIVE, archive_name
+from pdf_render import pdf_filename, render_document
+
+ROOT_DIR = Path(__file__).parent
+logger = logging.getLogger("render")
+
+KINDS = {"invoices": "invoice", "quotations": "quotation", "letters": "letter"}
+
+
+def render_chunk(kind: str, jobs: list) -> list:
+    """Render (document, company) pairs in a worker; returns (id, filename, pdf or None, error)."""
+    results = []
+    for document, company in jobs:
+        try:
+            results.append((document["id"], pdf_filename(kind, document), render_document(kind, document, company), None))
+        except Exception as exc:
+            results.append((document["id"], pdf_filename(kind, document), None, repr(exc)))
+    return results
+
+
+class Output:
+    """Writes PDFs into a directory, or stages them and packs a ZIP at the end.
+
+    Names include the document id so a resumed run overwrites rather than
+    duplicates anything the interrupted run wrote after its last checkpoint.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.is_zip = path.suffix.lower() == ".zip"
+        self.directory = path.with_name(path.name + ".parts") if self.is_zip else path
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def write(self, doc_id: str, filename: str, pdf: bytes):
+        stem = Path(filename.replace('/', '_').replace('\\', '_')).stem
+        target = self.directory / f"{stem}_{doc_id}.pdf"
+        partial = target.with_suffix(".tmp")
+        partial.write_bytes(pdf)
+        os.replace(partial, target)
+
+    def close(self):
+        if not self.is_zip:
+            return
+        # PDF streams are already compressed; storing avoids burning CPU for nothing
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_STORED) as archive:
+            for entry in sorted(self.directory.glob("*.pdf")):
+                archive.write(entry, entry.name)
+        shutil.rmtree(self.directory)
+
+
+class Checkpoint:
+    def __init__(self, path: Path, restart: bool):
+        self.path = path
+        if restart and path.exists():
+            path.unlink()
+        self.done = set(path.read_text().split()) if path.exists() else set()
+        self.pending = []
+
+    def add(self, doc_id: str):
+        self.pending.append(doc_id)
+
+    def commit(self):
+        if self.pending:
+            with self.path.open("a") as handle:
+                handle.write("\n".join(self.pending) + "\n")
+            self.done.update(self.pending)
+            self.pending = []
+
+
+def build_query(args) -> dict:
+    query = json.loads(args.query) if args.query else {}
+    if args.year:
+        # Invoice dates are ISO ("2024-03-01"), letter dates are free text ("1 Maret 2024")
+        query["date"] = {"$regex": str(args.year)}
+    return {"$and": [query, LIVE]} if query else dict(LIVE)
+
+
+def iter_documents(db, collection: str, query: dict, include_archived: bool):
+    yield from db[collection].find(query, {"_id": 0}, batch_size=500)
+    if include_archived:
+        yield from db[archive_name(collection)].find(query, {"_id": 0, "archived_at": 0}, batch_size=500)
+
+
+def iter_jobs(db, collection: str, query: dict, checkpoint: Checkpoint, chunk_size: int, include_archived: bool = False):
+    """Yield chunks of (document, company) pairs still to be rendered."""
+    companies = {}
+    chunk = []
+    for document in iter_documents(db, collection, query, include_archived):
+        if document["id"] in checkpoint.done:
+            continue
+        company_id = document.get("company_id")
+        if company_id not in companies:
+            companies[company_id] = db.companies.find_one({"id": company_id}, {"_id": 0})
+        company = companies[company_id]
+        if company is None:
+            logger.warning("Skipping %s %s: company %s not found", collection, document["id"], company_id)
+            continue
+        chunk.append((document, company))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(args) -> int:
+    load_dotenv(ROOT_DIR / '.env')
+    kind = KINDS[args.kind]
+    db = MongoClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+    output = Output(Path(args.out))
+    checkpoint = Checkpoint(Path(args.checkpoint or f"{args.out}.checkpoint"), args.restart)
+    if checkpoint.done:
+        logger.info("Resuming: %d documents already rendered", len(checkpoint.done))
+
+    rendered = failed = 0
+    start = last_report = time.perf_counter()
+    jobs = iter_jobs(db, args.kind, build_query(args), checkpoint, args.chunk_size, args.include_archived)
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        in_flight = set()
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < args.workers * 2:
+                chunk = next(jobs, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    in_flight.add(pool.submit(render_chunk, kind, chunk))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                for doc_id, filename, pdf, error in future.result():
+                    if error:
+                        failed += 1
+                        logger.error("Failed to render %s %s: %s", kind, doc_id, error)
+                        continue
+                    output.write(doc_id, filename, pdf)
+                    checkpoint.add(doc_id)
+                    rendered += 1
+            if len(checkpoint.pending) >= args.checkpoint_every:
+                checkpoint.commit()
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                last_report = now
+                logger.info("%d rendered, %d failed, %.1f docs/s", rendered, failed, rendered / (now - start))
+    checkpoint.commit()
+    if not failed:
+        output.close()
+        checkpoint.path.unlink(missing_ok=True)
+    elif output.is_zip:
+        logger.warning("Not packing %s until the failed documents render; rerun to retry them", args.out)
+
+    elapsed = time.perf_counter() - start
+    logger.info("Done: %d rendered, %d failed in %.1fs (%.1f docs/s)", rendered, failed, elapsed, rendered / elapsed if elapsed else 0)
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=sorted(KINDS))
+    parser.add_argument("--out", required=True, help="output directory, or a path ending in .zip")
+    parser.add_argument("--query", help="MongoDB filter as JSON")
+    parser.add_argument("--year", type=int, help="only documents dated in this year")
+    parser.add_argument("--include-archived", action="store_true", help="also render documents moved to the archive")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=16, help="documents per worker task")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <out>.checkpoint)")
+    parser.add_argument("--checkpoint-every", type=int, default=500, help="documents between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Carry catalog price changes into draft invoices and quotations.
+
+Line items keep the `item_id` of the catalog item they were picked from. A
+repricing job sets the current catalog price on every draft line that links to a
+repriced item and recomputes line totals, subtotal, discount, tax and total the
+same way the invoice and quotation forms do. The work is done by MongoDB with
+pipeline updates, found through the `items.item_id` index; only the id, number,
+revision and old and new totals of affected documents come back for the report.
+Each update is conditional on the revision the preview saw, so a document edited
+in between is left alone and reported as a conflict. Every repriced document
+gets a revision history record, like any other update.
+"""
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from archive import LIVE
+from history import SNAPSHOT_EVERY, record_versions
+
+# Collection and number field of the documents that are repriced
+REPRICED_COLLECTIONS = {"invoices": "invoice_number", "quotations": "quotation_number"}
+# Only drafts follow the catalog; sent documents keep the price they were sent with
+REPRICED_STATUS = "draft"
+
+# Same order as the forms: discount on the subtotal, tax on what is left
+TOTALS_STAGES = [
+    {"$set": {"subtotal": {"$sum": "$items.total"}}},
+    {"$set": {"discount_amount": {"$divide": [{"$multiply": ["$subtotal", {"$ifNull": ["$discount_rate", 0]}]}, 100]}}},
+    {"$set": {"tax_amount": {"$divide": [
+        {"$multiply": [{"$subtract": ["$subtotal", "$discount_amount"]}, {"$ifNull": ["$tax_rate", 0]}]}, 100]}}},
+    {"$set": {"total": {"$add": [{"$subtract": ["$subtotal", "$discount_amount"]}, "$tax_amount"]}}},
+]
+
+
+def affected_filter(prices: Dict[str, float]) -> dict:
+    """Drafts with a line whose item is repriced and whose price differs."""
+    return {
+        "status": REPRICED_STATUS,
+        **LIVE,
+        "$or": [
+            {"items": {"$elemMatch": {"item_id": item_id, "unit_price": {"$ne": price}}}}
+            for item_id, price in prices.items()
+        ],
+    }
+
+
+def repricing_stages(prices: Dict[str, float]) -> List[dict]:
+    """Pipeline stages that set the new prices on matching lines and recompute the totals."""
+    new_price = {"$switch": {
+        "branches": [{"case": {"$eq": ["$$line.item_id", item_id]}, "then": price} for item_id, price in prices.items()],
+        "default": None,
+    }}
+    lines = {"$map": {"input": "$items", "as": "line", "in": {"$let": {
+        "vars": {"price": new_price},
+        "in": {"$cond": [
+            {"$eq": ["$$price", None]},
+            "$$line",
+            {"$mergeObjects": ["$$line", {"unit_price": "$$price", "total": {"$multiply": ["$$line.quantity", "$$price"]}}]},
+        ]},
+    }}}}
+    return [{"$set": {"items": lines}}] + TOTALS_STAGES
+
+
+async def preview(collection, number_field: str, prices: Dict[str, float], max_time_ms: Optional[int] = None) -> List[dict]:
+    """Id, number, revision and old and new total of every document the job would change."""
+    pipeline = [
+        {"$match": affected_filter(prices)},
+        {"$set": {"old_total": "$total"}},
+        *repricing_stages(prices),
+        {"$project": {"_id": 0, "id": 1, "number": f"${number_field}", "revision": 1, "old_total": 1, "new_total": "$total"}},
+    ]
+    options = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+    return await collection.aggregate(pipeline, **options).to_list(None)
+
+
+async def reprice_drafts(db, prices: Dict[str, float], stamp: dict, dry_run: bool = False,
+                         max_time_ms: Optional[int] = None, snapshot_every: int = SNAPSHOT_EVERY) -> Dict[str, dict]:
+    """Reprice drafts in every repriced collection with one bulk write each.
+
+    `stamp` (revision and updated_at) is set on every changed document, and the
+    version it replaces is recorded in the history. Returns per collection the
+    repriced documents, those changed since the preview (`conflicts`, left as
+    they are) and the matched and modified counts.
+    """
+    report = {}
+    for name, number_field in REPRICED_COLLECTIONS.items():
+        collection = db[name]
+        documents = await preview(collection, number_field, prices, max_time_ms)
+        matched = modified = 0
+        conflicts = []
+        if documents and not dry_run:
+            affected = affected_filter(prices)
+            # The versions the updates are conditional on, for the history
+            previous = {document["id"]: document async for document in collection.find(
+                {"$or": [{"id": document["id"], "revision": document.get("revision")} for document in documents]}, {"_id": 0})}
+            result = await collection.bulk_write([
+                UpdateOne({**affected, "id": document["id"], "revision": document.get("revision")},
+                          repricing_stages(prices) + [{"$set": stamp}])
+                for document in documents
+            ], ordered=False)
+            matched, modified = result.matched_count, result.modified_count
+            repriced = {document["id"]: document async for document in collection.find(
+                {"id": {"$in": [document["id"] for document in documents]}, "revision": stamp["revision"]}, {"_id": 0})}
+            await record_versions(db, name, [(previous[doc_id], current) for doc_id, current in repriced.items()
+                                             if doc_id in previous], snapshot_every)
+            conflicts = [document for document in documents if document["id"] not in repriced]
+            documents = [document for document in documents if document["id"] in repriced]
+        report[name] = {"matched": matched, "modified": modified, "documents": documents, "conflicts": conflicts}
+    return report
@@ -1,36 +1,100 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Request, Header, Depends, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response, JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReadPreference, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ExecutionTimeout, OperationFailure
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import base64
 import io
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER, TA_JUSTIFY
-from reportlab.pdfgen import canvas
-from PIL import Image
+import asyncio
+import tempfile
+import csv
+import re
+from events import ChangeBroker, event_stream, supports_change_streams, watch_change_streams
+from metrics import REGISTRY, PDF_STAGE_SECONDS, PDF_CACHE_REQUESTS, THUMBNAIL_CACHE_REQUESTS, CommandTimingListener, MetricsMiddleware, PoolMetricsListener, StageTimer
+from admission import AdmissionMiddleware, limits_from_env
+from compression import CompressionMiddleware, parse_route_levels
+from diagnostics import ProfileSort, SlowLog, SlowCommandListener, SlowRequestMiddleware, RenderProfiler
+from pdf_cache import PdfCache, iter_file, parse_range
+from mail_merge import merge_digest, missing_fields, parse_recipients_csv
+from repricing import REPRICED_COLLECTIONS, reprice_drafts
+from export import BATCH_SIZE as EXPORT_BATCH_SIZE, EXPORTS, FORMATS as EXPORT_FORMATS, ROW_MODES, XlsxWriter, build_query, csv_bytes, csv_header, row_batches
+from export import columns as export_columns, projection as export_projection
+from importer import CHUNK_SIZE as IMPORT_CHUNK_SIZE, MAX_REPORTED_ERRORS, chunks, dedupe_key, defaults, read_rows, validate_chunk
+from archive import ARCHIVED_COLLECTIONS, LIVE, archive_name, ensure_archive_collections, restore_document, run_archive
+from history import DUPLICATE_KEY, HISTORY_COLLECTIONS, list_revisions, load_version, record_versions
+from thumbnails import FORMATS as THUMBNAIL_FORMATS, MAX_WIDTH as THUMBNAIL_MAX_WIDTH, MIN_WIDTH as THUMBNAIL_MIN_WIDTH, ThumbnailCache
+import secrets
+
+# ReportLab, PIL and Motor are imported where they are first used, so booting a
+# worker (or importing this module in a test) does not pay for the PDF stack.
 
 ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Process-wide state. create_app() configures it from the environment and the
+# lifespan opens the MongoDB client; nothing connects at import time.
+client = None
+db = None
+slow_log = SlowLog()
+slow_commands = SlowCommandListener(slow_log)
+render_profiler = RenderProfiler()
+ADMIN_TOKEN = ''
+
+# Rendered PDFs are kept on disk (None disables the cache); uncached renders are
+# spooled in memory up to PDF_SPOOL_MAX_BYTES before going to a temp file
+pdf_cache = None
+PDF_SPOOL_MAX_BYTES = 1024 * 1024
+
+# Mail-merge ZIPs are rendered on a process pool, started on first use
+MAIL_MERGE_MAX_RECIPIENTS = 5000
+merge_pool = None
+
+# Invoices created from quotations are numbered from a counter
+INVOICE_NUMBER_FORMAT = 'INV-{year}-{seq:05d}'
+CONVERT_MAX_QUOTATIONS = 500
+
+# Documents per /api/pdf/merge request
+PDF_MERGE_MAX_DOCUMENTS = 50
+
+# Deleted documents, and closed ones older than ARCHIVE_AFTER_DAYS, are moved to
+# archive collections by the archive job
+ARCHIVE_AFTER_DAYS = 730
+ARCHIVE_DELETED_AFTER_DAYS = 30
+ARCHIVE_COMPRESSOR = 'zstd'
+
+# Updates of invoices, quotations and letters append a patch to their history,
+# with a full snapshot every HISTORY_SNAPSHOT_EVERY versions
+HISTORY_SNAPSHOT_EVERY = 20
 
-# Create the main app without a prefix
-app = FastAPI()
+# Encoded thumbnails are kept in memory (None disables the cache)
+thumbnail_cache = None
+THUMBNAIL_BATCH_MAX = 100
+
+# List reads may be sent to secondaries and are cut off after LIST_MAX_TIME_MS
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+list_read_preference = ReadPreference.PRIMARY
+LIST_MAX_TIME_MS = 10000
+
+# Live change events: fed by MongoDB change streams when the deployment supports
+# them, otherwise published in-process by the write handlers below.
+change_broker = ChangeBroker()
+events_source = "local"
+
+logger = logging.getLogger(__name__)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -51,6 +115,8 @@ class Company(BaseModel):
     bank_account_name: str = ""
     logo: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+    revision: int = 0
 
 class CompanyCreate(BaseModel):
     name: str
@@ -73,6 +139,8 @@ class Item(BaseModel):
     unit_price: float
     unit: str = "pcs"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+    revision: int = 0
 
 class ItemCreate(BaseModel):
     name: str
@@ -114,6 +182,9 @@ class Invoice(BaseModel):
     signature_name: str = ""
     signature_position: str = ""
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+    quotation_id: Optional[str] = None
+    revision: int = 0
 
 class InvoiceCreate(BaseModel):
     invoice_number: str
@@ -163,6 +234,9 @@ class Quotation(BaseModel):
     signature_name: str = ""
     signature_position: str = ""
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+    invoice_id: Optional[str] = None
+    revision: int = 0
 
 class QuotationCreate(BaseModel):
     quotation_number: str
@@ -208,6 +282,8 @@ class Letter(BaseModel):
     cc_list: str = ""
     signatories: List[Signatory] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+    revision: int = 0
 
 class LetterCreate(BaseModel):
     letter_number: str
@@ -223,24 +299,333 @@ class LetterCreate(BaseModel):
     cc_list: str = ""
     signatories: List[Signatory] = []
 
+class MailMergeRequest(BaseModel):
+    letter: LetterCreate
+    recipients: List[Dict[str, str]]
+    output: str = "pdf"
+
+class RepriceRequest(BaseModel):
+    item_ids: List[str]
+    dry_run: bool = False
+
+class ConvertQuotationRequest(BaseModel):
+    invoice_number: Optional[str] = None
+    date: Optional[str] = None
+    due_date: str = ""
+
+class ConvertQuotationsRequest(BaseModel):
+    quotation_ids: List[str]
+    date: Optional[str] = None
+    due_date: str = ""
+
+class PdfReference(BaseModel):
+    kind: str
+    id: str
+    title: Optional[str] = None
+
+class PdfMergeRequest(BaseModel):
+    documents: List[PdfReference]
+    filename: Optional[str] = None
+
+class ThumbnailBatchRequest(BaseModel):
+    documents: List[PdfReference]
+    width: int = Field(200, ge=THUMBNAIL_MIN_WIDTH, le=THUMBNAIL_MAX_WIDTH)
+    format: str = "webp"
+
+# Change tracking
+# Every write takes the next value of a global revision counter, so clients can
+# ask for "everything after revision N" across all collections in one call.
+SYNCED_COLLECTIONS = ["companies", "items", "invoices", "quotations", "letters"]
+# A revision is taken before the write that carries it commits, so a lower revision
+# can become visible after a higher one, and a bulk job's documents under one
+# revision appear over time. /api/changes only moves `next` past revisions stamped
+# at least CHANGES_SETTLE_MS ago; it must exceed the longest write and the clock
+# skew between servers.
+CHANGES_SETTLE_MS = 5000
+
+async def next_revision(count: int = 1) -> int:
+    """Reserve `count` revisions and return the highest one."""
+    counter = await db.counters.find_one_and_update(
+        {"_id": "revision"},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["seq"]
+
+async def change_stamp() -> dict:
+    return {
+        "revision": await next_revision(),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+def publish_change(collection: str, op: str, doc_id: str, revision: int):
+    if events_source == "local":
+        change_broker.publish(collection, op, doc_id, revision)
+
+async def record_deletion(collection: str, doc_id: str):
+    stamp = await change_stamp()
+    await db.tombstones.update_one(
+        {"collection": collection, "id": doc_id},
+        {"$set": {"revision": stamp["revision"], "deleted_at": stamp["updated_at"]}},
+        upsert=True,
+    )
+    publish_change(collection, "delete", doc_id, stamp["revision"])
+
+def stamped_at(change: dict) -> Optional[datetime]:
+    """When the revision of a change was taken; None for documents numbered before
+    revisions were stamped."""
+    value = change["document"].get("updated_at") if change["op"] == "upsert" else change.get("deleted_at")
+    if not value:
+        return None
+    stamped = datetime.fromisoformat(value)
+    return stamped if stamped.tzinfo else stamped.replace(tzinfo=timezone.utc)
+
+def settled_revision(changes: List[dict], since: int, now: datetime) -> int:
+    """The highest revision of `changes` (sorted by revision) below which every
+    write has committed: those stamped CHANGES_SETTLE_MS before `now`."""
+    horizon = now - timedelta(milliseconds=CHANGES_SETTLE_MS)
+    settled = since
+    for change in changes:
+        stamped = stamped_at(change)
+        if stamped is not None and stamped > horizon:
+            return min(settled, change["revision"] - 1)
+        settled = change["revision"]
+    return settled
+
+async def soft_delete(collection: str, doc_id: str) -> bool:
+    """Mark a document deleted and record its tombstone; False if there is no live
+    document with that id. It stays restorable, and is archived after a while."""
+    result = await db[collection].update_one(
+        {"id": doc_id, **LIVE}, {"$set": {"deleted_at": datetime.now(timezone.utc).isoformat()}})
+    if result.matched_count == 0:
+        return False
+    await record_deletion(collection, doc_id)
+    return True
+
+async def ensure_change_tracking():
+    """Create the revision indexes and number documents written before revisions existed."""
+    for name in SYNCED_COLLECTIONS:
+        await db[name].create_index("revision")
+        missing = await db[name].find({"revision": {"$exists": False}}, {"_id": 0, "id": 1}).to_list(None)
+        if missing:
+            last = await next_revision(len(missing))
+            first = last - len(missing) + 1
+            await db[name].bulk_write([
+                UpdateOne({"id": doc["id"]}, {"$set": {"revision": first + offset}})
+                for offset, doc in enumerate(missing)
+            ])
+    await db.tombstones.create_index("revision")
+    await db.tombstones.create_index([("collection", 1), ("id", 1)], unique=True)
+
+async def ensure_indexes():
+    """Indexes behind lookups other than by id and revision."""
+    await db.invoices.create_index("quotation_id", sparse=True)
+    await ensure_invoice_numbers()
+    # Imports match existing items and companies by these keys
+    await db.items.create_index("name")
+    await db.companies.create_index("name")
+    await db.companies.create_index("npwp", sparse=True)
+    await ensure_archive_collections(db, ARCHIVE_COMPRESSOR)
+    await db.history.create_index([("collection", 1), ("id", 1), ("revision", 1)], unique=True)
+    # Repricing finds draft lines by catalog item
+    for name in REPRICED_COLLECTIONS:
+        await db[name].create_index("items.item_id")
+
+async def record_update(collection: str, previous: Optional[dict], update: dict):
+    """Append the revision history record of a `$set` of `update` onto `previous`."""
+    if previous is not None:
+        await record_versions(db, collection, [(previous, {**previous, **update})], HISTORY_SNAPSHOT_EVERY)
+
+def list_reads(name: str):
+    """Collection handle for list reads, which may be served by secondaries."""
+    return db.get_collection(name, read_preference=list_read_preference)
+
+async def list_live(name: str, include_archive: bool = False, length: Optional[int] = 1000) -> List[dict]:
+    """Documents that have not been deleted, followed by the archived ones when
+    asked; `length` in all."""
+    documents = await list_reads(name).find(LIVE, {"_id": 0}).max_time_ms(LIST_MAX_TIME_MS).to_list(length)
+    if include_archive and name in ARCHIVED_COLLECTIONS and (length is None or len(documents) < length):
+        archived = list_reads(archive_name(name)).find(LIVE, {"_id": 0, "archived_at": 0}).max_time_ms(LIST_MAX_TIME_MS)
+        documents += await archived.to_list(None if length is None else length - len(documents))
+    return documents
+
+async def find_live(name: str, doc_id: str, include_archive: bool = False) -> Optional[dict]:
+    """A document that has not been deleted, also looked up in the archive when asked."""
+    document = await db[name].find_one({"id": doc_id, **LIVE}, {"_id": 0})
+    if document is None and include_archive and name in ARCHIVED_COLLECTIONS:
+        document = await db[archive_name(name)].find_one({"id": doc_id, **LIVE}, {"_id": 0, "archived_at": 0})
+    return document
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not secrets.compare_digest(x_admin_token or '', ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Invoice & Quotation API"}
 
+@api_router.get("/health")
+async def health():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@api_router.get("/ready")
+async def ready(request: Request):
+    """Readiness: warm-up has finished and MongoDB answers. 503 until then."""
+    if not request.app.state.ready:
+        raise HTTPException(status_code=503, detail="Warming up")
+    try:
+        await db.command("ping")
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready"}
+
+@api_router.get("/changes")
+async def get_changes(since: int = 0, limit: int = 500, collections: Optional[str] = None):
+    """Return documents created, updated or deleted after revision `since`.
+
+    Pass the returned `next` token as `since` on the following call. A page never
+    splits a revision, so writes that share one (bulk jobs) arrive together.
+
+    `next` never skips a write: it stops before the first change stamped less than
+    CHANGES_SETTLE_MS ago, since revisions below it may still be committing. Such
+    recent changes are returned anyway and come again on the next call, so clients
+    apply changes idempotently (by id and revision).
+    """
+    limit = max(1, min(limit, 5000))
+    names = SYNCED_COLLECTIONS
+    if collections:
+        names = [name for name in collections.split(',') if name in SYNCED_COLLECTIONS]
+
+    changes = []
+    for name in names:
+        docs = await db[name].find({"revision": {"$gt": since}, **LIVE}, {"_id": 0}).sort("revision", 1).max_time_ms(LIST_MAX_TIME_MS).to_list(limit + 1)
+        changes.extend({"collection": name, "op": "upsert", "id": doc["id"], "revision": doc["revision"], "document": doc} for doc in docs)
+    tombstones = await db.tombstones.find(
+        {"revision": {"$gt": since}, "collection": {"$in": names}}, {"_id": 0}
+    ).sort("revision", 1).max_time_ms(LIST_MAX_TIME_MS).to_list(limit + 1)
+    changes.extend({"collection": t["collection"], "op": "delete", "id": t["id"], "revision": t["revision"], "deleted_at": t.get("deleted_at")} for t in tombstones)
+    changes.sort(key=lambda change: change["revision"])
+
+    has_more = len(changes) > limit
+    if has_more:
+        cutoff = changes[limit - 1]["revision"]
+        changes = [change for change in changes if change["revision"] < cutoff]
+        for name in names:
+            docs = await db[name].find({"revision": cutoff, **LIVE}, {"_id": 0}).to_list(None)
+            changes.extend({"collection": name, "op": "upsert", "id": doc["id"], "revision": cutoff, "document": doc} for doc in docs)
+        tombstones = await db.tombstones.find({"revision": cutoff, "collection": {"$in": names}}, {"_id": 0}).to_list(None)
+        changes.extend({"collection": t["collection"], "op": "delete", "id": t["id"], "revision": cutoff, "deleted_at": t.get("deleted_at")} for t in tombstones)
+
+    next_token = settled_revision(changes, since, datetime.now(timezone.utc))
+    has_more = has_more and next_token == changes[-1]["revision"]
+    return {"changes": changes, "next": next_token, "has_more": has_more}
+
+@api_router.get("/debug/slow", dependencies=[Depends(require_admin)])
+async def get_slow_events(kind: Optional[str] = None, limit: int = 100):
+    """Most recent slow queries, renders and requests, newest first."""
+    return slow_log.recent(kind, limit)
+
+@api_router.get("/debug/profile", dependencies=[Depends(require_admin)])
+async def get_render_profile(document: str = "letter", sort: ProfileSort = "cumulative", limit: int = 40, format: str = "text"):
+    """Aggregated cProfile stats of all profiled renders of one document type.
+
+    `format=pstats` downloads the raw stats for pstats/snakeviz.
+    """
+    if document not in render_profiler.aggregates:
+        raise HTTPException(status_code=404, detail="No profiled renders for this document type")
+    if format == "pstats":
+        return Response(render_profiler.dump(document), media_type="application/octet-stream", headers={
+            "Content-Disposition": f"attachment; filename={document}.pstats"
+        })
+    summary = render_profiler.format(render_profiler.aggregates[document], sort, limit)
+    return PlainTextResponse(f"{render_profiler.renders[document]} renders\n{summary}")
+
+@api_router.delete("/debug/profile", dependencies=[Depends(require_admin)])
+async def reset_render_profile():
+    render_profiler.reset()
+    return {"message": "Profiles reset"}
+
+@api_router.get("/events")
+async def get_events(request: Request, collections: Optional[str] = None):
+    """Server-Sent Events stream of compact create/update/delete notifications.
+
+    A `resync` event means the client fell behind and should catch up with
+    `/api/changes` from its last seen revision.
+    """
+    names = [name for name in collections.split(',') if name in SYNCED_COLLECTIONS] if collections else None
+    subscription = change_broker.subscribe(names)
+    return StreamingResponse(
+        event_stream(change_broker, subscription, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Deleted and archived documents
+@api_router.post("/{collection}/{document_id}/restore")
+async def restore_deleted(collection: str, document_id: str):
+    """Undo a delete, or bring an archived document back into the live collection."""
+    if collection not in SYNCED_COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    stamp = await change_stamp()
+    try:
+        document = await restore_document(db, collection, document_id, stamp)
+    except DuplicateKeyError:
+        # Its invoice number was given to another invoice in the meantime
+        raise HTTPException(status_code=409, detail="Number already in use by a live document")
+    if document is None:
+        raise HTTPException(status_code=404, detail="No deleted or archived document with this id")
+    await db.tombstones.delete_one({"collection": collection, "id": document_id})
+    publish_change(collection, "create", document_id, stamp["revision"])
+    return document
+
+@api_router.post("/archive", dependencies=[Depends(require_admin)])
+async def archive_job(dry_run: bool = False, older_than_days: Optional[int] = None, deleted_after_days: Optional[int] = None):
+    """Move closed documents older than ARCHIVE_AFTER_DAYS, and documents deleted
+    more than ARCHIVE_DELETED_AFTER_DAYS ago, to the archive collections. Also
+    run from cron with `python -m archive`."""
+    older_than_days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    deleted_after_days = ARCHIVE_DELETED_AFTER_DAYS if deleted_after_days is None else deleted_after_days
+    counts = await run_archive(db, older_than_days, deleted_after_days, dry_run)
+    return {"dry_run": dry_run, "older_than_days": older_than_days, "deleted_after_days": deleted_after_days, "archived": counts}
+
+# Revision history
+@api_router.get("/{collection}/{document_id}/revisions")
+async def get_revisions(collection: str, document_id: str, limit: int = 100):
+    """Versions of an invoice, quotation or letter, newest first, each with the
+    JSON Patch from the version before it (or marked as a full snapshot)."""
+    if collection not in HISTORY_COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    revisions = await list_revisions(db, collection, document_id, max(1, min(limit, 1000)))
+    return {"revisions": revisions}
+
+@api_router.get("/{collection}/{document_id}/revisions/{revision}")
+async def get_revision(collection: str, document_id: str, revision: int):
+    """The document exactly as it was at `revision`."""
+    if collection not in HISTORY_COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    document = await load_version(db, collection, document_id, revision)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return document
+
 # Company Routes
 @api_router.post("/companies", response_model=Company, status_code=201)
 async def create_company(input: CompanyCreate):
     company_dict = input.model_dump()
-    company = Company(**company_dict)
+    company = Company(**company_dict, **await change_stamp())
     doc = company.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['updated_at'] = doc['updated_at'].isoformat()
     await db.companies.insert_one(doc)
+    publish_change("companies", "create", company.id, company.revision)
     return company
 
 @api_router.get("/companies", response_model=List[Company])
 async def get_companies():
-    companies = await db.companies.find({}, {"_id": 0}).to_list(1000)
+    companies = await list_live("companies")
     for company in companies:
         if isinstance(company['created_at'], str):
             company['created_at'] = datetime.fromisoformat(company['created_at'])
@@ -248,7 +633,7 @@ async def get_companies():
 
 @api_router.get("/companies/{company_id}", response_model=Company)
 async def get_company(company_id: str):
-    company = await db.companies.find_one({"id": company_id}, {"_id": 0})
+    company = await find_live("companies", company_id)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     if isinstance(company['created_at'], str):
@@ -257,12 +642,14 @@ async def get_company(company_id: str):
 
 @api_router.put("/companies/{company_id}", response_model=Company)
 async def update_company(company_id: str, input: CompanyCreate):
-    company = await db.companies.find_one({"id": company_id}, {"_id": 0})
+    company = await find_live("companies", company_id)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     
     update_dict = input.model_dump()
+    update_dict.update(await change_stamp())
     await db.companies.update_one({"id": company_id}, {"$set": update_dict})
+    publish_change("companies", "update", company_id, update_dict["revision"])
     
     updated_company = await db.companies.find_one({"id": company_id}, {"_id": 0})
     if isinstance(updated_company['created_at'], str):
@@ -271,8 +658,7 @@ async def update_company(company_id: str, input: CompanyCreate):
 
 @api_router.delete("/companies/{company_id}")
 async def delete_company(company_id: str):
-    result = await db.companies.delete_one({"id": company_id})
-    if result.deleted_count == 0:
+    if not await soft_delete("companies", company_id):
         raise HTTPException(status_code=404, detail="Company not found")
     return {"message": "Company deleted successfully"}
 
@@ -280,15 +666,17 @@ async def delete_company(company_id: str):
 @api_router.post("/items", response_model=Item, status_code=201)
 async def create_item(input: ItemCreate):
     item_dict = input.model_dump()
-    item = Item(**item_dict)
+    item = Item(**item_dict, **await change_stamp())
     doc = item.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['updated_at'] = doc['updated_at'].isoformat()
     await db.items.insert_one(doc)
+    publish_change("items", "create", item.id, item.revision)
     return item
 
 @api_router.get("/items", response_model=List[Item])
 async def get_items():
-    items = await db.items.find({}, {"_id": 0}).to_list(1000)
+    items = await list_live("items")
     for item in items:
         if isinstance(item['created_at'], str):
             item['created_at'] = datetime.fromisoformat(item['created_at'])
@@ -296,7 +684,7 @@ async def get_items():
 
 @api_router.get("/items/{item_id}", response_model=Item)
 async def get_item(item_id: str):
-    item = await db.items.find_one({"id": item_id}, {"_id": 0})
+    item = await find_live("items", item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     if isinstance(item['created_at'], str):
@@ -305,22 +693,52 @@ async def get_item(item_id: str):
 
 @api_router.put("/items/{item_id}", response_model=Item)
 async def update_item(item_id: str, input: ItemCreate):
-    item = await db.items.find_one({"id": item_id}, {"_id": 0})
+    item = await find_live("items", item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     
     update_dict = input.model_dump()
+    update_dict.update(await change_stamp())
     await db.items.update_one({"id": item_id}, {"$set": update_dict})
+    publish_change("items", "update", item_id, update_dict["revision"])
     
     updated_item = await db.items.find_one({"id": item_id}, {"_id": 0})
     if isinstance(updated_item['created_at'], str):
         updated_item['created_at'] = datetime.fromisoformat(updated_item['created_at'])
     return updated_item
 
+async def reprice_items(item_ids: List[str], dry_run: bool):
+    """Apply the current catalog prices of `item_ids` to the draft documents using them."""
+    items = await db.items.find({"id": {"$in": item_ids}, **LIVE}, {"_id": 0, "id": 1, "unit_price": 1}).to_list(None)
+    prices = {item["id"]: item["unit_price"] for item in items}
+    missing = [item_id for item_id in item_ids if item_id not in prices]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Items not found: {', '.join(missing)}")
+    # All documents changed by one job share a revision
+    stamp = await change_stamp() if not dry_run else {}
+    report = await reprice_drafts(db, prices, stamp, dry_run=dry_run, max_time_ms=LIST_MAX_TIME_MS,
+                                  snapshot_every=HISTORY_SNAPSHOT_EVERY)
+    if not dry_run:
+        for name, result in report.items():
+            for document in result["documents"]:
+                publish_change(name, "update", document["id"], stamp["revision"])
+    return {"dry_run": dry_run, "prices": prices, "revision": stamp.get("revision"), **report}
+
+@api_router.post("/items/{item_id}/reprice")
+async def reprice_item(item_id: str, dry_run: bool = False):
+    """Opt-in: carry the item's current price into draft invoices and quotations
+    that use it. With dry_run the affected documents are listed but not changed."""
+    return await reprice_items([item_id], dry_run)
+
+@api_router.post("/items/reprice")
+async def reprice_items_batch(input: RepriceRequest):
+    if not input.item_ids:
+        raise HTTPException(status_code=400, detail="No items")
+    return await reprice_items(list(dict.fromkeys(input.item_ids)), input.dry_run)
+
 @api_router.delete("/items/{item_id}")
 async def delete_item(item_id: str):
-    result = await db.items.delete_one({"id": item_id})
-    if result.deleted_count == 0:
+    if not await soft_delete("items", item_id):
         raise HTTPException(status_code=404, detail="Item not found")
     return {"message": "Item deleted successfully"}
 
@@ -328,23 +746,28 @@ async def delete_item(item_id: str):
 @api_router.post("/invoices", response_model=Invoice, status_code=201)
 async def create_invoice(input: InvoiceCreate):
     invoice_dict = input.model_dump()
-    invoice = Invoice(**invoice_dict)
+    invoice = Invoice(**invoice_dict, **await change_stamp())
     doc = invoice.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
-    await db.invoices.insert_one(doc)
+    doc['updated_at'] = doc['updated_at'].isoformat()
+    try:
+        await db.invoices.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Invoice number already in use")
+    publish_change("invoices", "create", invoice.id, invoice.revision)
     return invoice
 
 @api_router.get("/invoices", response_model=List[Invoice])
-async def get_invoices():
-    invoices = await db.invoices.find({}, {"_id": 0}).to_list(1000)
+async def get_invoices(include_archive: bool = False):
+    invoices = await list_live("invoices", include_archive)
     for invoice in invoices:
         if isinstance(invoice['created_at'], str):
             invoice['created_at'] = datetime.fromisoformat(invoice['created_at'])
     return invoices
 
 @api_router.get("/invoices/{invoice_id}", response_model=Invoice)
-async def get_invoice(invoice_id: str):
-    invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
+async def get_invoice(invoice_id: str, include_archive: bool = False):
+    invoice = await find_live("invoices", invoice_id, include_archive)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     if isinstance(invoice['created_at'], str):
@@ -353,12 +776,18 @@ async def get_invoice(invoice_id: str):
 
 @api_router.put("/invoices/{invoice_id}", response_model=Invoice)
 async def update_invoice(invoice_id: str, input: InvoiceCreate):
-    invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
+    invoice = await find_live("invoices", invoice_id)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
     update_dict = input.model_dump()
-    await db.invoices.update_one({"id": invoice_id}, {"$set": update_dict})
+    update_dict.update(await change_stamp())
+    try:
+        previous = await db.invoices.find_one_and_update({"id": invoice_id}, {"$set": update_dict}, projection={"_id": 0})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Invoice number already in use")
+    await record_update("invoices", previous, update_dict)
+    publish_change("invoices", "update", invoice_id, update_dict["revision"])
     
     updated_invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
     if isinstance(updated_invoice['created_at'], str):
@@ -367,8 +796,7 @@ async def update_invoice(invoice_id: str, input: InvoiceCreate):
 
 @api_router.delete("/invoices/{invoice_id}")
 async def delete_invoice(invoice_id: str):
-    result = await db.invoices.delete_one({"id": invoice_id})
-    if result.deleted_count == 0:
+    if not await soft_delete("invoices", invoice_id):
         raise HTTPException(status_code=404, detail="Invoice not found")
     return {"message": "Invoice deleted successfully"}
 
@@ -376,23 +804,25 @@ async def delete_invoice(invoice_id: str):
 @api_router.post("/quotations", response_model=Quotation, status_code=201)
 async def create_quotation(input: QuotationCreate):
     quotation_dict = input.model_dump()
-    quotation = Quotation(**quotation_dict)
+    quotation = Quotation(**quotation_dict, **await change_stamp())
     doc = quotation.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['updated_at'] = doc['updated_at'].isoformat()
     await db.quotations.insert_one(doc)
+    publish_change("quotations", "create", quotation.id, quotation.revision)
     return quotation
 
 @api_router.get("/quotations", response_model=List[Quotation])
-async def get_quotations():
-    quotations = await db.quotations.find({}, {"_id": 0}).to_list(1000)
+async def get_quotations(include_archive: bool = False):
+    quotations = await list_live("quotations", include_archive)
     for quotation in quotations:
         if isinstance(quotation['created_at'], str):
             quotation['created_at'] = datetime.fromisoformat(quotation['created_at'])
     return quotations
 
 @api_router.get("/quotations/{quotation_id}", response_model=Quotation)
-async def get_quotation(quotation_id: str):
-    quotation = await db.quotations.find_one({"id": quotation_id}, {"_id": 0})
+async def get_quotation(quotation_id: str, include_archive: bool = False):
+    quotation = await find_live("quotations", quotation_id, include_archive)
     if not quotation:
         raise HTTPException(status_code=404, detail="Quotation not found")
     if isinstance(quotation['created_at'], str):
@@ -401,12 +831,15 @@ async def get_quotation(quotation_id: str):
 
 @api_router.put("/quotations/{quotation_id}", response_model=Quotation)
 async def update_quotation(quotation_id: str, input: QuotationCreate):
-    quotation = await db.quotations.find_one({"id": quotation_id}, {"_id": 0})
+    quotation = await find_live("quotations", quotation_id)
     if not quotation:
         raise HTTPException(status_code=404, detail="Quotation not found")
     
     update_dict = input.model_dump()
-    await db.quotations.update_one({"id": quotation_id}, {"$set": update_dict})
+    update_dict.update(await change_stamp())
+    previous = await db.quotations.find_one_and_update({"id": quotation_id}, {"$set": update_dict}, projection={"_id": 0})
+    await record_update("quotations", previous, update_dict)
+    publish_change("quotations", "update", quotation_id, update_dict["revision"])
     
     updated_quotation = await db.quotations.find_one({"id": quotation_id}, {"_id": 0})
     if isinstance(updated_quotation['created_at'], str):
@@ -415,15 +848,213 @@ async def update_quotation(quotation_id: str, input: QuotationCreate):
 
 @api_router.delete("/quotations/{quotation_id}")
 async def delete_quotation(quotation_id: str):
-    result = await db.quotations.delete_one({"id": quotation_id})
-    if result.deleted_count == 0:
+    if not await soft_delete("quotations", quotation_id):
         raise HTTPException(status_code=404, detail="Quotation not found")
     return {"message": "Quotation deleted successfully"}
 
+# Quotation to Invoice Conversion
+# A quotation is claimed by setting its invoice_id in the same conditional update
+# that marks it converted, so two concurrent conversions cannot both succeed.
+CONVERTIBLE_STATUSES = ["draft", "sent", "accepted"]
+# Fields an invoice takes over from its quotation as they are
+QUOTATION_INVOICE_FIELDS = (
+    "company_id", "client_name", "client_address", "client_phone", "client_email", "items", "subtotal",
+    "tax_rate", "tax_amount", "discount_rate", "discount_amount", "total", "currency", "notes", "template_id",
+    "signature_name", "signature_position",
+)
+
+# Invoice numbers are unique. Generated numbers skip those already given to
+# invoices by hand, and an insert that still collides takes new numbers.
+INVOICE_NUMBER_ATTEMPTS = 3
+
+def invoice_counter(year: int) -> str:
+    """Counter behind generated invoice numbers: one per year when the format
+    shows the year, so numbering starts again each year."""
+    return f"invoice_number:{year}" if "{year" in INVOICE_NUMBER_FORMAT else "invoice_number"
+
+async def ensure_invoice_numbers():
+    """Make invoice numbers unique among live invoices, and carry the single counter
+    used before numbers were counted per year over to the current year.
+
+    Deleted invoices keep their number, so the index also covers `deleted_at`: live
+    invoices all have it missing and collide, deleted ones are told apart by it. (A
+    partial index cannot select documents by a missing field.)
+    """
+    try:
+        await db.invoices.create_index([("invoice_number", 1), ("deleted_at", 1)], unique=True)
+    except OperationFailure as exc:
+        # Existing duplicates have to be renumbered by hand first
+        logger.error("Invoice numbers are not unique, so uniqueness is not enforced: %s", exc)
+    else:
+        # The earlier index also counted deleted invoices
+        if (await db.invoices.index_information()).get("invoice_number_1", {}).get("unique"):
+            await db.invoices.drop_index("invoice_number_1")
+    year = datetime.now(timezone.utc).year
+    if invoice_counter(year) != "invoice_number":
+        legacy = await db.counters.find_one_and_delete({"_id": "invoice_number"})
+        if legacy is not None:
+            await db.counters.update_one({"_id": invoice_counter(year)}, {"$max": {"seq": legacy["seq"]}}, upsert=True)
+
+def duplicate_invoice_number(error: dict) -> bool:
+    return error.get("code") == DUPLICATE_KEY and "invoice_number" in str(error.get("keyPattern") or error.get("errmsg"))
+
+async def next_invoice_numbers(count: int) -> List[str]:
+    """Reserve `count` invoice numbers (INVOICE_NUMBER_FORMAT, `{seq}` and `{year}`),
+    skipping numbers that invoices already have."""
+    year = datetime.now(timezone.utc).year
+    numbers = []
+    while len(numbers) < count:
+        wanted = count - len(numbers)
+        counter = await db.counters.find_one_and_update(
+            {"_id": invoice_counter(year)},
+            {"$inc": {"seq": wanted}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        candidates = [INVOICE_NUMBER_FORMAT.format(seq=seq, year=year) for seq in range(counter["seq"] - wanted + 1, counter["seq"] + 1)]
+        taken = {invoice["invoice_number"] async for invoice in db.invoices.find(
+            {"invoice_number": {"$in": candidates}}, {"_id": 0, "invoice_number": 1})}
+        numbers.extend(number for number in candidates if number not in taken)
+    return numbers
+
+async def convert_quotations(quotation_ids: List[str], invoice_numbers: Optional[List[str]], date: Optional[str], due_date: str):
+    """Convert quotations into draft invoices: one bulk write claims them and one
+    insert_many creates the invoices, all under a single revision.
+
+    Returns (invoices, skipped) where skipped maps quotation id to the reason.
+    """
+    quotation_ids = list(dict.fromkeys(quotation_ids))
+    found = {quotation["id"]: quotation async for quotation in db.quotations.find(
+        {"id": {"$in": quotation_ids}, **LIVE}, {"_id": 0, "id": 1, "status": 1, "invoice_id": 1, "revision": 1, "updated_at": 1})}
+    skipped = {}
+    for quotation_id in quotation_ids:
+        quotation = found.get(quotation_id)
+        if quotation is None:
+            skipped[quotation_id] = "not_found"
+        elif quotation.get("invoice_id"):
+            skipped[quotation_id] = "already_converted"
+        elif quotation.get("status", "draft") not in CONVERTIBLE_STATUSES:
+            skipped[quotation_id] = f"status_{quotation['status']}"
+    candidates = [quotation_id for quotation_id in quotation_ids if quotation_id not in skipped]
+    if not candidates:
+        return [], skipped
+
+    invoice_ids = {quotation_id: str(uuid.uuid4()) for quotation_id in candidates}
+    stamp = await change_stamp()
+    await db.quotations.bulk_write([
+        UpdateOne(
+            {"id": quotation_id, "revision": found[quotation_id].get("revision"), "invoice_id": None, **LIVE},
+            {"$set": {"status": "converted", "invoice_id": invoice_ids[quotation_id], **stamp}},
+        )
+        for quotation_id in candidates
+    ], ordered=False)
+    quotations = {quotation["id"]: quotation async for quotation in db.quotations.find(
+        {"id": {"$in": candidates}, "invoice_id": {"$in": list(invoice_ids.values())}}, {"_id": 0})}
+    claimed = [quotation_id for quotation_id in candidates if quotation_id in quotations]
+    for quotation_id in candidates:
+        if quotation_id not in quotations:
+            # Changed or converted by someone else since it was read
+            skipped[quotation_id] = "conflict"
+    if not claimed:
+        return [], skipped
+
+    numbers = invoice_numbers or await next_invoice_numbers(len(claimed))
+    invoice_date = date or datetime.now(timezone.utc).date().isoformat()
+    invoices = []
+    for quotation_id, number in zip(claimed, numbers):
+        quotation = quotations[quotation_id]
+        invoice = Invoice(
+            **{field: quotation[field] for field in QUOTATION_INVOICE_FIELDS if field in quotation},
+            id=invoice_ids[quotation_id],
+            invoice_number=number,
+            date=invoice_date,
+            due_date=due_date,
+            quotation_id=quotation_id,
+            **stamp,
+        )
+        invoices.append(invoice)
+    docs = [invoice.model_dump() for invoice in invoices]
+    for doc in docs:
+        doc['created_at'] = doc['created_at'].isoformat()
+        doc['updated_at'] = doc['updated_at'].isoformat()
+    try:
+        pending = docs
+        for attempt in range(INVOICE_NUMBER_ATTEMPTS):
+            try:
+                await db.invoices.insert_many(pending, ordered=False)
+                break
+            except BulkWriteError as exc:
+                errors = exc.details["writeErrors"]
+                if invoice_numbers or attempt == INVOICE_NUMBER_ATTEMPTS - 1 or not all(map(duplicate_invoice_number, errors)):
+                    raise
+                # Numbers given by hand since they were reserved
+                pending = [pending[error["index"]] for error in errors]
+                for doc, number in zip(pending, await next_invoice_numbers(len(pending))):
+                    doc["invoice_number"] = number
+    except Exception:
+        # Release the claims of quotations whose invoice was not written, so they
+        # can be converted again
+        written = {doc["id"] async for doc in db.invoices.find({"id": {"$in": [invoice.id for invoice in invoices]}}, {"_id": 0, "id": 1})}
+        released = [quotation_id for quotation_id in claimed if invoice_ids[quotation_id] not in written]
+        if released:
+            await db.quotations.bulk_write([
+                UpdateOne({"id": quotation_id, "invoice_id": invoice_ids[quotation_id]},
+                          {"$set": {"status": found[quotation_id].get("status", "draft"), "invoice_id": None}})
+                for quotation_id in released
+            ], ordered=False)
+        raise
+    for invoice, doc in zip(invoices, docs):
+        invoice.invoice_number = doc["invoice_number"]
+    # The claim matched the revision that was read, so that read is the previous version
+    await record_versions(db, "quotations", [
+        ({**quotations[quotation_id], "status": found[quotation_id].get("status", "draft"), "invoice_id": None,
+          "revision": found[quotation_id].get("revision"), "updated_at": found[quotation_id].get("updated_at")},
+         quotations[quotation_id])
+        for quotation_id in claimed
+    ], HISTORY_SNAPSHOT_EVERY)
+    for invoice in invoices:
+        publish_change("quotations", "update", invoice.quotation_id, stamp["revision"])
+        publish_change("invoices", "create", invoice.id, stamp["revision"])
+    return invoices, skipped
+
+@api_router.post("/quotations/convert")
+async def convert_quotations_batch(input: ConvertQuotationsRequest):
+    """Convert many quotations at once; quotations that cannot be converted are
+    reported under `skipped` with the reason."""
+    if len(input.quotation_ids) > CONVERT_MAX_QUOTATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {CONVERT_MAX_QUOTATIONS} quotations per request")
+    invoices, skipped = await convert_quotations(input.quotation_ids, None, input.date, input.due_date)
+    return {
+        "converted": [
+            {"quotation_id": invoice.quotation_id, "invoice_id": invoice.id, "invoice_number": invoice.invoice_number}
+            for invoice in invoices
+        ],
+        "skipped": [{"quotation_id": quotation_id, "reason": reason} for quotation_id, reason in skipped.items()],
+    }
+
+@api_router.post("/quotations/{quotation_id}/convert", response_model=Invoice, status_code=201)
+async def convert_quotation(quotation_id: str, input: Optional[ConvertQuotationRequest] = None):
+    input = input or ConvertQuotationRequest()
+    numbers = [input.invoice_number] if input.invoice_number else None
+    try:
+        invoices, skipped = await convert_quotations([quotation_id], numbers, input.date, input.due_date)
+    except BulkWriteError as exc:
+        if not all(map(duplicate_invoice_number, exc.details["writeErrors"])):
+            raise
+        raise HTTPException(status_code=409, detail="Invoice number already in use")
+    reason = skipped.get(quotation_id)
+    if reason == "not_found":
+        raise HTTPException(status_code=404, detail="Quotation not found")
+    if reason in ("already_converted", "conflict"):
+        raise HTTPException(status_code=409, detail="Quotation has already been converted")
+    if reason:
+        raise HTTPException(status_code=409, detail=f"A {reason[len('status_'):]} quotation cannot be converted")
+    return invoices[0]
+
 # Letter Routes
 @api_router.get("/letters")
-async def get_letters():
-    letters = await db.letters.find().to_list(length=None)
+async def get_letters(include_archive: bool = False):
+    letters = await list_live("letters", include_archive, length=None)
     return [Letter(**letter) for letter in letters]
 
 @api_router.post("/letters", status_code=201)
@@ -432,12 +1063,14 @@ async def create_letter(letter: LetterCreate):
     letter_dict["id"] = str(uuid.uuid4())
     letter_dict["created_at"] = datetime.now(timezone.utc).isoformat()
     letter_dict["signatories"] = [sig.dict() for sig in letter.signatories]
+    letter_dict.update(await change_stamp())
     await db.letters.insert_one(letter_dict)
+    publish_change("letters", "create", letter_dict["id"], letter_dict["revision"])
     return Letter(**letter_dict)
 
 @api_router.get("/letters/{letter_id}")
-async def get_letter(letter_id: str):
-    letter = await db.letters.find_one({"id": letter_id})
+async def get_letter(letter_id: str, include_archive: bool = False):
+    letter = await find_live("letters", letter_id, include_archive)
     if not letter:
         raise HTTPException(status_code=404, detail="Letter not found")
     return Letter(**letter)
@@ -446,26 +1079,94 @@ async def get_letter(letter_id: str):
 async def update_letter(letter_id: str, letter: LetterCreate):
     letter_dict = letter.dict()
     letter_dict["signatories"] = [sig.dict() for sig in letter.signatories]
-    result = await db.letters.update_one(
-        {"id": letter_id},
-        {"$set": letter_dict}
+    letter_dict.update(await change_stamp())
+    previous = await db.letters.find_one_and_update(
+        {"id": letter_id, **LIVE},
+        {"$set": letter_dict},
+        projection={"_id": 0},
     )
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Letter not found")
+    await record_update("letters", previous, letter_dict)
+    publish_change("letters", "update", letter_id, letter_dict["revision"])
     
     updated_letter = await db.letters.find_one({"id": letter_id})
     return Letter(**updated_letter)
 
 @api_router.delete("/letters/{letter_id}")
 async def delete_letter(letter_id: str):
-    result = await db.letters.delete_one({"id": letter_id})
-    if result.deleted_count == 0:
+    if not await soft_delete("letters", letter_id):
         raise HTTPException(status_code=404, detail="Letter not found")
     return {"message": "Letter deleted successfully"}
 
+# Mail Merge Routes
+def get_merge_pool():
+    global merge_pool
+    if merge_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+        # spawn: forking a process that runs Motor's threads is not safe
+        merge_pool = ProcessPoolExecutor(max_workers=int(os.environ.get('MAIL_MERGE_WORKERS', '0')) or None,
+                                         mp_context=get_context("spawn"))
+    return merge_pool
+
+async def mail_merge_response(request: Request, letter: LetterCreate, recipients: List[Dict[str, str]], output: str):
+    """The merged letters as one PDF, cached like other renders, or as a ZIP of PDFs."""
+    from mail_merge import render_merged_pdf, render_merged_zip
+    if output not in ("pdf", "zip"):
+        raise HTTPException(status_code=400, detail="output must be 'pdf' or 'zip'")
+    if not recipients:
+        raise HTTPException(status_code=400, detail="No recipients")
+    if len(recipients) > MAIL_MERGE_MAX_RECIPIENTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAIL_MERGE_MAX_RECIPIENTS} recipients per merge")
+    template = letter.model_dump()
+    missing = missing_fields(template, recipients)
+    if missing:
+        raise HTTPException(status_code=422, detail=f"Recipients are missing fields: {', '.join(sorted(missing))}")
+    company = await db.companies.find_one({"id": letter.company_id}, {"_id": 0})
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    headers = {"Content-Disposition": f"attachment; filename=mail_merge_{len(recipients)}.{output}"}
+    if output == "pdf" and pdf_cache is not None:
+        key = PdfCache.key("mail_merge", {"id": merge_digest(template, recipients)}, company)
+        file = await open_cached_pdf("mail_merge", key, lambda spool: render_merged_pdf(template, company, recipients, spool))
+        return cached_pdf_response(request, file, key, headers)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
+    try:
+        if output == "pdf":
+            await asyncio.to_thread(render_merged_pdf, template, company, recipients, spool)
+        else:
+            await render_merged_zip(get_merge_pool(), template, company, recipients, spool)
+    except BaseException:
+        spool.close()
+        raise
+    return StreamingResponse(iter_file(spool), media_type="application/pdf" if output == "pdf" else "application/zip",
+                             headers={**headers, "Content-Length": str(spool.tell())})
+
+@api_router.post("/letters/mail-merge")
+async def mail_merge(input: MailMergeRequest, request: Request):
+    """Render one letter template for every recipient, as one PDF or a ZIP of PDFs.
+
+    Template fields may use `{{field}}` placeholders filled from each recipient.
+    """
+    return await mail_merge_response(request, input.letter, input.recipients, input.output)
+
+@api_router.post("/letters/mail-merge/csv")
+async def mail_merge_csv(request: Request, letter: str = Form(...), recipients: UploadFile = File(...), output: str = Form("pdf")):
+    """Mail merge with recipients from a CSV upload (one column per field) and the
+    letter template as a JSON form field."""
+    try:
+        template = LetterCreate.model_validate_json(letter)
+        rows = parse_recipients_csv(await recipients.read())
+    except (ValueError, csv.Error) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid mail merge input: {exc}")
+    return await mail_merge_response(request, template, rows, output)
+
 # Signature Upload Route
 @api_router.post("/upload-signature")
 async def upload_signature(file: UploadFile = File(...)):
+    from PIL import Image
     try:
         contents = await file.read()
         
@@ -486,468 +1187,574 @@ async def upload_signature(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 # PDF Generation Routes
-def format_currency(amount: float, currency: str) -> str:
-    if currency == "IDR":
-        return f"Rp {amount:,.0f}"
-    elif currency == "USD":
-        return f"${amount:,.2f}"
-    elif currency == "EUR":
-        return f"€{amount:,.2f}"
-    else:
-        return f"{currency} {amount:,.2f}"
+def render_pdf(kind: str, document: dict, company: dict, timer: StageTimer, output, profile: bool = False):
+    """Render into `output` on a worker thread; returns the profile stats if it was profiled."""
+    from pdf_render import render_document, document_stats
+    profiling = render_profiler.begin(force=profile)
+    try:
+        render_document(kind, document, company, timer=timer, output=output)
+    except BaseException:
+        if profiling:
+            render_profiler.discard(profiling)
+        raise
+    slow_log.render(kind, document['id'], timer.total(), bytes=output.tell(), **document_stats(kind, document, company))
+    if profiling:
+        return render_profiler.end(kind, profiling)
+    return None
+
+def cached_pdf_response(request: Request, file, key: str, headers: dict):
+    """Send a cached PDF, honouring If-None-Match and single byte ranges."""
+    size = os.fstat(file.fileno()).st_size
+    etag = f'"{key}"'
+    headers = {**headers, "ETag": etag, "Accept-Ranges": "bytes"}
+    if request.headers.get("if-none-match") == etag:
+        file.close()
+        return Response(status_code=304, headers=headers)
+    byte_range = None
+    if request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            file.close()
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        return StreamingResponse(iter_file(file), media_type="application/pdf", headers={**headers, "Content-Length": str(size)})
+    start, end = byte_range
+    return StreamingResponse(iter_file(file, start, end - start + 1), status_code=206, media_type="application/pdf", headers={
+        **headers,
+        "Content-Length": str(end - start + 1),
+        "Content-Range": f"bytes {start}-{end}/{size}",
+    })
+
+async def open_rendered_pdf(kind: str, document: dict, company: dict, timer: StageTimer):
+    """An open file with the rendered PDF and its cache key, rendering off the event
+    loop on a cache miss. Without a cache the render is spooled and the key is None."""
+    if pdf_cache is None:
+        output = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
+        try:
+            await asyncio.to_thread(render_pdf, kind, document, company, timer, output)
+        except BaseException:
+            output.close()
+            raise
+        return output, None
+
+    key = PdfCache.key(kind, document, company)
+    file = await open_cached_pdf(kind, key, lambda output: render_pdf(kind, document, company, timer, output))
+    return file, key
+
+async def open_cached_pdf(kind: str, key: str, write):
+    """The cached PDF under `key`, opened; on a miss `write(output)` renders it off
+    the event loop first."""
+    path = pdf_cache.get(key)
+    PDF_CACHE_REQUESTS.inc(kind, "miss" if path is None else "hit")
+    if path is None:
+        path = await asyncio.to_thread(pdf_cache.put, key, write)
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        # Evicted by another worker between lookup and open; render it again
+        path = await asyncio.to_thread(pdf_cache.put, key, write)
+        return open(path, "rb")
+
+async def pdf_response(request: Request, kind: str, document: dict, company: dict, timer: StageTimer, profile: bool = False):
+    """Render an already-fetched document (or reuse its cached render) and stream it,
+    or send its profile when asked. Rendering runs off the event loop."""
+    from pdf_render import pdf_filename
+    headers = {"Content-Disposition": f"attachment; filename={pdf_filename(kind, document)}"}
+    if profile:
+        with tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES) as output:
+            stats = await asyncio.to_thread(render_pdf, kind, document, company, timer, output, True)
+        if stats is None:
+            raise HTTPException(status_code=503, detail="Another render is being profiled", headers={"Retry-After": "1"})
+        return PlainTextResponse(render_profiler.format(stats))
+
+    file, key = await open_rendered_pdf(kind, document, company, timer)
+    if key is None:
+        return StreamingResponse(iter_file(file), media_type="application/pdf", headers={**headers, "Content-Length": str(file.tell())})
+    return cached_pdf_response(request, file, key, headers)
 
 @api_router.get("/invoices/{invoice_id}/pdf")
-async def generate_invoice_pdf(invoice_id: str):
-    invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
+async def generate_invoice_pdf(invoice_id: str, request: Request, profile: bool = False, include_archive: bool = False,
+                               x_admin_token: Optional[str] = Header(None)):
+    if profile:
+        require_admin(x_admin_token)
+    timer = StageTimer(PDF_STAGE_SECONDS, "invoice")
+    invoice = await find_live("invoices", invoice_id, include_archive)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
     company = await db.companies.find_one({"id": invoice['company_id']}, {"_id": 0})
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
-    
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=50, leftMargin=50, topMargin=50, bottomMargin=50)
-    
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Header
-    header_style = ParagraphStyle('header', parent=styles['Heading1'], fontSize=24, textColor=colors.HexColor('#1e40af'), alignment=TA_CENTER)
-    story.append(Paragraph("INVOICE", header_style))
-    story.append(Spacer(1, 20))
-    
-    # Company Info
-    company_style = ParagraphStyle('company', parent=styles['Normal'], fontSize=10, alignment=TA_LEFT)
-    story.append(Paragraph(f"<b>{company['name']}</b>", company_style))
-    story.append(Paragraph(company['address'], company_style))
-    story.append(Paragraph(f"Phone: {company['phone']} | Email: {company['email']}", company_style))
-    if company.get('npwp'):
-        story.append(Paragraph(f"NPWP: {company['npwp']}", company_style))
-    story.append(Spacer(1, 20))
-    
-    # Invoice Info
-    info_data = [
-        ["Invoice Number:", invoice['invoice_number'], "Date:", invoice['date']],
-        ["Client:", invoice['client_name'], "Due Date:", invoice.get('due_date', '-')],
-    ]
-    info_table = Table(info_data, colWidths=[100, 200, 80, 120])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(info_table)
-    story.append(Spacer(1, 20))
-    
-    # Items Table
-    items_data = [['Item', 'Description', 'Qty', 'Unit Price', 'Total']]
-    for item in invoice['items']:
-        items_data.append([
-            item['name'],
-            item['description'],
-            f"{item['quantity']} {item['unit']}",
-            format_currency(item['unit_price'], invoice['currency']),
-            format_currency(item['total'], invoice['currency'])
-        ])
-    
-    items_table = Table(items_data, colWidths=[120, 150, 60, 80, 90])
-    items_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e40af')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.white]),
-    ]))
-    story.append(items_table)
-    story.append(Spacer(1, 20))
-    
-    # Summary
-    summary_data = [
-        ['Subtotal:', format_currency(invoice['subtotal'], invoice['currency'])],
-    ]
-    if invoice.get('discount_amount', 0) > 0:
-        summary_data.append([f"Discount ({invoice.get('discount_rate', 0)}%):", format_currency(invoice['discount_amount'], invoice['currency'])])
-    if invoice.get('tax_amount', 0) > 0:
-        summary_data.append([f"Tax ({invoice.get('tax_rate', 0)}%):", format_currency(invoice['tax_amount'], invoice['currency'])])
-    summary_data.append(['Total:', format_currency(invoice['total'], invoice['currency'])])
-    
-    summary_table = Table(summary_data, colWidths=[350, 150])
-    summary_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('LINEABOVE', (0, -1), (-1, -1), 2, colors.HexColor('#1e40af')),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, -1), (-1, -1), 12),
-    ]))
-    story.append(summary_table)
-    
-    if invoice.get('notes'):
-        story.append(Spacer(1, 20))
-        story.append(Paragraph(f"<b>Notes:</b>", styles['Normal']))
-        story.append(Paragraph(invoice['notes'], styles['Normal']))
-    
-    if company.get('bank_name'):
-        story.append(Spacer(1, 30))
-        story.append(Paragraph("<b>Payment Details:</b>", styles['Normal']))
-        story.append(Paragraph(f"Bank: {company['bank_name']}", styles['Normal']))
-        story.append(Paragraph(f"Account: {company['bank_account']}", styles['Normal']))
-        story.append(Paragraph(f"Account Name: {company['bank_account_name']}", styles['Normal']))
-    
-    # Signature section
-    if invoice.get('signature_name') or invoice.get('signature_position'):
-        story.append(Spacer(1, 40))
-        signature_style = ParagraphStyle('signature', parent=styles['Normal'], fontSize=10, alignment=TA_RIGHT)
-        story.append(Paragraph("<b>Authorized Signature:</b>", signature_style))
-        story.append(Spacer(1, 40))
-        if invoice.get('signature_name'):
-            story.append(Paragraph(f"<b>{invoice['signature_name']}</b>", signature_style))
-        if invoice.get('signature_position'):
-            story.append(Paragraph(invoice['signature_position'], signature_style))
-    
-    doc.build(story)
-    buffer.seek(0)
-    
-    return StreamingResponse(buffer, media_type="application/pdf", headers={
-        "Content-Disposition": f"attachment; filename=invoice_{invoice['invoice_number']}.pdf"
-    })
+    timer.lap("fetch")
+    return await pdf_response(request, "invoice", invoice, company, timer, profile)
 
 @api_router.get("/quotations/{quotation_id}/pdf")
-async def generate_quotation_pdf(quotation_id: str):
-    quotation = await db.quotations.find_one({"id": quotation_id}, {"_id": 0})
+async def generate_quotation_pdf(quotation_id: str, request: Request, profile: bool = False, include_archive: bool = False,
+                                 x_admin_token: Optional[str] = Header(None)):
+    if profile:
+        require_admin(x_admin_token)
+    timer = StageTimer(PDF_STAGE_SECONDS, "quotation")
+    quotation = await find_live("quotations", quotation_id, include_archive)
     if not quotation:
         raise HTTPException(status_code=404, detail="Quotation not found")
     
     company = await db.companies.find_one({"id": quotation['company_id']}, {"_id": 0})
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
-    
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=50, leftMargin=50, topMargin=50, bottomMargin=50)
-    
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Header
-    header_style = ParagraphStyle('header', parent=styles['Heading1'], fontSize=24, textColor=colors.HexColor('#059669'), alignment=TA_CENTER)
-    story.append(Paragraph("QUOTATION", header_style))
-    story.append(Spacer(1, 20))
-    
-    # Company Info
-    company_style = ParagraphStyle('company', parent=styles['Normal'], fontSize=10, alignment=TA_LEFT)
-    story.append(Paragraph(f"<b>{company['name']}</b>", company_style))
-    story.append(Paragraph(company['address'], company_style))
-    story.append(Paragraph(f"Phone: {company['phone']} | Email: {company['email']}", company_style))
-    if company.get('npwp'):
-        story.append(Paragraph(f"NPWP: {company['npwp']}", company_style))
-    story.append(Spacer(1, 20))
-    
-    # Quotation Info
-    info_data = [
-        ["Quotation Number:", quotation['quotation_number'], "Date:", quotation['date']],
-        ["Client:", quotation['client_name'], "Valid Until:", quotation.get('valid_until', '-')],
-    ]
-    info_table = Table(info_data, colWidths=[120, 180, 80, 120])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(info_table)
-    story.append(Spacer(1, 20))
-    
-    # Items Table
-    items_data = [['Item', 'Description', 'Qty', 'Unit Price', 'Total']]
-    for item in quotation['items']:
-        items_data.append([
-            item['name'],
-            item['description'],
-            f"{item['quantity']} {item['unit']}",
-            format_currency(item['unit_price'], quotation['currency']),
-            format_currency(item['total'], quotation['currency'])
-        ])
-    
-    items_table = Table(items_data, colWidths=[120, 150, 60, 80, 90])
-    items_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#059669')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.white]),
-    ]))
-    story.append(items_table)
-    story.append(Spacer(1, 20))
-    
-    # Summary
-    summary_data = [
-        ['Subtotal:', format_currency(quotation['subtotal'], quotation['currency'])],
-    ]
-    if quotation.get('discount_amount', 0) > 0:
-        summary_data.append([f"Discount ({quotation.get('discount_rate', 0)}%):", format_currency(quotation['discount_amount'], quotation['currency'])])
-    if quotation.get('tax_amount', 0) > 0:
-        summary_data.append([f"Tax ({quotation.get('tax_rate', 0)}%):", format_currency(quotation['tax_amount'], quotation['currency'])])
-    summary_data.append(['Total:', format_currency(quotation['total'], quotation['currency'])])
-    
-    summary_table = Table(summary_data, colWidths=[350, 150])
-    summary_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('LINEABOVE', (0, -1), (-1, -1), 2, colors.HexColor('#059669')),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, -1), (-1, -1), 12),
-    ]))
-    story.append(summary_table)
-    
-    if quotation.get('notes'):
-        story.append(Spacer(1, 20))
-        story.append(Paragraph(f"<b>Notes:</b>", styles['Normal']))
-        story.append(Paragraph(quotation['notes'], styles['Normal']))
-    
-    if company.get('bank_name'):
-        story.append(Spacer(1, 30))
-        story.append(Paragraph("<b>Payment Details:</b>", styles['Normal']))
-        story.append(Paragraph(f"Bank: {company['bank_name']}", styles['Normal']))
-        story.append(Paragraph(f"Account: {company['bank_account']}", styles['Normal']))
-        story.append(Paragraph(f"Account Name: {company['bank_account_name']}", styles['Normal']))
-    
-    # Signature section
-    if quotation.get('signature_name') or quotation.get('signature_position'):
-        story.append(Spacer(1, 40))
-        signature_style = ParagraphStyle('signature', parent=styles['Normal'], fontSize=10, alignment=TA_RIGHT)
-        story.append(Paragraph("<b>Authorized Signature:</b>", signature_style))
-        story.append(Spacer(1, 40))
-        if quotation.get('signature_name'):
-            story.append(Paragraph(f"<b>{quotation['signature_name']}</b>", signature_style))
-        if quotation.get('signature_position'):
-            story.append(Paragraph(quotation['signature_position'], signature_style))
-    
-    doc.build(story)
-    buffer.seek(0)
-    
-    return StreamingResponse(buffer, media_type="application/pdf", headers={
-        "Content-Disposition": f"attachment; filename=quotation_{quotation['quotation_number']}.pdf"
-    })
+    timer.lap("fetch")
+    return await pdf_response(request, "quotation", quotation, company, timer, profile)
 
 # Letter PDF Generation
 @api_router.get("/letters/{letter_id}/pdf")
-async def generate_letter_pdf(letter_id: str):
-    letter = await db.letters.find_one({"id": letter_id})
+async def generate_letter_pdf(letter_id: str, request: Request, profile: bool = False, include_archive: bool = False,
+                              x_admin_token: Optional[str] = Header(None)):
+    if profile:
+        require_admin(x_admin_token)
+    timer = StageTimer(PDF_STAGE_SECONDS, "letter")
+    letter = await find_live("letters", letter_id, include_archive)
     if not letter:
         raise HTTPException(status_code=404, detail="Letter not found")
     
-    company = await db.companies.find_one({"id": letter['company_id']})
+    company = await db.companies.find_one({"id": letter['company_id']}, {"_id": 0})
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
-    
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Company Header with Logo (Kop Surat) - Centered Layout
-    company_style = ParagraphStyle('company', parent=styles['Normal'], fontSize=11, alignment=TA_CENTER)
-    company_name_style = ParagraphStyle('company_name', parent=styles['Normal'], fontSize=14, alignment=TA_CENTER, spaceAfter=4)
-    company_motto_style = ParagraphStyle('company_motto', parent=styles['Normal'], fontSize=9, alignment=TA_CENTER, textColor=colors.HexColor('#666666'), fontName='Helvetica-Oblique')
-    
-    # Add logo if available (centered)
-    if company.get('logo'):
+    timer.lap("fetch")
+    return await pdf_response(request, "letter", letter, company, timer, profile)
+
+# Spreadsheet Export
+@api_router.get("/export/{collection}")
+async def export_collection(collection: str, format: str = "csv", rows: str = "documents", status: Optional[str] = None,
+                            company_id: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """Download invoices, quotations or items as CSV or XLSX, one row per document or
+    (rows=lines) per line item. Rows are read from the cursor in batches; CSV is
+    streamed as it is written, XLSX is assembled in a spooled temporary file."""
+    if collection not in EXPORTS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if rows not in ROW_MODES:
+        raise HTTPException(status_code=400, detail=f"rows must be one of: {', '.join(ROW_MODES)}")
+    try:
+        header = export_columns(collection, rows)
+        query = build_query(collection, status, company_id, date_from, date_to)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    cursor = list_reads(collection).find(query, export_projection(collection, rows), batch_size=EXPORT_BATCH_SIZE)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d")
+    headers = {"Content-Disposition": f"attachment; filename={collection}_{rows}_{stamp}.{format}"}
+    if format == "csv":
+        async def stream():
+            try:
+                yield csv_header(header)
+                async for batch in row_batches(cursor, collection, rows):
+                    yield csv_bytes(batch)
+            finally:
+                await cursor.close()
+        return StreamingResponse(stream(), media_type=EXPORT_FORMATS["csv"], headers=headers)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
+    try:
+        writer = await asyncio.to_thread(XlsxWriter, collection, header)
+        async for batch in row_batches(cursor, collection, rows):
+            await asyncio.to_thread(writer.append, batch)
+        await asyncio.to_thread(writer.save, spool)
+    except BaseException:
+        spool.close()
+        raise
+    return StreamingResponse(iter_file(spool), media_type=EXPORT_FORMATS["xlsx"], headers={**headers, "Content-Length": str(spool.tell())})
+
+# Bulk Import
+# Create model and dedupe keys per collection; the first key that is set on a row
+# identifies it (companies by NPWP when they have one, else by name)
+IMPORTS = {
+    "items": (ItemCreate, ("name",)),
+    "companies": (CompanyCreate, ("npwp", "name")),
+}
+
+async def upsert_import_chunk(collection: str, valid: List[tuple], model, keys: tuple):
+    """Insert or update one chunk of validated rows with a single bulk write;
+    returns (created, updated). Updates only set the fields a row has; `model`
+    defaults fill in the rest of new documents."""
+    row_keys = [dedupe_key(document, keys) for _, document in valid]
+    matches = {}
+    for field in keys:
+        values = [value for key, value in row_keys if key == field]
+        if values:
+            async for existing in db[collection].find({field: {"$in": values}, **LIVE}, {"_id": 0, "id": 1, field: 1}):
+                matches[field, existing[field]] = existing["id"]
+    stamp = await change_stamp()
+    created_at = datetime.now(timezone.utc).isoformat()
+    initial = defaults(model)
+    operations, ids = [], []
+    for (_, document), (field, value) in zip(valid, row_keys):
+        doc_id = matches.get((field, value)) or str(uuid.uuid4())
+        ids.append((doc_id, (field, value) in matches))
+        update = {**document, field: value, **stamp}
+        on_insert = {name: default for name, default in initial.items() if name not in update}
+        operations.append(UpdateOne(
+            {field: value, **LIVE},
+            {"$set": update, "$setOnInsert": {**on_insert, "id": doc_id, "created_at": created_at}},
+            upsert=True,
+        ))
+    result = await db[collection].bulk_write(operations, ordered=False)
+    for doc_id, existed in ids:
+        publish_change(collection, "update" if existed else "create", doc_id, stamp["revision"])
+    return result.upserted_count, result.matched_count
+
+@api_router.post("/import/{collection}")
+async def import_collection(collection: str, file: UploadFile = File(...), dry_run: bool = False):
+    """Import items or companies from a CSV or XLSX upload (header row of field names).
+
+    The file is read and validated a chunk at a time and each chunk is upserted
+    with one bulk write, matched on the collection's dedupe keys. The report lists
+    the rows that were rejected and why; with dry_run nothing is written.
+    """
+    if collection not in IMPORTS:
+        raise HTTPException(status_code=404, detail="Unknown import")
+    model, keys = IMPORTS[collection]
+    batches = chunks(read_rows(file.file, file.filename or ""), IMPORT_CHUNK_SIZE)
+    seen = {}
+
+    def next_chunk():
+        chunk = next(batches, None)
+        if chunk is None:
+            return None
+        return (len(chunk), *validate_chunk(chunk, model, keys, seen))
+
+    report = {"dry_run": dry_run, "rows": 0, "valid": 0, "created": 0, "updated": 0, "error_count": 0, "errors": []}
+    while True:
         try:
-            logo_data = company['logo'].split(',')[1] if ',' in company['logo'] else company['logo']
-            logo_bytes = base64.b64decode(logo_data)
-            logo_img = Image.open(io.BytesIO(logo_bytes))
-            
-            # Resize logo
-            max_width, max_height = 60, 60
-            logo_img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-            
-            logo_buffer = io.BytesIO()
-            logo_img.save(logo_buffer, format='PNG')
-            logo_buffer.seek(0)
-            
-            logo = RLImage(logo_buffer, width=logo_img.width, height=logo_img.height)
-            
-            # Center logo in table
-            logo_table = Table([[logo]], colWidths=[500])
-            logo_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ]))
-            story.append(logo_table)
-            story.append(Spacer(1, 8))
-        except:
-            pass
-    
-    # Company name and details (centered)
-    story.append(Paragraph(f"<b>{company['name']}</b>", company_name_style))
-    
-    if company.get('motto'):
-        story.append(Paragraph(f"<i>{company.get('motto')}</i>", company_motto_style))
-        story.append(Spacer(1, 4))
-    
-    story.append(Paragraph(company.get('address', ''), company_style))
-    story.append(Paragraph(f"Tel: {company.get('phone', '')} | Email: {company.get('email', '')}", company_style))
-    
-    if company.get('website'):
-        story.append(Paragraph(f"Website: {company.get('website')}", company_style))
-    
-    # Line separator
-    story.append(Spacer(1, 10))
-    separator_table = Table([['']], colWidths=[500])
-    separator_table.setStyle(TableStyle([
-        ('LINEABOVE', (0, 0), (-1, 0), 2, colors.HexColor('#000000')),
-        ('LINEBELOW', (0, 0), (-1, 0), 1, colors.HexColor('#000000')),
-    ]))
-    story.append(separator_table)
-    story.append(Spacer(1, 20))
-    
-    # Letter Number and Date
-    letter_info_style = ParagraphStyle('letterinfo', parent=styles['Normal'], fontSize=10, alignment=TA_LEFT)
-    story.append(Paragraph(f"Nomor: {letter['letter_number']}", letter_info_style))
-    story.append(Paragraph(f"Tanggal: {letter['date']}", letter_info_style))
-    
-    if letter.get('attachments_count', 0) > 0:
-        story.append(Paragraph(f"Lampiran: {letter['attachments_count']} berkas", letter_info_style))
-    
-    story.append(Paragraph(f"Perihal: <b>{letter['subject']}</b>", letter_info_style))
-    story.append(Spacer(1, 20))
-    
-    # Recipient
-    story.append(Paragraph("Kepada Yth,", styles['Normal']))
-    story.append(Paragraph(f"<b>{letter['recipient_name']}</b>", styles['Normal']))
-    if letter.get('recipient_position'):
-        story.append(Paragraph(letter['recipient_position'], styles['Normal']))
-    if letter.get('recipient_address'):
-        story.append(Paragraph(letter['recipient_address'], styles['Normal']))
-    story.append(Spacer(1, 20))
-    
-    # Greeting based on letter type
-    if letter['letter_type'] == 'general':
-        story.append(Paragraph("Dengan hormat,", styles['Normal']))
-    elif letter['letter_type'] == 'cooperation':
-        story.append(Paragraph("Dengan hormat,", styles['Normal']))
-    elif letter['letter_type'] == 'request':
-        story.append(Paragraph("Dengan hormat,", styles['Normal']))
-    
-    story.append(Spacer(1, 12))
-    
-    # Letter Content
-    content_style = ParagraphStyle('content', parent=styles['Normal'], fontSize=11, alignment=TA_JUSTIFY, leading=16)
-    
-    # Split content by paragraphs
-    paragraphs = letter['content'].split('\n')
-    for para in paragraphs:
-        if para.strip():
-            story.append(Paragraph(para.strip(), content_style))
-            story.append(Spacer(1, 8))
-    
-    story.append(Spacer(1, 12))
-    
-    # Closing based on letter type
-    if letter['letter_type'] == 'general':
-        story.append(Paragraph("Demikian surat ini kami sampaikan. Atas perhatian dan kerjasamanya, kami ucapkan terima kasih.", styles['Normal']))
-    elif letter['letter_type'] == 'cooperation':
-        story.append(Paragraph("Demikian surat penawaran kerjasama ini kami sampaikan. Besar harapan kami dapat menjalin kerjasama yang baik dengan perusahaan Bapak/Ibu.", styles['Normal']))
-    elif letter['letter_type'] == 'request':
-        story.append(Paragraph("Demikian permohonan ini kami sampaikan, atas perhatian dan perkenannya kami ucapkan terima kasih.", styles['Normal']))
-    
-    story.append(Spacer(1, 30))
-    
-    # Signatories
-    if letter.get('signatories') and len(letter['signatories']) > 0:
-        sig_data = []
-        sig_widths = []
-        
-        num_sigs = len(letter['signatories'])
-        col_width = 500 // num_sigs
-        
-        for sig in letter['signatories']:
-            sig_content = []
-            sig_style = ParagraphStyle('sig', parent=styles['Normal'], fontSize=10, alignment=TA_CENTER)
-            
-            sig_content.append(Paragraph(sig.get('position', ''), sig_style))
-            sig_content.append(Spacer(1, 5))
-            
-            # Add signature image if available
-            if sig.get('signature_image'):
-                try:
-                    sig_img_data = sig['signature_image'].split(',')[1] if ',' in sig['signature_image'] else sig['signature_image']
-                    sig_img_bytes = base64.b64decode(sig_img_data)
-                    sig_img_pil = Image.open(io.BytesIO(sig_img_bytes))
-                    
-                    # Resize signature - 2x larger for better visibility
-                    max_sig_width, max_sig_height = 160, 80
-                    sig_img_pil.thumbnail((max_sig_width, max_sig_height), Image.Resampling.LANCZOS)
-                    
-                    sig_img_buffer = io.BytesIO()
-                    sig_img_pil.save(sig_img_buffer, format='PNG')
-                    sig_img_buffer.seek(0)
-                    
-                    sig_image = RLImage(sig_img_buffer, width=sig_img_pil.width, height=sig_img_pil.height)
-                    sig_content.append(sig_image)
-                except:
-                    sig_content.append(Spacer(1, 80))
-            else:
-                sig_content.append(Spacer(1, 80))
-            
-            sig_content.append(Spacer(1, 5))
-            sig_content.append(Paragraph(f"<b>{sig.get('name', '')}</b>", sig_style))
-            
-            sig_data.append(sig_content)
-            sig_widths.append(col_width)
-        
-        # Create signature table
-        sig_table = Table([sig_data], colWidths=sig_widths)
-        sig_table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ]))
-        story.append(sig_table)
-    
-    # CC List
-    if letter.get('cc_list'):
-        story.append(Spacer(1, 30))
-        story.append(Paragraph("<b>Tembusan:</b>", styles['Normal']))
-        cc_items = letter['cc_list'].split('\n')
-        for cc in cc_items:
-            if cc.strip():
-                story.append(Paragraph(f"- {cc.strip()}", styles['Normal']))
-    
-    doc.build(story)
-    buffer.seek(0)
-    
-    return StreamingResponse(buffer, media_type="application/pdf", headers={
-        "Content-Disposition": f"attachment; filename=letter_{letter['letter_number'].replace('/', '_')}.pdf"
+            result = await asyncio.to_thread(next_chunk)
+        except (ValueError, csv.Error) as exc:
+            # Chunks before the unreadable part have been imported already
+            report["error"] = f"Could not read the file after row {report['rows'] + 1}: {exc}"
+            return JSONResponse(report, status_code=400)
+        if result is None:
+            break
+        count, valid, errors = result
+        report["rows"] += count
+        report["valid"] += len(valid)
+        report["error_count"] += len(errors)
+        report["errors"].extend(errors[:MAX_REPORTED_ERRORS - len(report["errors"])])
+        if valid and not dry_run:
+            created, updated = await upsert_import_chunk(collection, valid, model, keys)
+            report["created"] += created
+            report["updated"] += updated
+    return report
+
+# Routes that take references to documents of any kind
+PDF_COLLECTIONS = {"invoice": "invoices", "quotation": "quotations", "letter": "letters"}
+
+async def fetch_documents(refs: List[PdfReference]):
+    """Load the referenced documents with one query per kind, plus their companies.
+
+    Returns ({(kind, id): document}, {company id: company}); documents that do
+    not exist, or whose company does not, are left out.
+    """
+    unknown = {ref.kind for ref in refs} - PDF_COLLECTIONS.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown document kind: {', '.join(sorted(unknown))}")
+    documents = {}
+    for kind, collection in PDF_COLLECTIONS.items():
+        ids = list({ref.id for ref in refs if ref.kind == kind})
+        if ids:
+            async for document in db[collection].find({"id": {"$in": ids}, **LIVE}, {"_id": 0}):
+                documents[kind, document["id"]] = document
+    company_ids = list({document["company_id"] for document in documents.values()})
+    companies = {company["id"]: company async for company in db.companies.find({"id": {"$in": company_ids}}, {"_id": 0})}
+    return {key: document for key, document in documents.items() if document["company_id"] in companies}, companies
+
+# Merged PDF: several documents, in the requested order, as one file
+@api_router.post("/pdf/merge")
+async def merge_pdf(merge: PdfMergeRequest):
+    """Render (or reuse the cached renders of) the referenced documents in parallel
+    and stream them as one PDF with a bookmark per document."""
+    from pdf_merge import bookmark_title, merge_pdfs
+    if not merge.documents:
+        raise HTTPException(status_code=400, detail="No documents")
+    if len(merge.documents) > PDF_MERGE_MAX_DOCUMENTS:
+        raise HTTPException(status_code=413, detail=f"At most {PDF_MERGE_MAX_DOCUMENTS} documents per merge")
+    documents, companies = await fetch_documents(merge.documents)
+    missing = [f"{ref.kind} {ref.id}" for ref in merge.documents if (ref.kind, ref.id) not in documents]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Documents not found: {', '.join(missing)}")
+
+    # Each distinct document is rendered once, even if it is referenced twice
+    keys = list(documents)
+    results = await asyncio.gather(*(
+        open_rendered_pdf(kind, documents[kind, id], companies[documents[kind, id]["company_id"]], StageTimer(PDF_STAGE_SECONDS, kind))
+        for kind, id in keys
+    ), return_exceptions=True)
+    files = {key: result[0] for key, result in zip(keys, results) if not isinstance(result, BaseException)}
+    spool = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
+    try:
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        parts = [(ref.title or bookmark_title(ref.kind, documents[ref.kind, ref.id]), files[ref.kind, ref.id])
+                 for ref in merge.documents]
+        await asyncio.to_thread(merge_pdfs, parts, spool)
+    except BaseException:
+        spool.close()
+        raise
+    finally:
+        for file in files.values():
+            file.close()
+    filename = re.sub(r"[^\w.-]+", "_", merge.filename or "").strip("_") or f"merged_{len(merge.documents)}"
+    if not filename.lower().endswith(".pdf"):
+        filename += ".pdf"
+    return StreamingResponse(iter_file(spool), media_type="application/pdf", headers={
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Content-Length": str(spool.tell()),
     })
 
-# Include the router in the main app
-app.include_router(api_router)
+# Thumbnails: a small image of page one, for list previews
+async def thumbnail_image(kind: str, document: dict, company: dict, width: int, image_format: str):
+    """The encoded thumbnail and its cache key. Taken from the (cached) PDF when
+    PyMuPDF is installed, otherwise sketched from the document data."""
+    from thumbnails import rasterizer_available, render_thumbnail
+    key = ThumbnailCache.key(PdfCache.key(kind, document, company), width, image_format)
+    data = thumbnail_cache.get(key) if thumbnail_cache is not None else None
+    THUMBNAIL_CACHE_REQUESTS.inc(kind, "miss" if data is None else "hit")
+    if data is not None:
+        return data, key
+    if rasterizer_available():
+        file, _ = await open_rendered_pdf(kind, document, company, StageTimer(PDF_STAGE_SECONDS, kind))
+        try:
+            data = await asyncio.to_thread(render_thumbnail, kind, document, company, width, image_format, file)
+        finally:
+            file.close()
+    else:
+        data = await asyncio.to_thread(render_thumbnail, kind, document, company, width, image_format)
+    if thumbnail_cache is not None:
+        thumbnail_cache.put(key, data)
+    return data, key
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def check_thumbnail_format(image_format: str):
+    if image_format not in THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(THUMBNAIL_FORMATS)}")
+
+@api_router.get("/{collection}/{document_id}/thumbnail")
+async def get_thumbnail(collection: str, document_id: str, request: Request,
+                        width: int = Query(200, ge=THUMBNAIL_MIN_WIDTH, le=THUMBNAIL_MAX_WIDTH), format: str = "webp"):
+    kind = next((kind for kind, name in PDF_COLLECTIONS.items() if name == collection), None)
+    if kind is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    check_thumbnail_format(format)
+    documents, companies = await fetch_documents([PdfReference(kind=kind, id=document_id)])
+    document = documents.get((kind, document_id))
+    if document is None:
+        raise HTTPException(status_code=404, detail=f"{kind.capitalize()} not found")
+    data, key = await thumbnail_image(kind, document, companies[document["company_id"]], width, format)
+    etag = f'"{key}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(data, media_type=THUMBNAIL_FORMATS[format][1], headers={"ETag": etag})
+
+@api_router.post("/thumbnails")
+async def get_thumbnails(batch: ThumbnailBatchRequest):
+    """Thumbnails for a whole list page as data URIs, in request order; references
+    that do not resolve are listed under `missing`."""
+    check_thumbnail_format(batch.format)
+    if len(batch.documents) > THUMBNAIL_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {THUMBNAIL_BATCH_MAX} thumbnails per request")
+    documents, companies = await fetch_documents(batch.documents)
+    found = [ref for ref in batch.documents if (ref.kind, ref.id) in documents]
+    images = await asyncio.gather(*(
+        thumbnail_image(ref.kind, documents[ref.kind, ref.id], companies[documents[ref.kind, ref.id]["company_id"]],
+                        batch.width, batch.format)
+        for ref in found
+    ))
+    media_type = THUMBNAIL_FORMATS[batch.format][1]
+    return {
+        "thumbnails": [
+            {"kind": ref.kind, "id": ref.id, "etag": key,
+             "image": f"data:{media_type};base64,{base64.b64encode(data).decode()}"}
+            for ref, (data, key) in zip(found, images)
+        ],
+        "missing": [{"kind": ref.kind, "id": ref.id} for ref in batch.documents if (ref.kind, ref.id) not in documents],
+    }
+
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def mongo_client_options() -> dict:
+    """Pool, timeout and compression settings for the Motor client.
+
+    Size MONGO_MAX_POOL_SIZE to what one worker can use concurrently; a checkout
+    that waits longer than MONGO_WAIT_QUEUE_TIMEOUT_MS fails instead of queueing.
+    """
+    options = {
+        "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+        "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '0')) or None,
+        "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '30000')),
+        "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '20000')),
+        "timeoutMS": int(os.environ.get('MONGO_TIMEOUT_MS', '0')) or None,
+    }
+    if os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS'):
+        options["waitQueueTimeoutMS"] = int(os.environ['MONGO_WAIT_QUEUE_TIMEOUT_MS'])
+    if os.environ.get('MONGO_COMPRESSORS'):
+        # e.g. "zstd,snappy,zlib"; compressors whose package is missing are skipped with a warning
+        options["compressors"] = os.environ['MONGO_COMPRESSORS']
+    return options
+
+async def query_timeout(request: Request, exc: ExecutionTimeout):
+    return JSONResponse({"detail": "Query took too long"}, status_code=503, headers={"Retry-After": "5"})
+
+def _warm_up_pdf() -> dict:
+    from pdf_render import warm_up
+    return warm_up()
+
+async def warm_up_renderers(app: FastAPI):
+    """Import and exercise the PDF stack off the event loop, then mark the worker ready."""
+    start = asyncio.get_running_loop().time()
+    try:
+        seconds = await asyncio.to_thread(_warm_up_pdf)
+        logger.info("PDF warm-up done in %.2fs (%s)", asyncio.get_running_loop().time() - start,
+                    ", ".join(f"{kind} {value * 1000:.0f}ms" for kind, value in seconds.items()))
+    except Exception:
+        # A broken renderer should not keep the worker out of rotation for CRUD traffic
+        logger.exception("PDF warm-up failed")
+    app.state.ready = True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, db, events_source
+    if app.state.mongo_client is not None:
+        client = app.state.mongo_client
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(
+            os.environ['MONGO_URL'],
+            event_listeners=[CommandTimingListener(), PoolMetricsListener(), slow_commands],
+            **mongo_client_options(),
+        )
+    db = client[os.environ['DB_NAME']]
+
+    await ensure_change_tracking()
+    await ensure_indexes()
+    slow_commands.attach(db, asyncio.get_running_loop())
+
+    source = os.environ.get('EVENTS_SOURCE', 'auto')
+    watcher = None
+    if source == "change_stream" or (source == "auto" and await supports_change_streams(db)):
+        events_source = "change_stream"
+        watcher = asyncio.create_task(watch_change_streams(db, change_broker, SYNCED_COLLECTIONS))
+    logger.info("Change events source: %s", events_source)
+
+    # Render tiny documents before taking traffic so the first real PDF is not
+    # the one that loads ReportLab, its font metrics and the image codecs
+    app.state.ready = False
+    warmup = None
+    if os.environ.get('WARMUP_ON_STARTUP', '1') == '1':
+        warmup = asyncio.create_task(warm_up_renderers(app))
+    else:
+        app.state.ready = True
+    try:
+        yield
+    finally:
+        global merge_pool
+        if merge_pool is not None:
+            merge_pool.shutdown(cancel_futures=True)
+            merge_pool = None
+        if warmup:
+            warmup.cancel()
+        if watcher:
+            watcher.cancel()
+        client.close()
+
+def create_app(mongo_client=None) -> FastAPI:
+    """Build the ASGI app from the environment (and backend/.env).
+
+    `mongo_client` replaces the Motor client the lifespan would open, e.g. an
+    in-memory stand-in for benchmarks.
+    """
+    global slow_log, slow_commands, render_profiler, change_broker, ADMIN_TOKEN, list_read_preference, LIST_MAX_TIME_MS
+    global pdf_cache, PDF_SPOOL_MAX_BYTES, MAIL_MERGE_MAX_RECIPIENTS, PDF_MERGE_MAX_DOCUMENTS, thumbnail_cache, THUMBNAIL_BATCH_MAX
+    global INVOICE_NUMBER_FORMAT, CONVERT_MAX_QUOTATIONS, ARCHIVE_AFTER_DAYS, ARCHIVE_DELETED_AFTER_DAYS, ARCHIVE_COMPRESSOR
+    global HISTORY_SNAPSHOT_EVERY, CHANGES_SETTLE_MS
+    load_dotenv(ROOT_DIR / '.env')
+
+    # Slow operation log, thresholds in milliseconds
+    slow_log = SlowLog(
+        size=int(os.environ.get('SLOW_LOG_SIZE', '200')),
+        query_ms=float(os.environ.get('SLOW_QUERY_MS', '500')),
+        render_ms=float(os.environ.get('SLOW_RENDER_MS', '2000')),
+        request_ms=float(os.environ.get('SLOW_REQUEST_MS', '2000')),
+    )
+    # Slow queries are explained once per query shape every SLOW_QUERY_EXPLAIN_INTERVAL seconds
+    slow_commands = SlowCommandListener(
+        slow_log,
+        max_explains=int(os.environ.get('SLOW_QUERY_MAX_EXPLAINS', '2')),
+        explain_interval=float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', '300')),
+    )
+    # cProfile for PDF renders: on demand with ?profile=1, or a random sample of renders
+    render_profiler = RenderProfiler(sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0')))
+    # Debug and profiling endpoints require this token in the X-Admin-Token header
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+    change_broker = ChangeBroker(queue_size=int(os.environ.get('EVENTS_QUEUE_SIZE', '100')))
+    list_read_preference = READ_PREFERENCES[os.environ.get('MONGO_LIST_READ_PREFERENCE', 'primary')]
+    LIST_MAX_TIME_MS = int(os.environ.get('MONGO_LIST_MAX_TIME_MS', '10000'))
+    CHANGES_SETTLE_MS = int(os.environ.get('CHANGES_SETTLE_MS', '5000'))
+    cache_mb = int(os.environ.get('PDF_CACHE_MAX_MB', '512'))
+    cache_dir = os.environ.get('PDF_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'pdf-cache')
+    pdf_cache = PdfCache(cache_dir, cache_mb * 1024 * 1024) if cache_mb > 0 else None
+    PDF_SPOOL_MAX_BYTES = int(os.environ.get('PDF_SPOOL_MAX_BYTES', str(1024 * 1024)))
+    MAIL_MERGE_MAX_RECIPIENTS = int(os.environ.get('MAIL_MERGE_MAX_RECIPIENTS', '5000'))
+    PDF_MERGE_MAX_DOCUMENTS = int(os.environ.get('PDF_MERGE_MAX_DOCUMENTS', '50'))
+    thumbnail_mb = int(os.environ.get('THUMBNAIL_CACHE_MAX_MB', '64'))
+    thumbnail_cache = ThumbnailCache(thumbnail_mb * 1024 * 1024) if thumbnail_mb > 0 else None
+    THUMBNAIL_BATCH_MAX = int(os.environ.get('THUMBNAIL_BATCH_MAX', '100'))
+    INVOICE_NUMBER_FORMAT = os.environ.get('INVOICE_NUMBER_FORMAT', 'INV-{year}-{seq:05d}')
+    CONVERT_MAX_QUOTATIONS = int(os.environ.get('CONVERT_MAX_QUOTATIONS', '500'))
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '730'))
+    ARCHIVE_DELETED_AFTER_DAYS = int(os.environ.get('ARCHIVE_DELETED_AFTER_DAYS', '30'))
+    # Block compressor of the archive collections; empty for the server default
+    ARCHIVE_COMPRESSOR = os.environ.get('ARCHIVE_COMPRESSOR', 'zstd')
+    HISTORY_SNAPSHOT_EVERY = max(1, int(os.environ.get('HISTORY_SNAPSHOT_EVERY', '20')))
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.mongo_client = mongo_client
+    app.include_router(api_router)
+    app.add_api_route("/metrics", get_metrics, methods=["GET"], include_in_schema=False)
+    app.add_exception_handler(ExecutionTimeout, query_timeout)
+    # Inside CORS so that 429/503 rejections still carry CORS headers for the browser
+    app.add_middleware(
+        AdmissionMiddleware,
+        limits=limits_from_env(),
+        queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', '10000')) / 1000,
+        client_header=os.environ.get('ADMISSION_CLIENT_HEADER', ''),
+    )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(SlowRequestMiddleware, slow_log=slow_log)
+    # PDF streams and images are already deflated, and compressing PDFs would
+    # drop their Content-Length and byte ranges, so PDFs are sent as they are:
+    # excluded by content type, and the usual PDF routes skip the middleware
+    # outright. COMPRESSION_THREAD_THRESHOLD (bytes, 0 = off) moves large chunks
+    # off the event loop; at level 1 compressing inline measured faster.
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '4096')),
+        level=int(os.environ.get('COMPRESSION_LEVEL', '1')),
+        route_levels=parse_route_levels(os.environ.get('COMPRESSION_ROUTE_LEVELS', '/pdf$=0,^/api/pdf/=0,/mail-merge(/csv)?$=0')),
+        thread_threshold=int(os.environ.get('COMPRESSION_THREAD_THRESHOLD', '0')) or None,
+    )
+    app.add_middleware(MetricsMiddleware)
+    return app
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
-logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+app = create_app()
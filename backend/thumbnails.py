@@ -0,0 +1,270 @@
+"""Small WebP/PNG previews of page one of a document.
+
+With PyMuPDF installed, page one of the rendered PDF (normally already in the PDF
+cache) is rasterized. Without it, a sketch of the page is drawn straight from
+the document data with Pillow: the header, document details, the items table
+and totals at their places on an A4 page, with text too small to read drawn as
+grey bars. Encoded thumbnails are kept in a size-bounded LRU keyed by the same
+document and company revisions as the PDF cache.
+"""
+import importlib.util
+import io
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import BinaryIO, Optional
+
+FORMATS = {"webp": ("WEBP", "image/webp"), "png": ("PNG", "image/png")}
+MIN_WIDTH = 64
+MAX_WIDTH = 600
+
+# A4 in points; sketches are laid out in points and scaled to the thumbnail
+PAGE_WIDTH, PAGE_HEIGHT = 595.27, 841.89
+# Below this pixel size text is unreadable and drawn as a bar
+MIN_TEXT_PX = 6
+
+
+class ThumbnailCache:
+    """In-memory LRU of encoded thumbnails, bounded by their total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+
+    @staticmethod
+    def key(pdf_key: str, width: int, image_format: str) -> str:
+        return f"{pdf_key}-w{width}.{image_format}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+
+@lru_cache(maxsize=None)
+def rasterizer_available() -> bool:
+    """Whether PyMuPDF is installed, i.e. thumbnails are taken from the rendered PDF."""
+    return importlib.util.find_spec("fitz") is not None
+
+
+def rasterize(pdf: BinaryIO, width: int):
+    """Page one of a PDF as a `width` pixels wide RGB image (needs PyMuPDF)."""
+    import fitz
+    from PIL import Image
+    pdf.seek(0)
+    with fitz.open(stream=pdf.read(), filetype="pdf") as document:
+        page = document[0]
+        zoom = width / page.rect.width
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+
+@lru_cache(maxsize=64)
+def _font(size: int):
+    from PIL import ImageFont
+    return ImageFont.load_default(size=size)
+
+
+class _Sketch:
+    """Pillow drawing in page points (origin top left), scaled to the thumbnail width."""
+
+    def __init__(self, width: int):
+        from PIL import Image, ImageDraw
+        self.scale = width / PAGE_WIDTH
+        self.image = Image.new("RGB", (width, round(PAGE_HEIGHT * self.scale)), "white")
+        self.draw = ImageDraw.Draw(self.image)
+
+    def box(self, x: float, y: float, width: float, height: float, fill=None, outline=None):
+        s = self.scale
+        self.draw.rectangle((x * s, y * s, (x + width) * s, (y + height) * s), fill=fill, outline=outline)
+
+    def rule(self, x: float, y: float, width: float, thickness: float = 1, fill="black"):
+        self.box(x, y, width, max(thickness, 1 / self.scale), fill=fill)
+
+    def text(self, x: float, y: float, text: str, size: float, fill="black", align: str = "left", bold: bool = False,
+             max_width: float = PAGE_WIDTH - 2 * 36):
+        """One line of text, cut at `max_width`; `x` is the left edge, centre or right
+        edge depending on `align`."""
+        text = re.sub(r"<[^>]+>", "", text or "")
+        if not text:
+            return
+        pixels = round(size * self.scale)
+        if pixels < MIN_TEXT_PX:
+            # Helvetica averages about half an em per character
+            width = min(len(text) * size * (0.55 if bold else 0.5), max_width)
+            left = x - width / 2 if align == "center" else x - width if align == "right" else x
+            self.box(left, y + size * 0.2, width, size * (0.7 if bold else 0.55), fill=fill if bold else "#b0b0b0")
+            return
+        font = _font(pixels)
+        while len(text) > 1 and font.getlength(text) > max_width * self.scale:
+            text = text[:-1]
+        anchor = {"left": "la", "center": "ma", "right": "ra"}[align]
+        self.draw.text((x * self.scale, y * self.scale), text, fill=fill, font=font, anchor=anchor,
+                       stroke_width=1 if bold and pixels >= 12 else 0, stroke_fill=fill)
+
+    def paste_logo(self, data_uri: str, centre: float, y: float, max_size: float) -> float:
+        """Draw the logo centred on `centre`; returns its height in points (0 if unreadable)."""
+        import base64
+        from PIL import Image
+        try:
+            logo = Image.open(io.BytesIO(base64.b64decode(data_uri.split(",")[-1])))
+            logo.thumbnail((max_size, max_size))
+            width, height = logo.size
+            logo = logo.convert("RGBA").resize((max(1, round(width * self.scale)), max(1, round(height * self.scale))))
+        except Exception:
+            return 0
+        self.image.paste(logo, (round((centre - width / 2) * self.scale), round(y * self.scale)), logo)
+        return height
+
+
+def _sketch_priced(sketch: _Sketch, kind: str, document: dict, company: dict):
+    from pdf_render import PRICED_LAYOUTS, format_currency, resolve_template
+    layout = PRICED_LAYOUTS[kind]
+    accent = resolve_template(kind, document)["accent"]
+    currency = document.get("currency", "IDR")
+    left, bottom = 50, PAGE_HEIGHT - 50
+    table_left = (PAGE_WIDTH - 500) / 2
+
+    sketch.text(PAGE_WIDTH / 2, 50, layout["title"], 24, fill=accent, align="center", bold=True)
+    y = 104
+    sketch.text(left, y, company.get("name", ""), 10, bold=True)
+    for line in (company.get("address", ""), f"Phone: {company.get('phone', '')} | Email: {company.get('email', '')}",
+                 f"NPWP: {company['npwp']}" if company.get("npwp") else ""):
+        if line:
+            y += 12
+            sketch.text(left, y, line, 10)
+    y += 34
+
+    widths = layout["info_widths"]
+    for row in ((layout["number_label"], document.get(f"{kind}_number", ""), "Date:", document.get("date", "")),
+                ("Client:", document.get("client_name", ""), layout["until_label"], document.get(layout["until_field"]) or "-")):
+        x = table_left
+        for column, (value, width) in enumerate(zip(row, widths)):
+            sketch.text(x + 6, y, str(value), 10, bold=column % 2 == 0, max_width=width - 12)
+            x += width
+        y += 22
+    y += 20
+
+    columns = (120, 150, 60, 80, 90)
+    sketch.box(table_left, y, 500, 26, fill=accent)
+    x = table_left
+    for title, width in zip(("Item", "Description", "Qty", "Unit Price", "Total"), columns):
+        sketch.text(x + 6, y + 7, title, 10, fill="white", bold=True)
+        x += width
+    y += 26
+    items = document.get("items") or []
+    for index, item in enumerate(items):
+        if y + 18 > bottom:
+            return
+        sketch.box(table_left, y, 500, 18, fill="#f5f5f5" if index % 2 == 0 else "white", outline="#808080")
+        values = (item.get("name", ""), item.get("description", ""), f"{item.get('quantity', '')} {item.get('unit', '')}",
+                  format_currency(item.get("unit_price", 0), currency), format_currency(item.get("total", 0), currency))
+        x = table_left
+        for column, (value, width) in enumerate(zip(values, columns)):
+            if column < 2:
+                sketch.text(x + 6, y + 4, value, 10, max_width=width - 12)
+            else:
+                sketch.text(x + width - 6, y + 4, value, 10, align="right", max_width=width - 12)
+            x += width
+        y += 18
+    y += 20
+
+    totals = [("Subtotal:", document.get("subtotal", 0))]
+    if document.get("discount_amount", 0) > 0:
+        totals.append((f"Discount ({document.get('discount_rate', 0)}%):", document["discount_amount"]))
+    if document.get("tax_amount", 0) > 0:
+        totals.append((f"Tax ({document.get('tax_rate', 0)}%):", document["tax_amount"]))
+    totals.append(("Total:", document.get("total", 0)))
+    for index, (label, amount) in enumerate(totals):
+        last = index == len(totals) - 1
+        if y + 22 > bottom:
+            return
+        if last:
+            sketch.rule(table_left, y, 500, 2, fill=accent)
+        sketch.text(table_left + 344, y + 5, label, 12 if last else 10, align="right", bold=last)
+        sketch.text(table_left + 494, y + 5, format_currency(amount, currency), 12 if last else 10, align="right", bold=last)
+        y += 22
+
+
+def _sketch_letter(sketch: _Sketch, letter: dict, company: dict):
+    left, width, bottom = 72, PAGE_WIDTH - 144, PAGE_HEIGHT - 36
+    centre = PAGE_WIDTH / 2
+    y = 36
+    if company.get("logo"):
+        height = sketch.paste_logo(company["logo"], centre, y + 4, 60)
+        if height:
+            y += height + 16
+    sketch.text(centre, y, company.get("name", ""), 14, align="center", bold=True)
+    y += 20
+    if company.get("motto"):
+        sketch.text(centre, y, company["motto"], 9, fill="#666666", align="center")
+        y += 15
+    for line in (company.get("address", ""), f"Tel: {company.get('phone', '')} | Email: {company.get('email', '')}",
+                 f"Website: {company['website']}" if company.get("website") else ""):
+        if line:
+            sketch.text(centre, y, line, 11, align="center")
+            y += 14
+    y += 12
+    sketch.rule(centre - 250, y, 500, 2)
+    sketch.rule(centre - 250, y + 16, 500, 1)
+    y += 40
+
+    for line in (f"Nomor: {letter.get('letter_number', '')}", f"Tanggal: {letter.get('date', '')}",
+                 f"Perihal: {letter.get('subject', '')}"):
+        sketch.text(left, y, line, 10)
+        y += 12
+    y += 20
+    sketch.text(left, y, "Kepada Yth,", 10)
+    sketch.text(left, y + 12, letter.get("recipient_name", ""), 10, bold=True)
+    y += 44
+
+    # Body text wrapped by character count; close enough for a preview
+    per_line = int(width / 5)
+    for paragraph in (letter.get("content") or "").split("\n"):
+        words, line = paragraph.split(), ""
+        for word in words + [None]:
+            if word is not None and len(line) + len(word) + 1 <= per_line:
+                line = f"{line} {word}".strip()
+                continue
+            if y + 14 > bottom:
+                return
+            sketch.text(left, y, line, 10)
+            y += 14
+            line = word or ""
+        y += 6
+
+
+def sketch(kind: str, document: dict, company: dict, width: int):
+    """Draw page one from the document data; no PDF is rendered."""
+    drawing = _Sketch(width)
+    if kind == "letter":
+        _sketch_letter(drawing, document, company)
+    else:
+        _sketch_priced(drawing, kind, document, company)
+    return drawing.image
+
+
+def encode(image, image_format: str) -> bytes:
+    output = io.BytesIO()
+    options = {"quality": 80, "method": 4} if image_format == "webp" else {"optimize": True}
+    image.save(output, format=FORMATS[image_format][0], **options)
+    return output.getvalue()
+
+
+def render_thumbnail(kind: str, document: dict, company: dict, width: int, image_format: str,
+                     pdf: Optional[BinaryIO] = None) -> bytes:
+    """Encoded thumbnail of page one, from `pdf` when given, else sketched from the data."""
+    image = rasterize(pdf, width) if pdf is not None else sketch(kind, document, company, width)
+    return encode(image, image_format)
@@ -0,0 +1,154 @@
+"""Synthetic companies, invoices, quotations and letters for benchmarks.
+
+Documents have the same shape as the ones the API stores, so they can be
+inserted straight into MongoDB or handed to the PDF renderers.
+"""
+import base64
+import io
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+
+WORDS = (
+    "kerjasama penawaran layanan pengadaan barang jasa konsultasi proyek kontrak "
+    "pembayaran termin jadwal pengiriman gudang laporan audit pajak dokumen "
+    "service maintenance license support hardware software training network"
+).split()
+
+
+@lru_cache(maxsize=None)
+def png_data_uri(width: int, height: int, seed: int = 0) -> str:
+    """A noisy PNG (so it does not compress to nothing) as a data URI."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    for _ in range(max(10, width * height // 400)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.ellipse((x, y, x + rng.randrange(2, 12), y + rng.randrange(2, 12)), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def line_item_count(rng: random.Random) -> int:
+    """1-300 line items, skewed towards short documents like real invoices."""
+    roll = rng.random()
+    if roll < 0.8:
+        return rng.randint(1, 20)
+    if roll < 0.98:
+        return rng.randint(21, 100)
+    return rng.randint(101, 300)
+
+
+def _stamp(rng: random.Random) -> dict:
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=rng.randrange(60 * 24 * 700))
+    return {"created_at": created.isoformat(), "updated_at": created.isoformat()}
+
+
+def make_company(rng: random.Random, logo_size: int = 0) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "name": f"PT {sentence(rng, 2)} {rng.randrange(10000)}",
+        "address": f"Jl. {sentence(rng, 2)} No. {rng.randrange(1, 300)}, Jakarta",
+        "phone": f"021-{rng.randrange(1000000, 9999999)}",
+        "email": f"info{rng.randrange(100000)}@example.co.id",
+        "website": "www.example.co.id",
+        "motto": sentence(rng, 5),
+        "npwp": f"{rng.randrange(10**14, 10**15)}",
+        "bank_name": "Bank Mandiri",
+        "bank_account": f"{rng.randrange(10**12, 10**13)}",
+        "bank_account_name": "PT Example",
+        "logo": png_data_uri(logo_size, logo_size, seed=1) if logo_size else None,
+        **_stamp(rng),
+    }
+
+
+def make_line_items(rng: random.Random, count: int) -> list:
+    items = []
+    for _ in range(count):
+        quantity = rng.randint(1, 50)
+        unit_price = rng.randrange(10, 5000) * 1000
+        items.append({
+            "item_id": None,
+            "name": sentence(rng, 2),
+            "description": sentence(rng, rng.randint(3, 12)),
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "unit": rng.choice(["pcs", "unit", "jam", "paket"]),
+            "total": quantity * unit_price,
+        })
+    return items
+
+
+def make_invoice(rng: random.Random, company_id: str, items: int = None, kind: str = "invoice") -> dict:
+    line_items = make_line_items(rng, items if items is not None else line_item_count(rng))
+    subtotal = sum(item["total"] for item in line_items)
+    discount_rate = rng.choice([0, 0, 5, 10])
+    tax_rate = rng.choice([0, 11])
+    discount_amount = subtotal * discount_rate / 100
+    tax_amount = (subtotal - discount_amount) * tax_rate / 100
+    doc_id = str(uuid.uuid4())
+    doc = {
+        "id": doc_id,
+        # Invoice numbers are unique
+        f"{kind}_number": f"{'INV' if kind == 'invoice' else 'QUO'}/{rng.randrange(2023, 2026)}/{doc_id[:13].upper()}",
+        "company_id": company_id,
+        "client_name": f"PT {sentence(rng, 2)}",
+        "client_address": f"Jl. {sentence(rng, 3)}",
+        "client_phone": "0812-0000-0000",
+        "client_email": "client@example.com",
+        "date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "items": line_items,
+        "subtotal": subtotal,
+        "tax_rate": tax_rate,
+        "tax_amount": tax_amount,
+        "discount_rate": discount_rate,
+        "discount_amount": discount_amount,
+        "total": subtotal - discount_amount + tax_amount,
+        "currency": "IDR",
+        "notes": sentence(rng, 15),
+        "template_id": "template1",
+        "status": rng.choice(["draft", "sent", "paid"]),
+        "signature_name": "Budi Santoso",
+        "signature_position": "Direktur",
+        **_stamp(rng),
+    }
+    doc["due_date" if kind == "invoice" else "valid_until"] = "2025-12-31"
+    return doc
+
+
+def make_quotation(rng: random.Random, company_id: str, items: int = None) -> dict:
+    return make_invoice(rng, company_id, items, kind="quotation")
+
+
+def make_letter(rng: random.Random, company_id: str, paragraphs: int = 4, signatories: int = 2, signature_size: int = 200) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "letter_number": f"{rng.randrange(1000):03d}/SK/{rng.randrange(2023, 2026)}",
+        "company_id": company_id,
+        "date": "17 Agustus 2025",
+        "subject": sentence(rng, 4),
+        "letter_type": rng.choice(["general", "cooperation", "request"]),
+        "recipient_name": f"Bapak {sentence(rng, 2)}",
+        "recipient_position": "Direktur Utama",
+        "recipient_address": f"Jl. {sentence(rng, 3)}, Bandung",
+        "content": "\n".join(sentence(rng, rng.randint(30, 80)) + "." for _ in range(paragraphs)),
+        "attachments_count": rng.randint(0, 3),
+        "cc_list": "\n".join(sentence(rng, 3) for _ in range(rng.randint(0, 3))),
+        "signatories": [
+            {
+                "name": sentence(rng, 2),
+                "position": rng.choice(["Direktur", "Manajer", "Komisaris"]),
+                "signature_image": png_data_uri(signature_size, signature_size // 2, seed=2 + n) if signature_size else None,
+            }
+            for n in range(signatories)
+        ],
+        **_stamp(rng),
+    }
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""In-process load test for the API.
+
+Boots the FastAPI app from backend/server.py against a local mongod (--mongo-url)
+or an in-memory MongoDB stand-in (mongomock-motor, the default), seeds realistic
+data, then drives a weighted mix of CRUD and PDF requests at a fixed concurrency.
+Latency percentiles and throughput per operation are printed and written as JSON
+so runs from different commits can be compared.
+
+    python benchmarks/load_test.py --scale 0.01 --concurrency 16 --requests 2000 --output run.json
+    python benchmarks/load_test.py --mongo-url mongodb://localhost:27017 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "backend"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import fixtures  # noqa: E402
+
+DEFAULT_MIX = {
+    "list_companies": 3,
+    "get_company": 10,
+    "list_invoices": 2,
+    "get_invoice": 25,
+    "create_invoice": 8,
+    "update_invoice": 8,
+    "delete_invoice": 1,
+    "get_letter": 10,
+    "changes": 5,
+    "invoice_pdf": 12,
+    "quotation_pdf": 6,
+    "letter_pdf": 10,
+}
+
+
+def load_server(mongo_url, db_name):
+    """Build the app with its database pointed at `mongo_url`, or at an in-memory stand-in."""
+    os.environ["MONGO_URL"] = mongo_url or "mongodb://localhost:27017"
+    os.environ["DB_NAME"] = db_name
+    import server
+    mongo_client = None
+    if not mongo_url:
+        from mongomock_motor import AsyncMongoMockClient
+        mongo_client = AsyncMongoMockClient()
+    return server, server.create_app(mongo_client=mongo_client)
+
+
+async def insert_batches(collection, docs, batch_size=1000):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            await collection.insert_many(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch)
+
+
+async def seed(db, rng, companies, invoices, quotations, letters):
+    """Insert synthetic data and return the ids the workload picks from."""
+    revision = 0
+
+    def numbered(docs):
+        nonlocal revision
+        for doc in docs:
+            revision += 1
+            doc["revision"] = revision
+            yield doc
+
+    company_docs = [fixtures.make_company(rng, logo_size=rng.choice([0, 120, 400])) for _ in range(companies)]
+    company_ids = [doc["id"] for doc in company_docs]
+    await insert_batches(db.companies, numbered(company_docs))
+
+    ids = {"companies": company_ids, "invoices": [], "quotations": [], "letters": []}
+
+    def generate(factory, count, key):
+        for _ in range(count):
+            doc = factory(rng, rng.choice(company_ids))
+            ids[key].append(doc["id"])
+            yield doc
+
+    await insert_batches(db.invoices, numbered(generate(fixtures.make_invoice, invoices, "invoices")))
+    await insert_batches(db.quotations, numbered(generate(fixtures.make_quotation, quotations, "quotations")))
+    await insert_batches(db.letters, numbered(generate(
+        lambda r, company_id: fixtures.make_letter(r, company_id, paragraphs=r.randint(2, 10), signatories=r.randint(1, 3)),
+        letters, "letters",
+    )))
+    await db.counters.update_one({"_id": "revision"}, {"$set": {"seq": revision}}, upsert=True)
+    return ids
+
+
+class Workload:
+    def __init__(self, client, ids, rng):
+        self.client = client
+        self.ids = ids
+        self.rng = rng
+
+    def pick(self, key):
+        return self.rng.choice(self.ids[key])
+
+    async def list_companies(self):
+        return await self.client.get("/api/companies")
+
+    async def get_company(self):
+        return await self.client.get(f"/api/companies/{self.pick('companies')}")
+
+    async def list_invoices(self):
+        return await self.client.get("/api/invoices")
+
+    async def get_invoice(self):
+        return await self.client.get(f"/api/invoices/{self.pick('invoices')}")
+
+    def _invoice_body(self):
+        doc = fixtures.make_invoice(self.rng, self.pick("companies"))
+        for field in ("id", "created_at", "updated_at"):
+            doc.pop(field)
+        return doc
+
+    async def create_invoice(self):
+        response = await self.client.post("/api/invoices", json=self._invoice_body())
+        if response.status_code == 201:
+            self.ids["invoices"].append(response.json()["id"])
+        return response
+
+    async def update_invoice(self):
+        return await self.client.put(f"/api/invoices/{self.pick('invoices')}", json=self._invoice_body())
+
+    async def delete_invoice(self):
+        invoice_id = self.pick("invoices")
+        self.ids["invoices"].remove(invoice_id)
+        return await self.client.delete(f"/api/invoices/{invoice_id}")
+
+    async def get_letter(self):
+        return await self.client.get(f"/api/letters/{self.pick('letters')}")
+
+    async def changes(self):
+        return await self.client.get("/api/changes", params={"since": max(0, self.ids["revision"] - 200)})
+
+    async def invoice_pdf(self):
+        return await self.client.get(f"/api/invoices/{self.pick('invoices')}/pdf")
+
+    async def quotation_pdf(self):
+        return await self.client.get(f"/api/quotations/{self.pick('quotations')}/pdf")
+
+    async def letter_pdf(self):
+        return await self.client.get(f"/api/letters/{self.pick('letters')}/pdf")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    routes = {}
+    for name in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies.get(name, []))
+        routes[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else None,
+            "p50_ms": round(percentile(values, 50) * 1000, 2) if values else None,
+            "p95_ms": round(percentile(values, 95) * 1000, 2) if values else None,
+            "p99_ms": round(percentile(values, 99) * 1000, 2) if values else None,
+        }
+    everything = sorted(value for values in latencies.values() for value in values)
+    total = {
+        "count": len(everything),
+        "errors": sum(errors.values()),
+        "throughput_rps": round(len(everything) / elapsed, 2),
+        "p50_ms": round(percentile(everything, 50) * 1000, 2) if everything else None,
+        "p95_ms": round(percentile(everything, 95) * 1000, 2) if everything else None,
+        "p99_ms": round(percentile(everything, 99) * 1000, 2) if everything else None,
+    }
+    return routes, total
+
+
+async def drive(workload, mix, concurrency, requests, duration):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies, errors = {}, {}
+    remaining = [requests]
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        while True:
+            if deadline and time.perf_counter() >= deadline:
+                return
+            if not deadline:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            name = workload.rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await getattr(workload, name)()
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - start
+            if failed:
+                errors[name] = errors.get(name, 0) + 1
+            else:
+                latencies.setdefault(name, []).append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if not hasattr(Workload, name):
+            raise argparse.ArgumentTypeError(f"unknown operation: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    db_name = args.db_name or f"bench_{uuid.uuid4().hex[:8]}"
+    server, app = load_server(args.mongo_url, db_name)
+
+    async with app.router.lifespan_context(app):
+        scale = args.scale
+        seed_start = time.perf_counter()
+        ids = await seed(
+            server.db, rng,
+            companies=max(1, int(args.companies * scale)),
+            invoices=max(1, int(args.invoices * scale)),
+            quotations=max(1, int(args.quotations * scale)),
+            letters=max(1, int(args.letters * scale)),
+        )
+        seed_seconds = time.perf_counter() - seed_start
+        print(f"Seeded {', '.join(f'{len(v)} {k}' for k, v in ids.items())} in {seed_seconds:.1f}s")
+
+        ids["revision"] = (await server.db.counters.find_one({"_id": "revision"}))["seq"]
+        while not app.state.ready:  # PDF warm-up runs in the background
+            await asyncio.sleep(0.05)
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                workload = Workload(client, ids, rng)
+                latencies, errors, elapsed = await drive(workload, args.mix, args.concurrency, args.requests, args.duration)
+        finally:
+            if args.mongo_url and not args.keep_db:
+                await server.client.drop_database(db_name)
+
+    routes, total = summarize(latencies, errors, elapsed)
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "mongo": "mongod" if args.mongo_url else "in-memory",
+            "scale": scale,
+            "concurrency": args.concurrency,
+            "elapsed_s": round(elapsed, 2),
+            "seed_s": round(seed_seconds, 2),
+            "mix": args.mix,
+        },
+        "routes": routes,
+        "total": total,
+    }
+
+    print(f"\n{'operation':<16}{'count':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in routes.items():
+        print(f"{name:<16}{stats['count']:>8}{stats['errors']:>6}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms'] or '-':>10}{stats['p95_ms'] or '-':>10}{stats['p99_ms'] or '-':>10}")
+    print(f"{'total':<16}{total['count']:>8}{total['errors']:>6}{total['throughput_rps']:>9}"
+          f"{total['p50_ms'] or '-':>10}{total['p95_ms'] or '-':>10}{total['p99_ms'] or '-':>10}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+        print(f"\nWrote {args.output}")
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", help="local mongod to use; defaults to an in-memory stand-in")
+    parser.add_argument("--db-name", help="database to seed (default: a fresh bench_* database)")
+    parser.add_argument("--keep-db", action="store_true", help="do not drop the seeded mongod database")
+    parser.add_argument("--companies", type=int, default=10_000)
+    parser.add_argument("--invoices", type=int, default=100_000)
+    parser.add_argument("--quotations", type=int, default=20_000)
+    parser.add_argument("--letters", type=int, default=10_000)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply all seed counts, e.g. 0.01 for a quick run")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=5000, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, help="run for this many seconds instead of a request count")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="e.g. get_invoice=5,invoice_pdf=1")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
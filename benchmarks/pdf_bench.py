@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""PDF render micro-benchmark with regression gates.
+
+Calls the invoice, quotation and letter renderers directly with synthetic
+documents over a parameter grid (line items, paragraphs, signatories, image
+size). Every case runs in a fresh process, which gives a clean peak RSS. The
+median wall time, peak RSS and PDF size are recorded per case.
+
+    python benchmarks/pdf_bench.py --save-baseline            # store benchmarks/baselines/pdf_render.json
+    python benchmarks/pdf_bench.py --compare --threshold 0.2  # exit 1 if any case got >20% worse
+
+Baselines depend on the machine, so none is committed: save one before comparing.
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "backend"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import fixtures  # noqa: E402
+
+DEFAULT_BASELINE = ROOT / "benchmarks" / "baselines" / "pdf_render.json"
+
+GRIDS = {
+    "quick": {
+        "invoice": {"items": [1, 50, 300]},
+        "quotation": {"items": [1, 50, 300]},
+        "letter": {"paragraphs": [1, 20], "signatories": [0, 3], "image_size": [0, 800]},
+    },
+    "full": {
+        "invoice": {"items": [1, 10, 50, 100, 200, 300]},
+        "quotation": {"items": [1, 10, 50, 100, 200, 300]},
+        "letter": {"paragraphs": [1, 5, 20, 50], "signatories": [0, 1, 3, 5], "image_size": [0, 200, 800, 2000]},
+    },
+}
+# Letter parameters that are not being varied stay at these values
+LETTER_DEFAULTS = {"paragraphs": 5, "signatories": 2, "image_size": 400}
+
+
+def build_cases(grid):
+    cases = []
+    for renderer in ("invoice", "quotation"):
+        for items in grid[renderer]["items"]:
+            cases.append({"renderer": renderer, "items": items})
+    # Vary one letter parameter at a time around the defaults
+    seen = set()
+    for param, values in grid["letter"].items():
+        for value in values:
+            case = {"renderer": "letter", **LETTER_DEFAULTS, param: value}
+            key = case_key(case)
+            if key not in seen:
+                seen.add(key)
+                cases.append(case)
+    return cases
+
+
+def case_key(case):
+    return ",".join(f"{name}={case[name]}" for name in sorted(case))
+
+
+def make_documents(case):
+    rng = random.Random(42)
+    if case["renderer"] == "letter":
+        company = fixtures.make_company(rng, logo_size=case["image_size"])
+        letter = fixtures.make_letter(rng, company["id"], paragraphs=case["paragraphs"],
+                                      signatories=case["signatories"], signature_size=case["image_size"])
+        return letter, company
+    company = fixtures.make_company(rng)
+    factory = fixtures.make_invoice if case["renderer"] == "invoice" else fixtures.make_quotation
+    return factory(rng, company["id"], items=case["items"]), company
+
+
+def run_case(case, repeats):
+    from pdf_render import RENDERERS
+    render = RENDERERS[case["renderer"]]
+    document, company = make_documents(case)
+    output = render(document, company)  # warm-up: fonts, styles, codecs
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = render(document, company)
+        times.append(time.perf_counter() - start)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        **case,
+        "key": case_key(case),
+        "median_ms": round(statistics.median(times) * 1000, 2),
+        "min_ms": round(min(times) * 1000, 2),
+        "max_ms": round(max(times) * 1000, 2),
+        "peak_rss_kb": rss_after,
+        "rss_growth_kb": rss_after - rss_before,
+        "bytes": len(output),
+    }
+
+
+def run(cases, repeats, isolate):
+    results = []
+    for case in cases:
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(run_case, case, repeats).result()
+        else:
+            result = run_case(case, repeats)
+        print(f"{result['key']:<60}{result['median_ms']:>10} ms{result['peak_rss_kb'] / 1024:>9.1f} MB{result['bytes']:>10} B")
+        results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return (case, metric, old, new) for every metric that grew beyond the threshold."""
+    previous = {case["key"]: case for case in baseline["cases"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result["key"])
+        if not old:
+            continue
+        for metric in ("median_ms", "peak_rss_kb", "bytes"):
+            if old[metric] and result[metric] > old[metric] * (1 + threshold):
+                regressions.append((result["key"], metric, old[metric], result[metric]))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid", choices=sorted(GRIDS), default="quick")
+    parser.add_argument("--renderer", choices=["invoice", "quotation", "letter"], action="append",
+                        help="only benchmark these renderers (repeatable)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-isolate", action="store_true", help="run every case in this process (faster, RSS less meaningful)")
+    parser.add_argument("--output", help="write the JSON results here")
+    parser.add_argument("--save-baseline", nargs="?", const=str(DEFAULT_BASELINE), help="store results as the baseline")
+    parser.add_argument("--compare", nargs="?", const=str(DEFAULT_BASELINE), help="compare against a stored baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative growth before a case is a regression")
+    args = parser.parse_args(argv)
+    if args.compare and not Path(args.compare).is_file():
+        print(f"No baseline at {args.compare}; run with --save-baseline first (on the same machine)", file=sys.stderr)
+        return 2
+
+    cases = [case for case in build_cases(GRIDS[args.grid]) if not args.renderer or case["renderer"] in args.renderer]
+    results = run(cases, args.repeats, isolate=not args.no_isolate)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "grid": args.grid,
+            "repeats": args.repeats,
+        },
+        "cases": results,
+    }
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(report, indent=2))
+        print(f"Wrote {path}")
+
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.threshold)
+        for key, metric, old, new in regressions:
+            print(f"REGRESSION {key}: {metric} {old} -> {new} ({(new / old - 1) * 100:+.0f}%)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""API cold-start report.
+
+Imports backend/server.py in fresh interpreters under `-X importtime` and
+prints the slowest modules by cumulative import time, plus wall-clock time to
+import the module and to build the app. It also lists which heavy packages
+(ReportLab, PIL, Motor) got imported, since those should only load on first use.
+
+    python benchmarks/startup.py                  # median of 5 cold imports
+    python benchmarks/startup.py --top 30 --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / "backend"
+
+# Packages the API process should not import until a request needs them
+DEFERRED = ("reportlab", "PIL", "motor")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+server.create_app()
+built = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (built - imported) * 1000,
+    "loaded": sorted({name.split(".")[0] for name in sys.modules} & set(sys.argv[1:])),
+}))
+"""
+
+
+def probe_env():
+    env = dict(os.environ)
+    # Settings the module needs once the app is built; nothing is contacted
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "startup_probe")
+    return env
+
+
+def run_probe(importtime: bool):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE, *DEFERRED]
+    result = subprocess.run(command, cwd=BACKEND, env=probe_env(), capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def parse_importtime(stderr):
+    """Return {module: (self_us, cumulative_us)} from `-X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5, help="cold imports to take the median of")
+    parser.add_argument("--top", type=int, default=20, help="modules to list")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    timings = [run_probe(importtime=False)[0] for _ in range(args.repeats)]
+    sample, stderr = run_probe(importtime=True)
+    modules = parse_importtime(stderr)
+    slowest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "repeats": args.repeats,
+        },
+        "import_ms": round(statistics.median(t["import_ms"] for t in timings), 1),
+        "create_app_ms": round(statistics.median(t["create_app_ms"] for t in timings), 1),
+        "modules_imported": len(modules),
+        "deferred_loaded": sample["loaded"],
+        "slowest": [{"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+                    for name, (self_us, cumulative_us) in slowest],
+    }
+
+    print(f"import server   {report['import_ms']:>8} ms (median of {args.repeats})")
+    print(f"create_app()    {report['create_app_ms']:>8} ms")
+    print(f"modules         {report['modules_imported']:>8}")
+    print(f"deferred loaded {', '.join(report['deferred_loaded']) or 'none':>8}\n")
+    print(f"{'module':<50}{'self ms':>10}{'cumul ms':>10}")
+    for entry in report["slowest"]:
+        print(f"{entry['module']:<50}{entry['self_ms']:>10.1f}{entry['cumulative_ms']:>10.1f}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\nWrote {args.output}")
+    return 1 if report["deferred_loaded"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
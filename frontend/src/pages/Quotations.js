@@ -111,6 +111,7 @@ const Quotations = () => {
       sent: { variant: "default", label: "Sent" },
       accepted: { variant: "success", label: "Accepted" },
       rejected: { variant: "destructive", label: "Rejected" },
+      converted: { variant: "success", label: "Converted" },
     };
     const config = statusConfig[status] || statusConfig.draft;
     return <Badge variant={config.variant}>{config.label}</Badge>;
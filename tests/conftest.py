@@ -0,0 +1,83 @@
+import base64
+import io
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server.py builds its app at import time from the environment
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("WARMUP_ON_STARTUP", "0")
+
+ADMIN_TOKEN = "test-admin-token"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def api(monkeypatch, tmp_path):
+    """HTTP client for a freshly built app on an in-memory MongoDB; the database
+    is `server.db` while the test runs."""
+    from mongomock_motor import AsyncMongoMockClient
+    import server
+    monkeypatch.setenv("ADMIN_TOKEN", ADMIN_TOKEN)
+    monkeypatch.setenv("PDF_CACHE_DIR", str(tmp_path / "pdf-cache"))
+    app = server.create_app(mongo_client=AsyncMongoMockClient())
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            yield client
+
+
+def png_data_uri(width: int, height: int) -> str:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "navy").save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+@pytest.fixture
+def make_company():
+    """Factory for company documents, with a logo; fields override the defaults."""
+    def make(**fields) -> dict:
+        return {
+            "id": str(uuid.uuid4()), "revision": 1, "name": "PT Contoh", "address": "Jl. Merdeka 1, Jakarta",
+            "phone": "021-555", "email": "info@contoh.co.id", "website": "www.contoh.co.id", "motto": "Selalu tepat",
+            "logo": png_data_uri(120, 120), **fields,
+        }
+    return make
+
+
+@pytest.fixture
+def make_letter():
+    """Factory for a letter of `company` numbered `number`."""
+    def make(company: dict, number: int) -> dict:
+        return {
+            "id": str(uuid.uuid4()), "letter_number": f"L-{number}", "company_id": company["id"], "date": "2024-05-01",
+            "subject": "Penawaran", "letter_type": "general", "recipient_name": "Budi",
+            "content": "Dengan hormat,\n" + "isi surat " * 80, "signatories": [],
+        }
+    return make
+
+
+@pytest.fixture
+def make_invoice():
+    """Factory for a five-line invoice of `company` numbered `number`."""
+    def make(company: dict, number: int) -> dict:
+        items = [{"name": f"Item {n}", "description": "Jasa", "quantity": 2, "unit": "pcs", "unit_price": 1000, "total": 2000}
+                 for n in range(5)]
+        return {
+            "id": str(uuid.uuid4()), "invoice_number": f"INV-{number}", "company_id": company["id"], "date": "2024-05-01",
+            "due_date": "2024-05-31", "client_name": "Client", "items": items, "subtotal": 10000, "total": 10000,
+            "currency": "IDR",
+        }
+    return make
@@ -0,0 +1,65 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from admission import DEFAULTS, AdmissionMiddleware, classify
+
+pytestmark = pytest.mark.anyio
+
+
+def make_app(**limits) -> tuple:
+    app = FastAPI()
+    release = asyncio.Event()
+
+    @app.get("/api/invoices/{invoice_id}/pdf")
+    async def pdf(invoice_id: str):
+        await release.wait()
+        return {"id": invoice_id}
+
+    @app.get("/api/items")
+    async def items():
+        return []
+
+    settings = {name: dict(config) for name, config in DEFAULTS.items()}
+    for name, config in limits.items():
+        settings[name].update(config)
+    app.add_middleware(AdmissionMiddleware, limits=settings, queue_timeout=0.05)
+    return app, release
+
+
+def test_routes_are_classified():
+    assert classify("/api/invoices/abc/pdf") == "pdf"
+    assert classify("/api/pdf/merge") == "pdf"
+    assert classify("/api/letters/mail-merge") == "pdf"
+    assert classify("/api/letters/mail-merge/csv") == "pdf"
+    assert classify("/api/export/invoices") == "export"
+    assert classify("/api/items") == "crud"
+    assert classify("/api/health") is None
+    assert classify("/metrics") is None
+
+
+async def test_a_full_class_turns_requests_away_without_blocking_others():
+    app, release = make_app(pdf={"concurrency": 1, "queue": 1})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        first = asyncio.ensure_future(client.get("/api/invoices/a/pdf"))
+        await asyncio.sleep(0.01)
+        # Waits in the queue, then gives up after queue_timeout
+        queued = asyncio.ensure_future(client.get("/api/invoices/b/pdf"))
+        await asyncio.sleep(0.01)
+        rejected = await client.get("/api/invoices/c/pdf")
+        assert rejected.status_code == 503 and rejected.headers["retry-after"] == "1"
+        assert (await client.get("/api/items")).status_code == 200
+        assert (await queued).status_code == 503
+        release.set()
+        assert (await first).status_code == 200
+
+
+async def test_clients_over_their_rate_get_429():
+    app, release = make_app(crud={"rate": 0.5, "burst": 2})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        statuses = [(await client.get("/api/items")).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+        response = await client.get("/api/items")
+        assert int(response.headers["retry-after"]) >= 1
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from archive import ensure_archive_collections, restore_document, run_archive
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_archive_collections_fall_back_without_storage_options():
+    """Servers (and stand-ins) that reject WiredTiger options still get the archive."""
+    db = AsyncMongoMockClient()["test_archive"]
+    await ensure_archive_collections(db, "zstd")
+    names = await db.list_collection_names()
+    for name in ("invoices_archive", "quotations_archive", "letters_archive", "companies_archive", "items_archive"):
+        assert name in names
+        indexes = await db[name].index_information()
+        assert any(index.get("unique") and index["key"] == [("id", 1)] for index in indexes.values())
+    # Running again, as every worker does at startup, is harmless
+    await ensure_archive_collections(db, "zstd")
+
+
+async def test_app_starts_with_default_compressor(api, monkeypatch):
+    assert server.ARCHIVE_COMPRESSOR == "zstd"
+    response = await api.get("/api/health")
+    assert response.status_code == 200
+
+
+def days_ago(days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+
+
+async def test_deleted_items_are_hidden_until_restored(api):
+    item = (await api.post("/api/items", json={"name": "Kertas", "unit_price": 1000})).json()
+    assert (await api.delete(f"/api/items/{item['id']}")).status_code == 200
+    assert [listed["id"] for listed in (await api.get("/api/items")).json()] == []
+    assert (await api.get(f"/api/items/{item['id']}")).status_code == 404
+
+    response = await api.post(f"/api/items/{item['id']}/restore")
+    assert response.status_code == 200
+    restored = response.json()
+    assert "deleted_at" not in restored and restored["revision"] > item["revision"]
+    assert [listed["id"] for listed in (await api.get("/api/items")).json()] == [item["id"]]
+    # Only deleted documents can be restored
+    assert (await api.post(f"/api/items/{item['id']}/restore")).status_code == 404
+
+
+async def test_archive_moves_closed_and_long_deleted_documents():
+    db = AsyncMongoMockClient()["test_archive"]
+    await ensure_archive_collections(db, "")
+    await db.invoices.insert_many([
+        {"id": "paid-old", "date": days_ago(1000)[:10], "status": "paid", "revision": 1},
+        {"id": "sent-old", "date": days_ago(1000)[:10], "status": "sent", "revision": 2},
+        {"id": "paid-new", "date": days_ago(10)[:10], "status": "paid", "revision": 3},
+        {"id": "deleted-old", "date": days_ago(10)[:10], "status": "draft", "revision": 4, "deleted_at": days_ago(60)},
+        {"id": "deleted-new", "date": days_ago(10)[:10], "status": "draft", "revision": 5, "deleted_at": days_ago(1)},
+    ])
+    assert (await run_archive(db, 730, 30, dry_run=True))["invoices"] == 2
+    assert await db.invoices.count_documents({}) == 5
+
+    counts = await run_archive(db, 730, 30)
+    assert counts["invoices"] == 2
+    assert sorted(await db.invoices.distinct("id")) == ["deleted-new", "paid-new", "sent-old"]
+    archived = await db.invoices_archive.find({}, {"_id": 0}).sort("id", 1).to_list(None)
+    assert [document["id"] for document in archived] == ["deleted-old", "paid-old"]
+    assert all("archived_at" in document for document in archived)
+
+    # Restoring brings an archived document back without its archive fields
+    restored = await restore_document(db, "invoices", "deleted-old", {"revision": 9, "updated_at": days_ago(0)})
+    assert restored["revision"] == 9 and "deleted_at" not in restored and "archived_at" not in restored
+    assert await db.invoices_archive.count_documents({"id": "deleted-old"}) == 0
+    assert (await db.invoices.find_one({"id": "deleted-old"}, {"_id": 0})) == restored
+
+
+async def test_deleted_companies_and_items_are_archived_once_unreferenced():
+    db = AsyncMongoMockClient()["test_archive"]
+    await ensure_archive_collections(db, "")
+    await db.companies.insert_many([
+        {"id": "unused", "date": days_ago(1000)[:10], "deleted_at": days_ago(60)},
+        {"id": "in-use", "deleted_at": days_ago(60)},
+        {"id": "archived-use", "deleted_at": days_ago(60)},
+        {"id": "live", "date": days_ago(1000)[:10]},
+    ])
+    await db.items.insert_many([{"id": "old", "deleted_at": days_ago(60)}, {"id": "kept", "date": days_ago(1000)[:10]}])
+    await db.letters.insert_one({"id": "letter", "company_id": "in-use", "date": days_ago(10)[:10]})
+    await db.invoices_archive.insert_one({"id": "invoice", "company_id": "archived-use", "archived_at": days_ago(5)})
+
+    counts = await run_archive(db, 730, 30)
+    assert counts["companies"] == 1 and counts["items"] == 1
+    assert sorted(await db.companies.distinct("id")) == ["archived-use", "in-use", "live"]
+    assert await db.companies_archive.distinct("id") == ["unused"]
+    assert await db.items.distinct("id") == ["kept"]
+
+
+async def test_restored_documents_are_not_archived_again_until_they_age():
+    db = AsyncMongoMockClient()["test_archive"]
+    await ensure_archive_collections(db, "")
+    await db.letters.insert_one({"id": "letter", "date": days_ago(1000)[:10], "updated_at": days_ago(900), "revision": 1})
+    assert (await run_archive(db, 730, 30))["letters"] == 1
+    await restore_document(db, "letters", "letter", {"revision": 2, "updated_at": days_ago(0)})
+    assert (await run_archive(db, 730, 30))["letters"] == 0
+    assert await db.letters.count_documents({"id": "letter"}) == 1
@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_item(api, name: str) -> dict:
+    response = await api.post("/api/items", json={"name": name, "unit_price": 1000})
+    assert response.status_code == 201
+    return response.json()
+
+
+async def test_next_waits_for_revisions_still_being_written(api):
+    first = await create_item(api, "Kertas")
+    # A write that has taken its revision but not committed yet
+    in_flight = await server.change_stamp()
+    later = await create_item(api, "Tinta")
+
+    response = await api.get("/api/changes", params={"since": first["revision"]})
+    body = response.json()
+    assert [change["id"] for change in body["changes"]] == [later["id"]]
+    assert body["next"] < in_flight["revision"]
+
+    await server.db.items.insert_one({"id": "in-flight", "name": "Map", "unit_price": 500, **in_flight})
+    body = (await api.get("/api/changes", params={"since": body["next"]})).json()
+    assert [change["id"] for change in body["changes"]] == ["in-flight", later["id"]]
+
+
+async def test_next_moves_past_settled_changes(api, monkeypatch):
+    await create_item(api, "Kertas")
+    await server.change_stamp()  # never written
+    later = await create_item(api, "Tinta")
+    await api.delete(f"/api/items/{later['id']}")
+
+    monkeypatch.setattr(server, "CHANGES_SETTLE_MS", 0)
+    body = (await api.get("/api/changes")).json()
+    assert body["next"] == body["changes"][-1]["revision"]
+    assert body["changes"][-1]["op"] == "delete"
+    assert (await api.get("/api/changes", params={"since": body["next"]})).json()["changes"] == []
+
+
+def test_settled_revision_stops_before_recent_stamps(monkeypatch):
+    monkeypatch.setattr(server, "CHANGES_SETTLE_MS", 5000)
+    now = datetime(2024, 5, 1, 12, 0, 0, tzinfo=timezone.utc)
+    changes = [
+        {"op": "upsert", "revision": 3, "document": {}},  # numbered before stamps existed
+        {"op": "upsert", "revision": 4, "document": {"updated_at": "2024-05-01T11:59:50+00:00"}},
+        {"op": "delete", "revision": 6, "deleted_at": "2024-05-01T11:59:54"},
+        {"op": "upsert", "revision": 7, "document": {"updated_at": "2024-05-01T11:59:58+00:00"}},
+    ]
+    assert server.settled_revision(changes, 2, now) == 6
+    assert server.settled_revision(changes[3:], 6, now) == 6
+    assert server.settled_revision([], 9, now) == 9
@@ -0,0 +1,87 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+
+import compression
+import server
+from compression import CompressionMiddleware
+
+pytestmark = pytest.mark.anyio
+
+
+def make_client(**options) -> httpx.AsyncClient:
+    app = FastAPI()
+
+    @app.get("/items")
+    async def items(count: int):
+        return [{"id": n, "name": f"Item {n}", "unit": "pcs"} for n in range(count)]
+
+    @app.get("/export")
+    async def export():
+        return StreamingResponse((f"{n},Item {n}\n" * 2000 for n in range(3)), media_type="text/csv")
+
+    @app.get("/document")
+    async def document():
+        return Response(b"%PDF-1.4\n" + b"0" * 50000, media_type="application/pdf")
+
+    app.add_middleware(CompressionMiddleware, **options)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def test_small_json_is_sent_as_is():
+    async with make_client() as client:
+        response = await client.get("/items", params={"count": 10}, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert len(response.json()) == 10
+
+
+async def test_large_json_is_compressed():
+    async with make_client() as client:
+        response = await client.get("/items", params={"count": 5000}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < len(response.content) / 4
+    assert len(response.json()) == 5000
+
+
+async def test_large_chunks_can_be_compressed_in_the_thread_pool(monkeypatch):
+    offloaded = []
+
+    async def run_in_threadpool(function, data):
+        offloaded.append(len(data))
+        return function(data)
+
+    monkeypatch.setattr(compression, "run_in_threadpool", run_in_threadpool)
+    async with make_client() as client:
+        await client.get("/items", params={"count": 5000}, headers={"Accept-Encoding": "gzip"})
+    assert offloaded == []
+
+    async with make_client(thread_threshold=16 * 1024) as client:
+        response = await client.get("/items", params={"count": 5000}, headers={"Accept-Encoding": "gzip"})
+        assert len(response.json()) == 5000 and len(offloaded) == 1
+        streamed = await client.get("/export", headers={"Accept-Encoding": "gzip"})
+    assert streamed.headers["content-encoding"] == "gzip"
+    assert streamed.text.count("\n") == 6000
+    # Streamed chunks are offloaded one by one, the closing empty chunk is not
+    assert len(offloaded) == 4 and offloaded[-3:] == [len("0,Item 0\n" * 2000)] * 3
+
+
+async def test_pdfs_are_sent_as_they_are():
+    async with make_client() as client:
+        response = await client.get("/document", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-length"] == str(len(response.content))
+
+
+async def test_mail_merge_pdfs_are_not_compressed(api, make_company):
+    company = make_company()
+    await server.db.companies.insert_one(dict(company))
+    letter = {"letter_number": "L-{{index}}", "company_id": company["id"], "date": "2024-05-01", "subject": "Undangan",
+              "recipient_name": "Bapak/Ibu", "content": "Dengan hormat " * 200}
+    recipients = [{"recipient_name": f"Penerima {n}"} for n in range(20)]
+    response = await api.post("/api/letters/mail-merge", json={"letter": letter, "recipients": recipients},
+                              headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200 and response.headers["content-type"] == "application/pdf"
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-length"] == str(len(response.content))
+    assert response.content.startswith(b"%PDF")
@@ -0,0 +1,129 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from diagnostics import RenderProfiler, SlowCommandListener, SlowLog, query_shape
+from tests.conftest import ADMIN_TOKEN
+
+pytestmark = pytest.mark.anyio
+
+
+class ExplainingDb:
+    def __init__(self):
+        self.explained = []
+        self.release = asyncio.Event()
+
+    async def command(self, command):
+        self.explained.append(command["explain"])
+        await self.release.wait()
+        return {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}, "executionStats": {"totalDocsExamined": 1000, "nReturned": 1}}
+
+
+def run_command(listener, request_id: int, name: str, command: dict):
+    listener.started(SimpleNamespace(command_name=name, request_id=request_id, command={name: "invoices", **command}, database_name="app"))
+    listener.succeeded(SimpleNamespace(command_name=name, request_id=request_id, duration_micros=900_000, reply={"n": 1}))
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_query_shape_drops_values():
+    assert query_shape({"id": {"$in": ["a", "b"]}, "$or": [{"status": "paid"}, {"total": {"$gt": 5}}]}) == {
+        "id": {"$in": ["?"]}, "$or": [{"status": "?"}, {"total": {"$gt": "?"}}],
+    }
+
+
+async def test_slow_commands_are_logged_by_shape_and_explained_once():
+    slow_log = SlowLog(query_ms=500)
+    db = ExplainingDb()
+    listener = SlowCommandListener(slow_log, max_explains=2)
+    listener.attach(db, asyncio.get_running_loop())
+
+    updates = [{"q": {"id": f"invoice-{n}"}, "u": {"$set": {"logo": "data:image/png;base64,AAAA", "client_name": "Budi"}}} for n in range(50)]
+    run_command(listener, 1, "update", {"updates": updates})
+    run_command(listener, 2, "update", {"updates": updates[1:]})
+    await settle()
+    # The second update has the same shape as the one being explained
+    assert len(db.explained) == 1 and len(db.explained[0]["updates"]) == 1
+    db.release.set()
+    await settle()
+    run_command(listener, 3, "update", {"updates": updates[2:]})
+    await settle()
+    assert len(db.explained) == 1
+
+    events = slow_log.recent()
+    assert [event.get("explain") for event in events] == ["cached", None, "skipped"]
+    assert all(event["filter"] == {"id": "?"} for event in events)
+    assert events[0]["plan"] == "COLLSCAN" and events[0]["docs_examined"] == 1000
+    assert "Budi" not in str(events) and "base64" not in str(events)
+
+
+async def test_explains_in_flight_are_capped():
+    slow_log = SlowLog(query_ms=500)
+    db = ExplainingDb()
+    listener = SlowCommandListener(slow_log, max_explains=2)
+    listener.attach(db, asyncio.get_running_loop())
+    for n, field in enumerate(["client_name", "status", "date"]):
+        run_command(listener, n, "find", {"filter": {field: "x"}})
+    await settle()
+    assert len(db.explained) == 2
+    assert [event.get("explain") for event in slow_log.recent()] == ["skipped"]
+    db.release.set()
+    await settle()
+    assert len(slow_log.recent()) == 3
+
+
+async def test_profile_sort_key_is_validated(api):
+    profile = server.render_profiler.begin(force=True)
+    sorted(range(1000))
+    server.render_profiler.end("letter", profile)
+    headers = {"X-Admin-Token": ADMIN_TOKEN}
+    response = await api.get("/api/debug/profile", params={"sort": "tottime"}, headers=headers)
+    assert response.status_code == 200 and response.text.startswith("1 renders")
+    response = await api.get("/api/debug/profile", params={"sort": "bogus"}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_one_render_is_profiled_at_a_time():
+    profiler = RenderProfiler()
+    first = profiler.begin(force=True)
+    assert profiler.begin(force=True) is None
+    profiler.end("letter", first)
+    failed = profiler.begin(force=True)
+    assert failed is not None
+    profiler.discard(failed)
+    second = profiler.begin(force=True)
+    sorted(range(1000))
+    profiler.end("letter", second)
+    assert profiler.renders == {"letter": 2}
+
+
+def test_formatting_leaves_the_aggregate_alone():
+    profiler = RenderProfiler()
+    profile = profiler.begin(force=True)
+    sorted(range(1000))
+    profiler.end("letter", profile)
+    aggregate = profiler.aggregates["letter"]
+    stream, order = aggregate.stream, list(aggregate.fcn_list or [])
+    assert "sorted" in profiler.format(aggregate, "tottime", 5)
+    assert aggregate.stream is stream and list(aggregate.fcn_list or []) == order
+
+
+async def test_a_profiled_render_waits_its_turn(api, make_company, make_letter):
+    company = make_company()
+    letter = make_letter(company, 1)
+    await server.db.companies.insert_one(dict(company))
+    await server.db.letters.insert_one(dict(letter))
+    url, headers = f"/api/letters/{letter['id']}/pdf", {"X-Admin-Token": ADMIN_TOKEN}
+    busy = server.render_profiler.begin(force=True)
+    try:
+        response = await api.get(url, params={"profile": "true"}, headers=headers)
+        assert response.status_code == 503 and response.headers["retry-after"] == "1"
+    finally:
+        server.render_profiler.discard(busy)
+    response = await api.get(url, params={"profile": "true"}, headers=headers)
+    assert response.status_code == 200 and "function calls" in response.text
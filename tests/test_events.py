@@ -0,0 +1,45 @@
+import pytest
+
+import server
+from events import RESYNC, ChangeBroker, event_stream
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_subscribers_get_the_collections_they_asked_for():
+    broker = ChangeBroker()
+    invoices = broker.subscribe(["invoices"])
+    everything = broker.subscribe()
+    broker.publish("invoices", "create", "a", 1)
+    broker.publish("letters", "update", "b", 2)
+    assert invoices.queue.qsize() == 1 and everything.queue.qsize() == 2
+    assert invoices.queue.get_nowait() == {"collection": "invoices", "op": "create", "id": "a", "revision": 1}
+
+
+async def test_a_client_that_falls_behind_is_told_to_resync():
+    broker = ChangeBroker(queue_size=2)
+    subscription = broker.subscribe()
+    for revision in range(5):
+        broker.publish("items", "update", "a", revision)
+    assert subscription.queue.qsize() == 1 and subscription.queue.get_nowait() is RESYNC
+
+    broker.publish("items", "update", "a", 6)
+    stream = event_stream(broker, subscription, is_disconnected=None)
+    assert await stream.__anext__() == "retry: 3000\n\n"
+    subscription.queue.put_nowait(RESYNC)
+    assert await stream.__anext__() == "event: resync\ndata: {}\n\n"
+    # Events resume once the resync has been sent
+    broker.publish("items", "update", "a", 7)
+    assert await stream.__anext__() == 'id: 7\nevent: change\ndata: {"collection":"items","op":"update","id":"a","revision":7}\n\n'
+    await stream.aclose()
+    assert subscription not in broker.subscribers
+
+
+async def test_writes_are_published(api):
+    subscription = server.change_broker.subscribe(["items"])
+    response = await api.post("/api/items", json={"name": "Kertas", "unit_price": 1000})
+    item = response.json()
+    await api.delete(f"/api/items/{item['id']}")
+    events = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+    assert [(event["op"], event["id"]) for event in events] == [("create", item["id"]), ("delete", item["id"])]
+    assert events[0]["revision"] < events[1]["revision"]
@@ -0,0 +1,47 @@
+import csv
+import io
+import zipfile
+
+from openpyxl import load_workbook
+
+from export import columns, csv_bytes, write_export
+
+INJECTIONS = ['=HYPERLINK("http://evil.example","click")', "+1+2", "-2+3", "@SUM(A1)", "\t=1", "\r=1"]
+
+
+def invoice(client_name: str, number: int) -> dict:
+    return {"id": f"id-{number}", "invoice_number": f"INV-{number}", "date": "2024-01-01", "status": "sent",
+            "client_name": client_name, "subtotal": -5, "total": 1000}
+
+
+def test_csv_neutralises_formulas():
+    rows = list(csv.reader(io.StringIO(csv_bytes([[value, -5, "plain"] for value in INJECTIONS]).decode())))
+    assert [row[0] for row in rows] == [f"'{value}" for value in INJECTIONS]
+    # Numbers and ordinary text are left alone
+    assert all(row[1:] == ["-5", "plain"] for row in rows)
+
+
+def test_csv_export_neutralises_client_names():
+    output = io.BytesIO()
+    write_export([invoice(value, n) for n, value in enumerate(INJECTIONS)], "invoices", "documents", "csv", output)
+    rows = list(csv.reader(io.StringIO(output.getvalue().decode("utf-8-sig"))))
+    client = rows[0].index("client_name")
+    assert [row[client] for row in rows[1:]] == [f"'{value}" for value in INJECTIONS]
+
+
+def test_xlsx_stores_formula_like_text_as_text():
+    output = io.BytesIO()
+    write_export([invoice(value, n) for n, value in enumerate(INJECTIONS)], "invoices", "documents", "xlsx", output)
+
+    with zipfile.ZipFile(io.BytesIO(output.getvalue())) as archive:
+        sheet = next(name for name in archive.namelist() if name.startswith("xl/worksheets/"))
+        assert b"<f>" not in archive.read(sheet)
+
+    sheet = load_workbook(io.BytesIO(output.getvalue())).active
+    client = columns("invoices", "documents").index("client_name") + 1
+    cells = [sheet.cell(row=row, column=client) for row in range(2, len(INJECTIONS) + 2)]
+    # XML reads a lone carriage return back as a newline
+    assert [cell.value for cell in cells] == [value.replace("\r", "\n") for value in INJECTIONS]
+    assert all(cell.data_type == "s" for cell in cells)
+    # Numbers keep their type
+    assert sheet.cell(row=2, column=columns("invoices", "documents").index("total") + 1).value == 1000
@@ -0,0 +1,53 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from history import apply_patch, diff, list_revisions, load_version, record_versions
+
+pytestmark = pytest.mark.anyio
+
+
+def test_patches_turn_the_old_version_into_the_new_one():
+    old = {"a/b": 1, "items": [{"qty": 1}, {"qty": 2}, {"qty": 3}], "gone": True, "total": 1}
+    new = {"a/b": 2, "items": [{"qty": 1}, {"qty": 5}], "added": {"x": []}, "total": 1.0}
+    patch = diff(old, new)
+    assert {"op": "replace", "path": "/a~1b", "value": 2} in patch
+    # 1 and 1.0 are different values in the database
+    assert {"op": "replace", "path": "/total", "value": 1.0} in patch
+    assert apply_patch(old, patch) == new and old["items"][2] == {"qty": 3}
+    assert diff(new, new) == []
+
+
+async def test_versions_are_rebuilt_across_snapshots():
+    db = AsyncMongoMockClient()["history"]
+    versions = [{"id": "a", "revision": revision, "subject": f"v{revision}", "items": list(range(revision))}
+                for revision in range(1, 7)]
+    for previous, current in zip(versions, versions[1:]):
+        await record_versions(db, "letters", [(previous, current)], snapshot_every=3)
+
+    for version in versions:
+        assert await load_version(db, "letters", "a", version["revision"]) == version
+    assert await load_version(db, "letters", "a", 99) is None
+    kinds = {record["revision"]: record["kind"] for record in await list_revisions(db, "letters", "a", 100)}
+    assert kinds == {1: "snapshot", 2: "patch", 3: "patch", 4: "snapshot", 5: "patch", 6: "patch"}
+
+
+async def test_updates_are_kept_as_revisions(api):
+    letter = {"letter_number": "L-1", "company_id": "c", "date": "2024-05-01", "subject": "Penawaran",
+              "recipient_name": "Budi", "content": "Dengan hormat"}
+    created = (await api.post("/api/letters", json=letter)).json()
+    # Before any update the live document is its only version
+    revisions = (await api.get(f"/api/letters/{created['id']}/revisions")).json()["revisions"]
+    assert [(record["revision"], record["kind"]) for record in revisions] == [(created["revision"], "live")]
+    current = (await api.get(f"/api/letters/{created['id']}/revisions/{created['revision']}")).json()
+    assert current["subject"] == "Penawaran" and current["revision"] == created["revision"]
+
+    updated = (await api.put(f"/api/letters/{created['id']}", json={**letter, "subject": "Penawaran harga"})).json()
+
+    revisions = (await api.get(f"/api/letters/{created['id']}/revisions")).json()["revisions"]
+    assert [record["revision"] for record in revisions] == [updated["revision"], created["revision"]]
+    assert {"op": "replace", "path": "/subject", "value": "Penawaran harga"} in revisions[0]["patch"]
+    old = (await api.get(f"/api/letters/{created['id']}/revisions/{created['revision']}")).json()
+    assert old["subject"] == "Penawaran" and old["revision"] == created["revision"]
+    assert (await api.get(f"/api/letters/{created['id']}/revisions/0")).status_code == 404
+    assert (await api.get(f"/api/companies/{created['id']}/revisions")).status_code == 404
+
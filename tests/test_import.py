@@ -0,0 +1,41 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def import_csv(api, collection: str, text: str) -> dict:
+    response = await api.post(f"/api/import/{collection}", files={"file": ("import.csv", text.encode(), "text/csv")})
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_import_keeps_fields_missing_from_the_file(api):
+    response = await api.post("/api/companies", json={
+        "name": "PT Contoh", "phone": "021-555", "bank_name": "BCA", "logo": "data:image/png;base64,AAAA",
+    })
+    assert response.status_code == 201
+    company = response.json()
+
+    report = await import_csv(api, "companies", "name,phone,address\nPT Contoh,021-777,\nPT Baru,021-888,Jl. Baru 2\n")
+    assert (report["created"], report["updated"]) == (1, 1)
+
+    updated = await server.db.companies.find_one({"id": company["id"]}, {"_id": 0})
+    assert updated["phone"] == "021-777"
+    # Not in the file, or an empty cell: left alone
+    assert updated["bank_name"] == "BCA"
+    assert updated["logo"] == "data:image/png;base64,AAAA"
+    assert updated["address"] == ""
+    assert updated["revision"] > company["revision"]
+
+    created = await server.db.companies.find_one({"name": "PT Baru"}, {"_id": 0})
+    assert created["address"] == "Jl. Baru 2"
+    assert created["bank_name"] == "" and created["logo"] is None
+
+
+async def test_import_creates_items_with_defaults(api):
+    report = await import_csv(api, "items", "name,unit_price\nKertas,1000\n")
+    assert report["created"] == 1
+    item = await server.db.items.find_one({"name": "Kertas"}, {"_id": 0})
+    assert item["unit_price"] == 1000 and item["unit"] == "pcs" and item["description"] == ""
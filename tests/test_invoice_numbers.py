@@ -0,0 +1,106 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+YEAR = datetime.now(timezone.utc).year
+ITEMS = [{"name": "Jasa", "quantity": 1, "unit_price": 1000, "total": 1000}]
+
+
+async def create_quotations(api, count: int) -> list:
+    ids = []
+    for n in range(count):
+        response = await api.post("/api/quotations", json={
+            "quotation_number": f"QUO-{n}", "company_id": "company", "client_name": "Client", "date": "2024-05-01",
+            "items": ITEMS, "subtotal": 1000, "total": 1000,
+        })
+        assert response.status_code == 201
+        ids.append(response.json()["id"])
+    return ids
+
+
+async def create_invoice(api, number: str):
+    return await api.post("/api/invoices", json={
+        "invoice_number": number, "company_id": "company", "client_name": "Client", "date": "2024-05-01",
+        "items": ITEMS, "subtotal": 1000, "total": 1000,
+    })
+
+
+async def convert(api, quotation_ids: list) -> list:
+    response = await api.post("/api/quotations/convert", json={"quotation_ids": quotation_ids})
+    assert response.status_code == 200
+    return [converted["invoice_number"] for converted in response.json()["converted"]]
+
+
+async def test_numbers_are_counted_per_year(api):
+    assert await convert(api, await create_quotations(api, 3)) == [f"INV-{YEAR}-{seq:05d}" for seq in (1, 2, 3)]
+    counter = await server.db.counters.find_one({"_id": f"invoice_number:{YEAR}"})
+    assert counter["seq"] == 3
+
+
+async def test_numbers_taken_by_hand_are_skipped(api):
+    assert (await create_invoice(api, f"INV-{YEAR}-00002")).status_code == 201
+    assert await convert(api, await create_quotations(api, 2)) == [f"INV-{YEAR}-00001", f"INV-{YEAR}-00003"]
+
+
+async def test_numbers_taken_during_a_conversion_are_replaced(api, monkeypatch):
+    reserve = server.next_invoice_numbers
+
+    async def racing(count):
+        numbers = await reserve(count)
+        if count > 1:
+            # Someone types the same number into a new invoice before the insert
+            assert (await create_invoice(api, numbers[0])).status_code == 201
+        return numbers
+
+    monkeypatch.setattr(server, "next_invoice_numbers", racing)
+    numbers = await convert(api, await create_quotations(api, 2))
+    assert numbers == [f"INV-{YEAR}-00003", f"INV-{YEAR}-00002"]
+    assert await server.db.invoices.count_documents({}) == 3
+
+
+async def test_duplicate_numbers_are_rejected(api):
+    assert (await create_invoice(api, "INV-1")).status_code == 201
+    assert (await create_invoice(api, "INV-1")).status_code == 409
+    quotation_id, = await create_quotations(api, 1)
+    response = await api.post(f"/api/quotations/{quotation_id}/convert", json={"invoice_number": "INV-1"})
+    assert response.status_code == 409
+    # The quotation was released and can still be converted
+    response = await api.post(f"/api/quotations/{quotation_id}/convert", json={"invoice_number": "INV-2"})
+    assert response.status_code == 201
+
+
+async def test_single_counter_moves_to_the_current_year(api):
+    await server.db.counters.insert_one({"_id": "invoice_number", "seq": 41})
+    await server.ensure_invoice_numbers()
+    assert await server.db.counters.find_one({"_id": "invoice_number"}) is None
+    assert await convert(api, await create_quotations(api, 1)) == [f"INV-{YEAR}-00042"]
+
+
+async def test_numbers_of_deleted_invoices_can_be_used_again(api):
+    deleted = (await create_invoice(api, "INV-7")).json()
+    assert (await api.delete(f"/api/invoices/{deleted['id']}")).status_code == 200
+    assert (await create_invoice(api, "INV-7")).status_code == 201
+    # The deleted invoice cannot come back while its number is taken
+    response = await api.post(f"/api/invoices/{deleted['id']}/restore")
+    assert response.status_code == 409
+    assert await server.db.invoices.count_documents({"id": deleted["id"], "deleted_at": {"$exists": True}}) == 1
+
+
+async def test_archived_invoices_cannot_be_restored_over_a_live_number(api):
+    await server.db.invoices_archive.insert_one({"id": "archived", "invoice_number": "INV-8", "archived_at": "2024-01-01"})
+    assert (await create_invoice(api, "INV-8")).status_code == 201
+    assert (await api.post("/api/invoices/archived/restore")).status_code == 409
+    assert await server.db.invoices_archive.count_documents({"id": "archived"}) == 1
+
+
+async def test_the_index_over_every_invoice_is_replaced(api):
+    await server.db.invoices.drop_index("invoice_number_1_deleted_at_1")
+    await server.db.invoices.create_index("invoice_number", unique=True)
+    await server.ensure_invoice_numbers()
+    indexes = await server.db.invoices.index_information()
+    assert "invoice_number_1" not in indexes
+    assert indexes["invoice_number_1_deleted_at_1"]["unique"]
@@ -0,0 +1,74 @@
+import io
+
+import pytest
+from pypdf import PdfReader
+
+import server
+from mail_merge import merge_letter, missing_fields, parse_recipients_csv
+
+pytestmark = pytest.mark.anyio
+
+
+def make_template(company_id: str) -> dict:
+    return {
+        "letter_number": "L-{{index}}", "company_id": company_id, "date": "2024-05-01", "subject": "Undangan {{event}}",
+        "recipient_name": "Bapak/Ibu", "content": "Dengan hormat {{recipient_name}}, kami mengundang Anda ke {{event}}.",
+        "signatories": [],
+    }
+
+
+def test_recipients_csv_skips_blank_rows_and_trims():
+    data = "﻿recipient_name , event\n Budi ,Rapat\n,\nSiti,Seminar\n".encode()
+    assert parse_recipients_csv(data) == [
+        {"recipient_name": "Budi", "event": "Rapat"},
+        {"recipient_name": "Siti", "event": "Seminar"},
+    ]
+
+
+def test_placeholders_some_recipient_cannot_fill_are_reported():
+    template = make_template("c")
+    assert missing_fields(template, [{"recipient_name": "Budi", "event": "Rapat"}]) == set()
+    assert missing_fields(template, [{"recipient_name": "Budi", "event": "Rapat"}, {"recipient_name": "Siti"}]) == {"event"}
+
+
+def test_merged_letters_escape_recipient_values():
+    letter = merge_letter(make_template("c"), {"recipient_name": "A & B <Co>", "event": "Rapat"}, 3)
+    assert letter["letter_number"] == "L-3"
+    assert letter["recipient_name"] == "A &amp; B &lt;Co&gt;"
+    assert letter["content"] == "Dengan hormat A &amp; B &lt;Co&gt;, kami mengundang Anda ke Rapat."
+    assert letter["subject"] == "Undangan Rapat" and letter["id"] == "merge-3"
+
+
+async def test_merge_renders_one_pdf_for_all_recipients(api, make_company):
+    company = make_company()
+    await server.db.companies.insert_one(dict(company))
+    recipients = [{"recipient_name": "Budi", "event": "Rapat"}, {"recipient_name": "Siti", "event": "Seminar"}]
+    response = await api.post("/api/letters/mail-merge", json={"letter": make_template(company["id"]), "recipients": recipients})
+    assert response.status_code == 200 and response.headers["content-type"] == "application/pdf"
+    assert len(PdfReader(io.BytesIO(response.content)).pages) >= 2
+
+
+async def test_missing_fields_and_companies_are_rejected(api, make_company):
+    company = make_company()
+    await server.db.companies.insert_one(dict(company))
+    response = await api.post("/api/letters/mail-merge", json={"letter": make_template(company["id"]), "recipients": [{"recipient_name": "Budi"}]})
+    assert response.status_code == 422 and "event" in response.json()["detail"]
+    response = await api.post("/api/letters/mail-merge", json={"letter": make_template("missing"), "recipients": [{"recipient_name": "Budi", "event": "Rapat"}]})
+    assert response.status_code == 404
+
+
+async def test_merged_pdfs_are_cached_and_sent_uncompressed(api, make_company):
+    company = make_company()
+    await server.db.companies.insert_one(dict(company))
+    merge = {"letter": make_template(company["id"]), "recipients": [{"recipient_name": f"Penerima {n}", "event": "Rapat"} for n in range(20)]}
+    first = await api.post("/api/letters/mail-merge", json=merge, headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200 and "content-encoding" not in first.headers
+    assert first.headers["content-length"] == str(len(first.content))
+    assert first.headers["content-disposition"] == "attachment; filename=mail_merge_20.pdf"
+
+    again = await api.post("/api/letters/mail-merge", json=merge, headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+    other = await api.post("/api/letters/mail-merge", json={**merge, "recipients": merge["recipients"][:1]})
+    assert other.headers["etag"] != first.headers["etag"]
+    metrics = (await api.get("/metrics")).text
+    assert 'pdf_cache_requests_total{document="mail_merge",result="hit"} 1' in metrics
@@ -0,0 +1,35 @@
+import pytest
+
+from metrics import Histogram, Registry, StageTimer
+
+pytestmark = pytest.mark.anyio
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram("render_seconds", "Render time.", ["document"], buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(seconds, "letter")
+    lines = registry.render().splitlines()
+    assert 'render_seconds_bucket{document="letter",le="0.1"} 1' in lines
+    assert 'render_seconds_bucket{document="letter",le="1.0"} 3' in lines
+    assert 'render_seconds_bucket{document="letter",le="+Inf"} 4' in lines
+    assert 'render_seconds_count{document="letter"} 4' in lines
+
+
+def test_stage_timer_subtracts_nested_stages():
+    histogram = Histogram("stage_seconds", "Stages.", ["document", "stage"], buckets=(1.0,))
+    timer = StageTimer(histogram, "invoice")
+    timer.lap("build", nested={"images": 5.0})
+    lines = histogram.render().splitlines()
+    # The nested stage is recorded on its own, not also inside "build"
+    assert 'stage_seconds_bucket{document="invoice",stage="images",le="1.0"} 0' in lines
+    assert 'stage_seconds_bucket{document="invoice",stage="build",le="1.0"} 1' in lines
+
+
+async def test_requests_are_counted_by_route_template(api):
+    response = await api.get("/api/items/missing-item")
+    assert response.status_code == 404
+    metrics = (await api.get("/metrics")).text
+    assert 'http_requests_total{method="GET",route="/api/items/{item_id}",status="404"}' in metrics
+    assert "missing-item" not in metrics
@@ -0,0 +1,37 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import ReadPreference
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def test_client_options_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "20")
+    monkeypatch.setenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "250")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zstd,zlib")
+    options = server.mongo_client_options()
+    assert options["maxPoolSize"] == 20 and options["minPoolSize"] == 0
+    assert options["waitQueueTimeoutMS"] == 250 and options["compressors"] == "zstd,zlib"
+    # Unset timeouts are left to the driver rather than passed as 0
+    assert options["timeoutMS"] is None and options["maxIdleTimeMS"] is None
+
+
+def test_defaults_leave_optional_settings_out(monkeypatch):
+    for name in ("MONGO_WAIT_QUEUE_TIMEOUT_MS", "MONGO_COMPRESSORS", "MONGO_MAX_POOL_SIZE"):
+        monkeypatch.delenv(name, raising=False)
+    options = server.mongo_client_options()
+    assert options["maxPoolSize"] == 100
+    assert "waitQueueTimeoutMS" not in options and "compressors" not in options
+
+
+async def test_list_reads_use_the_configured_read_preference(monkeypatch, tmp_path):
+    monkeypatch.setenv("MONGO_LIST_READ_PREFERENCE", "secondaryPreferred")
+    monkeypatch.setenv("MONGO_LIST_MAX_TIME_MS", "2500")
+    monkeypatch.setenv("PDF_CACHE_DIR", str(tmp_path))
+    app = server.create_app(mongo_client=AsyncMongoMockClient())
+    async with app.router.lifespan_context(app):
+        assert server.list_reads("invoices").read_preference == ReadPreference.SECONDARY_PREFERRED
+        assert server.db.invoices.read_preference == ReadPreference.PRIMARY
+        assert server.LIST_MAX_TIME_MS == 2500
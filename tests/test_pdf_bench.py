@@ -0,0 +1,12 @@
+import subprocess
+import sys
+from pathlib import Path
+
+BENCH = Path(__file__).resolve().parent.parent / "benchmarks" / "pdf_bench.py"
+
+
+def test_compare_without_a_baseline_says_how_to_make_one(tmp_path):
+    result = subprocess.run([sys.executable, str(BENCH), "--compare", str(tmp_path / "missing.json")],
+                            capture_output=True, text=True)
+    assert result.returncode == 2
+    assert "--save-baseline" in result.stderr and "Traceback" not in result.stderr
@@ -0,0 +1,10 @@
+import pdf_cache
+from pdf_cache import PdfCache
+
+
+def test_key_changes_with_the_renderer(monkeypatch):
+    document, company = {"id": "doc", "revision": 3}, {"revision": 2}
+    key = PdfCache.key("invoice", document, company)
+    assert key.startswith("invoice-doc-r3-c2-")
+    monkeypatch.setattr(pdf_cache, "RENDERER_VERSION", "next")
+    assert PdfCache.key("invoice", document, company) != key
@@ -0,0 +1,39 @@
+import io
+
+import pytest
+from pypdf import PdfReader
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_documents_are_merged_in_order_with_bookmarks(api, make_company, make_invoice, make_letter):
+    company = make_company()
+    invoice, letter = make_invoice(company, 1), make_letter(company, 2)
+    await server.db.companies.insert_one(dict(company))
+    await server.db.invoices.insert_one(dict(invoice))
+    await server.db.letters.insert_one(dict(letter))
+    response = await api.post("/api/pdf/merge", json={"filename": "bundel mei", "documents": [
+        {"kind": "letter", "id": letter["id"]},
+        {"kind": "invoice", "id": invoice["id"], "title": "Tagihan"},
+    ]})
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == "attachment; filename=bundel_mei.pdf"
+    reader = PdfReader(io.BytesIO(response.content))
+    assert [item.title for item in reader.outline] == ["Letter L-2 - Penawaran", "Tagihan"]
+
+
+async def test_empty_and_unresolved_merges_are_rejected(api):
+    assert (await api.post("/api/pdf/merge", json={"documents": []})).status_code == 400
+    response = await api.post("/api/pdf/merge", json={"documents": [{"kind": "invoice", "id": "missing"}]})
+    assert response.status_code == 404 and response.json()["detail"] == "Documents not found: invoice missing"
+
+
+async def test_deleted_documents_are_not_merged(api, make_company, make_invoice):
+    company = make_company()
+    invoice = make_invoice(company, 1)
+    await server.db.companies.insert_one(dict(company))
+    await server.db.invoices.insert_one({**invoice, "deleted_at": "2024-06-01T00:00:00+00:00"})
+    response = await api.post("/api/pdf/merge", json={"documents": [{"kind": "invoice", "id": invoice["id"]}]})
+    assert response.status_code == 404
@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pdf_render
+
+
+def test_letterhead_is_shared_across_render_threads(make_company, make_invoice, make_letter):
+    """Renders of one company on many threads share its cached letterhead layout."""
+    company = make_company()
+    jobs = [("letter", make_letter(company, n)) if n % 2 else ("invoice", make_invoice(company, n)) for n in range(400)]
+
+    def render(job):
+        kind, document = job
+        return pdf_render.render_document(kind, document, company)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        pdfs = list(pool.map(render, jobs))
+
+    assert all(pdf.startswith(b"%PDF") for pdf in pdfs)
+    # Every render defines its own copy of the letterhead form
+    assert all(pdf.count(b"/Subtype /Form") >= 1 for pdf in pdfs)
+
+
+def test_letterhead_follows_company_revision(make_company, make_letter):
+    company = make_company(name="PT Lama")
+    letter = make_letter(company, 1)
+    old = pdf_render.render_letter(letter, company)
+    new = pdf_render.render_letter(letter, {**company, "name": "PT Baru", "revision": 2})
+    assert old != new
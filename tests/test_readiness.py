@@ -0,0 +1,36 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_ready_waits_for_the_pdf_warm_up(monkeypatch, tmp_path):
+    warmed = threading.Event()
+
+    def warm_up():
+        warmed.wait(10)
+        return {"invoice": 0.01}
+
+    monkeypatch.setattr(server, "_warm_up_pdf", warm_up)
+    monkeypatch.setenv("WARMUP_ON_STARTUP", "1")
+    monkeypatch.setenv("PDF_CACHE_DIR", str(tmp_path))
+    app = server.create_app(mongo_client=AsyncMongoMockClient())
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            assert (await client.get("/api/health")).status_code == 200
+            assert (await client.get("/api/ready")).status_code == 503
+            # CRUD is served during the warm-up
+            assert (await client.get("/api/items")).status_code == 200
+            warmed.set()
+            for _ in range(100):
+                if app.state.ready:
+                    break
+                await asyncio.sleep(0.01)
+            response = await client.get("/api/ready")
+            assert response.status_code == 200 and response.json() == {"status": "ready"}
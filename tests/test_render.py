@@ -0,0 +1,33 @@
+import argparse
+
+import mongomock
+
+import render
+
+
+def rendered_ids(db, checkpoint, include_archived: bool = False, year: int = None) -> list:
+    args = argparse.Namespace(query=None, year=year)
+    chunks = render.iter_jobs(db, "invoices", render.build_query(args), checkpoint, 10, include_archived)
+    return sorted(document["id"] for chunk in chunks for document, _ in chunk)
+
+
+def test_render_skips_deleted_and_reads_the_archive_on_request(tmp_path):
+    db = mongomock.MongoClient()["test_render"]
+    db.companies.insert_one({"id": "company", "name": "PT Contoh"})
+    db.invoices.insert_many([
+        {"id": "live", "company_id": "company", "date": "2024-05-01"},
+        {"id": "deleted", "company_id": "company", "date": "2024-05-02", "deleted_at": "2024-06-01T00:00:00+00:00"},
+        {"id": "other-year", "company_id": "company", "date": "2023-05-01"},
+    ])
+    db.invoices_archive.insert_many([
+        {"id": "archived", "company_id": "company", "date": "2024-01-01", "archived_at": "2025-01-01T00:00:00+00:00"},
+        {"id": "archived-deleted", "company_id": "company", "date": "2024-01-02", "deleted_at": "2024-02-01T00:00:00+00:00"},
+    ])
+    checkpoint = render.Checkpoint(tmp_path / "checkpoint", restart=False)
+
+    assert rendered_ids(db, checkpoint) == ["live", "other-year"]
+    assert rendered_ids(db, checkpoint, year=2024) == ["live"]
+    assert rendered_ids(db, checkpoint, include_archived=True, year=2024) == ["archived", "live"]
+    archived = next(render.iter_jobs(db, "invoices", render.build_query(argparse.Namespace(query='{"id": "archived"}', year=None)),
+                                     checkpoint, 10, include_archived=True))
+    assert "archived_at" not in archived[0][0]
@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from history import load_version
+from repricing import reprice_drafts
+
+pytestmark = pytest.mark.anyio
+
+
+class PreviewedCollection:
+    """Stands in for a collection whose preview sees `previewed` revisions while
+    the stored documents are at `current` ones (the in-memory MongoDB has no
+    pipeline updates)."""
+
+    def __init__(self, previewed: dict, current: dict):
+        self.previewed = previewed
+        self.documents = {doc_id: {"id": doc_id, "revision": revision, "total": 100} for doc_id, revision in current.items()}
+        self.aggregate_options = None
+        self.operations = []
+
+    @property
+    def current(self) -> dict:
+        return {doc_id: document["revision"] for doc_id, document in self.documents.items()}
+
+    def aggregate(self, pipeline, **options):
+        self.aggregate_options = options
+        documents = [{"id": doc_id, "number": doc_id.upper(), "revision": revision, "old_total": 100, "new_total": 120}
+                     for doc_id, revision in self.previewed.items()]
+        return SimpleNamespace(to_list=lambda length: _value(documents))
+
+    async def bulk_write(self, operations, ordered=True):
+        self.operations = operations
+        matched = 0
+        for operation in operations:
+            query, update = operation._filter, operation._doc
+            document = self.documents[query["id"]]
+            if document["revision"] == query["revision"]:
+                self.documents[query["id"]] = {**document, **update[-1]["$set"], "total": 120}
+                matched += 1
+        return SimpleNamespace(matched_count=matched, modified_count=matched)
+
+    async def find(self, query, projection):
+        wanted = query["$or"] if "$or" in query else [{"id": doc_id, "revision": query["revision"]} for doc_id in query["id"]["$in"]]
+        for match in wanted:
+            document = self.documents.get(match["id"])
+            if document is not None and document["revision"] == match["revision"]:
+                yield dict(document)
+
+    async def find_one(self, query, projection):
+        async for document in self.find({"$or": [query]}, projection):
+            return document
+        return None
+
+
+class FakeDb(dict):
+    """The repriced collections, with an in-memory history collection."""
+
+    def __init__(self, **collections):
+        super().__init__(collections)
+        self.history = AsyncMongoMockClient()["repricing"].history
+
+
+async def _value(value):
+    return value
+
+
+async def test_documents_changed_since_the_preview_are_left_alone():
+    invoices = PreviewedCollection({"a": 3, "b": 4}, {"a": 3, "b": 7})
+    quotations = PreviewedCollection({}, {})
+    db = FakeDb(invoices=invoices, quotations=quotations)
+    report = await reprice_drafts(db, {"item": 120}, {"revision": 10, "updated_at": "now"}, max_time_ms=5000)
+
+    assert invoices.aggregate_options == {"maxTimeMS": 5000}
+    assert [(operation._filter["id"], operation._filter["revision"]) for operation in invoices.operations] == [("a", 3), ("b", 4)]
+    assert all(operation._filter["status"] == "draft" for operation in invoices.operations)
+    assert [document["id"] for document in report["invoices"]["documents"]] == ["a"]
+    assert [document["id"] for document in report["invoices"]["conflicts"]] == ["b"]
+    assert invoices.current == {"a": 10, "b": 7}
+    assert report["quotations"] == {"matched": 0, "modified": 0, "documents": [], "conflicts": []}
+
+    # The repriced document's previous version is kept in its history
+    assert await load_version(db, "invoices", "a", 3) == {"id": "a", "revision": 3, "total": 100}
+    assert await load_version(db, "invoices", "a", 10) == {"id": "a", "revision": 10, "total": 120, "updated_at": "now"}
+    assert await load_version(db, "invoices", "b", 4) is None
+
+
+async def test_dry_run_only_previews():
+    invoices = PreviewedCollection({"a": 3}, {"a": 3})
+    report = await reprice_drafts(FakeDb(invoices=invoices, quotations=PreviewedCollection({}, {})), {"item": 120}, {}, dry_run=True)
+    assert invoices.operations == [] and invoices.aggregate_options == {}
+    assert [document["id"] for document in report["invoices"]["documents"]] == ["a"]
@@ -0,0 +1,17 @@
+import json
+import subprocess
+import sys
+
+from tests.conftest import BACKEND_DIR
+
+PROBE = """
+import json, sys
+import server
+server.create_app()
+print(json.dumps(sorted({name.split(".")[0] for name in sys.modules} & {"reportlab", "PIL", "motor", "pdf_render"})))
+"""
+
+
+def test_heavy_packages_load_on_first_use():
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout
+    assert json.loads(output.splitlines()[-1]) == []
@@ -0,0 +1,87 @@
+import base64
+import importlib.util
+import io
+
+import pytest
+from PIL import Image
+
+import server
+import thumbnails
+from thumbnails import ThumbnailCache
+
+pytestmark = pytest.mark.anyio
+
+
+def test_cache_evicts_least_recently_used_past_its_size():
+    cache = ThumbnailCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+    assert cache.get("b") is None and cache.get("a") == b"1234" and cache.get("c") == b"1234"
+
+
+def test_rasterizer_is_looked_up_without_importing_it(monkeypatch):
+    looked_up = []
+
+    def find_spec(name):
+        looked_up.append(name)
+        return None
+
+    thumbnails.rasterizer_available.cache_clear()
+    monkeypatch.setattr(importlib.util, "find_spec", find_spec)
+    try:
+        assert thumbnails.rasterizer_available() is False
+        assert thumbnails.rasterizer_available() is False
+    finally:
+        thumbnails.rasterizer_available.cache_clear()
+    assert looked_up == ["fitz"]
+
+
+async def test_thumbnails_are_revalidated_by_document_revision(api, make_company, make_invoice):
+    company = make_company()
+    invoice = {**make_invoice(company, 1), "revision": 1}
+    await server.db.companies.insert_one(dict(company))
+    await server.db.invoices.insert_one(dict(invoice))
+    url = f"/api/invoices/{invoice['id']}/thumbnail?width=120"
+
+    response = await api.get(url)
+    assert response.status_code == 200 and response.headers["content-type"] == "image/webp"
+    assert Image.open(io.BytesIO(response.content)).width == 120
+    etag = response.headers["etag"]
+    revalidated = await api.get(url, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.headers["etag"] == etag
+
+    await server.db.invoices.update_one({"id": invoice["id"]}, {"$set": {"revision": 2}})
+    changed = await api.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+
+async def test_unknown_collections_and_formats_are_rejected(api, make_company, make_invoice):
+    assert (await api.get("/api/companies/x/thumbnail")).status_code == 404
+    company = make_company()
+    invoice = make_invoice(company, 1)
+    await server.db.companies.insert_one(dict(company))
+    await server.db.invoices.insert_one(dict(invoice))
+    assert (await api.get(f"/api/invoices/{invoice['id']}/thumbnail?format=gif")).status_code == 400
+
+
+async def test_batch_keeps_request_order_and_lists_missing(api, make_company, make_invoice, make_letter):
+    company = make_company()
+    invoice, letter = make_invoice(company, 1), make_letter(company, 2)
+    await server.db.companies.insert_one(dict(company))
+    await server.db.invoices.insert_one(dict(invoice))
+    await server.db.letters.insert_one(dict(letter))
+    response = await api.post("/api/thumbnails", json={"width": 80, "format": "png", "documents": [
+        {"kind": "letter", "id": letter["id"]},
+        {"kind": "quotation", "id": "missing"},
+        {"kind": "invoice", "id": invoice["id"]},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert [(thumbnail["kind"], thumbnail["id"]) for thumbnail in body["thumbnails"]] == [("letter", letter["id"]), ("invoice", invoice["id"])]
+    assert body["missing"] == [{"kind": "quotation", "id": "missing"}]
+    prefix = "data:image/png;base64,"
+    image = body["thumbnails"][0]["image"]
+    assert image.startswith(prefix)
+    assert Image.open(io.BytesIO(base64.b64decode(image[len(prefix):]))).size[0] == 80